@@ -0,0 +1,190 @@
+"""
+answer_cache.py
+
+Caché semántico de respuestas para el flujo RAG del chat.
+
+Una respuesta guardada se reutiliza cuando llega una pregunta casi idéntica:
+mismo perfil, mismo modelo, mismos fragmentos recuperados, mismo resumen de
+la conversación previa (memoria) y similitud coseno
+entre embeddings de la pregunta por encima de un umbral. Las entradas
+expiran por TTL, se desalojan por LRU y se invalidan por completo cuando
+cambia la versión del vectorstore.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_MAX_ENTRIES = 2000
+
+
+def profile_key(profile: dict) -> str:
+    """
+    Hash estable de un perfil: cualquier cambio en sus campos cambia la clave.
+    """
+    payload = json.dumps(profile, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def doc_key(doc) -> str:
+    """
+    Identificador de un fragmento recuperado: su id en el docstore o, si no
+    lo tiene, un hash de su contenido.
+    """
+    if getattr(doc, "id", None):
+        return str(doc.id)
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Caché
+# ───────────────────────────────────────────────────────────────────────────────
+class AnswerCache:
+    """
+    Caché en memoria, compartido por todas las sesiones del proceso.
+
+    Las entradas se agrupan por (perfil, modelo, fragmentos recuperados); la
+    búsqueda semántica es un producto matricial sobre los vectores
+    normalizados del grupo, que suele tener muy pocas entradas.
+    """
+    def __init__(self,
+                 threshold: float = DEFAULT_THRESHOLD,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # id → (bucket, vector, respuesta, creado)
+        self._buckets = {}              # bucket → [id, ...]
+        self._version = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _bucket(profile: dict, model: str, chunk_ids: list[str], memory: str) -> tuple:
+        # La memoria va al prompt: dos conversaciones distintas no comparten respuesta
+        memory_key = hashlib.sha256(memory.encode("utf-8")).hexdigest() if memory else ""
+        return profile_key(profile), model, tuple(chunk_ids), memory_key
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype="float32")
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _check_version(self, corpus_version: str):
+        """
+        Invalida todo si cambió el vectorstore. Requiere el lock.
+        """
+        if corpus_version != self._version:
+            self._entries.clear()
+            self._buckets.clear()
+            self._version = corpus_version
+
+    def _drop(self, entry_id: int):
+        bucket = self._entries.pop(entry_id)[0]
+        ids = self._buckets.get(bucket, [])
+        ids.remove(entry_id)
+        if not ids:
+            self._buckets.pop(bucket, None)
+
+    def lookup(self, profile: dict, model: str, query_vector,
+               chunk_ids: list[str], corpus_version: str, memory: str = ""):
+        """
+        Devuelve la respuesta guardada más parecida o None.
+        """
+        bucket = self._bucket(profile, model, chunk_ids, memory)
+        query = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            self._check_version(corpus_version)
+            ids = list(self._buckets.get(bucket, ()))
+            for entry_id in ids:
+                if now - self._entries[entry_id][3] > self.ttl_seconds:
+                    self._drop(entry_id)
+            ids = self._buckets.get(bucket, [])
+            if ids:
+                sims = np.stack([self._entries[i][1] for i in ids]) @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return self._entries[ids[best]][2]
+            self.misses += 1
+            return None
+
+    def store(self, profile: dict, model: str, query_vector,
+              chunk_ids: list[str], corpus_version: str, answer: str, memory: str = ""):
+        """
+        Guarda una respuesta; desaloja la menos usada si se supera el límite.
+        """
+        if not answer:
+            return
+        bucket = self._bucket(profile, model, chunk_ids, memory)
+        vector = self._normalize(query_vector)
+        with self._lock:
+            self._check_version(corpus_version)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (bucket, vector, answer, time.time())
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, profile: dict = None):
+        """
+        Elimina las entradas de un perfil, o todas si `profile` es None.
+        """
+        with self._lock:
+            if profile is None:
+                self._entries.clear()
+                self._buckets.clear()
+                return
+            key = profile_key(profile)
+            for entry_id in [i for i, e in self._entries.items() if e[0][0] == key]:
+                self._drop(entry_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Instancia única del caché para todo el proceso.
+    """
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Reproducción
+# ───────────────────────────────────────────────────────────────────────────────
+def replay_chunks(answer: str, chunk_words: int = 8):
+    """
+    Trozos de `chunk_words` palabras de una respuesta guardada, como si
+    llegaran del LLM en streaming.
+    """
+    words = answer.split(" ")
+    for i in range(0, len(words), chunk_words):
+        piece = " ".join(words[i:i + chunk_words])
+        if i + chunk_words < len(words):
+            piece += " "
+        yield piece
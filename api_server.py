@@ -0,0 +1,332 @@
+"""
+api_server.py
+
+API HTTP del asistente (sin Streamlit), para bots de WhatsApp/Instagram u
+otros clientes, sobre el mismo motor que la app (engine.py):
+
+  POST /v1/chat   {"question", "user"?, "profile"?, "model"?, "memory"?,
+                   "context"?: [str], "sources"?: [libro], "stream"?: true}
+                  Con stream (por defecto) responde en SSE:
+                    event: meta   {"turn_id", "cached", "sources"}
+                    event: token  {"text"}            (uno por token)
+                    event: done   {"ttft_s", "tokens", "tokens_per_s", "total_s", "context_tokens"}
+                    event: error  {"error"}
+                  Sin stream, un JSON con "answer" y los mismos metadatos.
+  GET  /healthz   estado del worker y vectores cargados.
+  GET  /metrics   métricas Prometheus del worker (metrics.py).
+
+El servidor es asíncrono (aiohttp): la recuperación corre en hilos y el
+streaming del LLM se consume sin bloquear el event loop, así un worker
+atiende muchas conversaciones a la vez. Con --workers N se lanzan N procesos
+que comparten el puerto (SO_REUSEPORT); cada uno mapea el mismo índice FAISS
+(VECTORSTORE_MMAP=1), de modo que las páginas del índice se comparten en la
+caché del sistema operativo en lugar de copiarse por proceso.
+
+El perfil de cada conversación llega en la petición ("profile") o se lee del
+almacén de perfiles por email ("user"); leer el perfil de un usuario exige
+su token personal en `X-User-Token` (profile_store.user_link_token, el mismo
+de los enlaces firmados de la app). Configuración por entorno:
+OPENAI_API_KEY, OPENAI_BASE_URL, EMBEDDING_BACKEND, EMBEDDING_MODEL y las
+VECTORSTORE_* / CONTEXT_MAX_TOKENS de la app; CHAT_API_TOKEN exige
+`Authorization: Bearer <token>` y es obligatorio si el servidor escucha
+fuera de localhost (--host).
+
+Uso:
+    python api_server.py --port 8080 --workers 4
+    CHAT_API_TOKEN=... python api_server.py --host 0.0.0.0 --port 8080
+    curl -N localhost:8080/v1/chat -H "X-User-Token: <token>" \
+         -d '{"question": "ideas para reels", "user": "ana@pyme.com"}'
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+
+from aiohttp import web
+
+from callbacks import StreamlitUICallbackHandler
+from context_assembler import DEFAULT_MAX_CONTEXT_TOKENS, ranked
+from embedding_backends import DEFAULT_BACKEND, make_embeddings
+from embedding_cache import CachedEmbeddings
+from engine import DEFAULT_MODEL, ChatEngine
+from llm_backend import get_llm_backend
+from metrics import get_metrics_registry, start_turn
+from profile_store import get_profile_store, user_link_token
+from rerank import reranker_from_env
+from vectorstore import UnknownSourceError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+MAX_QUESTION_CHARS = 4_000
+MAX_CONTEXT_ITEMS = 8
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Motor del worker
+# ───────────────────────────────────────────────────────────────────────────────
+def _env_int(name: str) -> int | None:
+    return int(os.getenv(name) or 0) or None
+
+
+def engine_from_env() -> ChatEngine:
+    """
+    ChatEngine configurado con las mismas variables de entorno que la app.
+
+    Raises:
+      ValueError: si falta OPENAI_API_KEY.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Define OPENAI_API_KEY para el servidor de la API")
+    base_url = os.getenv("OPENAI_BASE_URL") or None
+    backend = os.getenv("EMBEDDING_BACKEND") or DEFAULT_BACKEND
+    embeddings = CachedEmbeddings(make_embeddings(backend, os.getenv("EMBEDDING_MODEL"),
+                                                  api_key=api_key, base_url=base_url))
+    return ChatEngine(
+        embeddings,
+        get_llm_backend(api_key, base_url=base_url),
+        vs_path=os.getenv("VECTORSTORE_PATH") or None,
+        mmap=os.getenv("VECTORSTORE_MMAP", "1") == "1",
+        nprobe=_env_int("VECTORSTORE_NPROBE"),
+        ef_search=_env_int("VECTORSTORE_EF_SEARCH"),
+        max_context_tokens=_env_int("CONTEXT_MAX_TOKENS") or DEFAULT_MAX_CONTEXT_TOKENS,
+        reranker=reranker_from_env(),
+    )
+
+
+async def _startup(app: web.Application):
+    engine = engine_from_env()
+    # Carga (o mapea) el índice y verifica los embeddings antes de aceptar peticiones
+    await asyncio.to_thread(engine.vectorstore)
+    app["engine"] = engine
+    logger.info("Worker %d listo", os.getpid())
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Handlers
+# ───────────────────────────────────────────────────────────────────────────────
+def _parse_request(body) -> dict:
+    """
+    Valida el cuerpo de /v1/chat.
+
+    Raises:
+      ValueError: con el motivo, si el cuerpo no es válido.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("El cuerpo debe ser un objeto JSON")
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("Falta 'question'")
+    if len(question) > MAX_QUESTION_CHARS:
+        raise ValueError(f"'question' supera {MAX_QUESTION_CHARS} caracteres")
+    profile = body.get("profile")
+    if profile is not None and not isinstance(profile, dict):
+        raise ValueError("'profile' debe ser un objeto")
+    user = body.get("user") or ""
+    if not isinstance(user, str):
+        raise ValueError("'user' debe ser un email")
+    context = body.get("context") or []
+    if not isinstance(context, list) or not all(isinstance(c, str) for c in context):
+        raise ValueError("'context' debe ser una lista de textos")
+    sources = body.get("sources")
+    if sources is not None and (not isinstance(sources, list) or not all(isinstance(x, str) for x in sources)):
+        raise ValueError("'sources' debe ser una lista de libros")
+    return {
+        "question": question.strip(),
+        "profile": profile,
+        "user": user.strip(),
+        "model": str(body.get("model") or DEFAULT_MODEL),
+        "memory": str(body.get("memory") or ""),
+        "context": context[:MAX_CONTEXT_ITEMS],
+        "sources": sources,
+        "stream": bool(body.get("stream", True)),
+    }
+
+
+def _authorized(request: web.Request) -> bool:
+    token = os.getenv("CHAT_API_TOKEN")
+    return not token or hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+
+
+def _user_authorized(request: web.Request, user: str) -> bool:
+    """
+    True si la petición trae el token personal de `user` en X-User-Token:
+    el token del servicio no basta para leer el perfil de cualquier email.
+    """
+    try:
+        expected = user_link_token(user)
+    except ValueError:
+        logger.warning("Perfil de %s denegado: falta USER_LINK_SECRET", user)
+        return False
+    return hmac.compare_digest(request.headers.get("X-User-Token", ""), expected)
+
+
+def _load_profile(user: str) -> dict:
+    # Lectura del almacén de perfiles (E/S de disco): se llama en un hilo
+    profile = get_profile_store().get(user)
+    profile.pop("user", None)
+    return profile
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def chat(request: web.Request) -> web.StreamResponse:
+    if not _authorized(request):
+        return web.json_response({"error": "No autorizado"}, status=401)
+    try:
+        params = _parse_request(await request.json())
+    except (ValueError, json.JSONDecodeError) as exc:
+        return web.json_response({"error": str(exc)}, status=400)
+    if params["profile"] is None:
+        if params["user"] and not _user_authorized(request, params["user"]):
+            return web.json_response({"error": "Token de usuario inválido"}, status=403)
+        params["profile"] = await asyncio.to_thread(_load_profile, params["user"]) if params["user"] else {}
+
+    engine = request.app["engine"]
+    timer = start_turn()
+    pieces = ranked("Contexto del usuario", params["context"], weight=1.5) if params["context"] else []
+    try:
+        turn = await asyncio.to_thread(
+            engine.prepare, params["question"], params["profile"], params["model"],
+            extra_pieces=pieces, memory=params["memory"], use_cache=not pieces, sources=params["sources"],
+        )
+    except UnknownSourceError as exc:
+        return web.json_response({"error": str(exc)}, status=400)
+    except (ValueError, FileNotFoundError) as exc:
+        # Vectorstore ausente, a medio publicar o reconstruido con otros embeddings
+        logger.error("No se pudo preparar %s: %s", timer.turn_id, exc)
+        return web.json_response({"error": str(exc)}, status=503)
+    meta = {"turn_id": timer.turn_id, "cached": turn.cached is not None, "sources": turn.sources}
+    ui_metrics = StreamlitUICallbackHandler(timer)
+
+    if not params["stream"]:
+        ui_metrics.on_llm_start()
+        parts = []
+        async for tok in engine.astream(turn):
+            ui_metrics.on_llm_new_token(tok)
+            parts.append(tok)
+        ui_metrics.on_llm_end()
+        record = _finish(timer, turn, params)
+        return web.json_response({**meta, "answer": "".join(parts), **_summary(record, turn)})
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    await response.write(_sse("meta", meta))
+    ui_metrics.on_llm_start()
+    try:
+        async for tok in engine.astream(turn):
+            ui_metrics.on_llm_new_token(tok)
+            await response.write(_sse("token", {"text": tok}))
+    except ConnectionResetError:
+        # El cliente cerró la conexión; al salir del bucle se cancela el stream del LLM
+        logger.info("Cliente desconectado en %s", timer.turn_id)
+        return response
+    except Exception as exc:
+        logger.exception("Fallo en el streaming de %s", timer.turn_id)
+        await response.write(_sse("error", {"error": str(exc)}))
+        return response
+    ui_metrics.on_llm_end()
+    record = _finish(timer, turn, params)
+    await response.write(_sse("done", _summary(record, turn)))
+    await response.write_eof()
+    return response
+
+
+def _finish(timer, turn, params: dict) -> dict:
+    timer.set("mode", "api")
+    timer.set("model", params["model"])
+    timer.set("cached", turn.cached is not None)
+    timer.set("context_tokens", turn.context_tokens)
+    record = timer.record()
+    get_metrics_registry().observe_turn(record)
+    return record
+
+
+def _summary(record: dict, turn) -> dict:
+    return {
+        "ttft_s": record.get("ttft_s"),
+        "tokens": record.get("tokens"),
+        "tokens_per_s": record.get("tokens_per_s"),
+        "total_s": record["total_s"],
+        "context_tokens": turn.context_tokens,
+    }
+
+
+async def healthz(request: web.Request) -> web.Response:
+    engine = request.app.get("engine")
+    vectors = (await asyncio.to_thread(engine.vectorstore)).index.ntotal if engine is not None else 0
+    return web.json_response({"status": "ok", "pid": os.getpid(), "vectors": vectors})
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(text=get_metrics_registry().to_prometheus(),
+                        content_type="text/plain", charset="utf-8")
+
+
+def create_app() -> web.Application:
+    app = web.Application(client_max_size=1024 ** 2)
+    app.on_startup.append(_startup)
+    app.router.add_post("/v1/chat", chat)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 4) Workers
+# ───────────────────────────────────────────────────────────────────────────────
+def run_worker(host: str, port: int, reuse_port: bool = False):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(name)s: %(message)s")
+    web.run_app(create_app(), host=host, port=port, reuse_port=reuse_port,
+                access_log=None, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="interfaz de escucha; fuera de localhost exige CHAT_API_TOKEN")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="procesos que comparten el puerto (SO_REUSEPORT)")
+    args = parser.parse_args()
+    if args.host not in LOOPBACK_HOSTS and not os.getenv("CHAT_API_TOKEN"):
+        parser.error(f"Define CHAT_API_TOKEN para escuchar en {args.host} (sin token, solo localhost)")
+
+    if args.workers <= 1:
+        run_worker(args.host, args.port)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=run_worker, args=(args.host, args.port, True), name=f"api-worker-{i}")
+               for i in range(args.workers)]
+    for proc in workers:
+        proc.start()
+
+    def _stop(signum, frame):
+        for proc in workers:
+            proc.terminate()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    for proc in workers:
+        proc.join()
+
+
+if __name__ == "__main__":
+    main()
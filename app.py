@@ -11,31 +11,35 @@ Interfaz principal de Streamlit para EstrategIA MKT:
 # ───────────────────────────────────────────────────────────────────────────────
 # Librerías estándar
 import os
-import json
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # Librerías de terceros
 import streamlit as st
-import PyPDF2
-import pandas as pd
-from openai import OpenAI
-from langchain.chains import LLMChain
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate
-)
+from streamlit.logger import get_logger
 
-# Módulos propios
-from callbacks import StreamHandler
+# Módulos propios: solo los ligeros. langchain_core (callbacks, embeddings),
+# numpy (caché de respuestas), pandas (CSV), PyPDF2 (PDF), faiss (vectorstore),
+# las cadenas de LangChain y los SDK de OpenAI se importan en la ruta que los
+# usa, o en el hilo de precarga (`start_warmup`), para que el primer render
+# no espere por ellos.
+from context_assembler import DEFAULT_MAX_CONTEXT_TOKENS, ranked
 from utils import (
     enable_chat_history,
     display_msg,
+    scroll_to_end,
+    get_chat_history,
+    choose_model,
     configure_llm,
+    configure_llm_backend,
     configure_embedding_model,
+    get_embedding_config,
     get_openai_api_key,
+    get_openai_base_url,
     load_user_profile
 )
-from vectorstore import initialize_vectorstore
+from metrics import get_metrics_registry, start_turn
+
+logger = get_logger(__name__)
 
 
 # ───────────────────────────────────────────────────────────────────────────────
@@ -59,6 +63,135 @@ def load_css(path: str):
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 load_css(os.path.join(BASE_DIR, "assets", "style.css"))
 
+# Mapear el índice FAISS en memoria para compartir páginas entre workers
+VECTORSTORE_MMAP = os.getenv("VECTORSTORE_MMAP", "1") == "1"
+# Directorio del vectorstore (relativo a la app o absoluto); vacío = vectorstore.DEFAULT_VS_SUBPATH
+VECTORSTORE_PATH = os.getenv("VECTORSTORE_PATH") or None
+# Recall/latencia de índices aproximados (IVF: nprobe, HNSW: efSearch); vacío = valor del build
+VECTORSTORE_NPROBE = int(os.getenv("VECTORSTORE_NPROBE") or 0) or None
+VECTORSTORE_EF_SEARCH = int(os.getenv("VECTORSTORE_EF_SEARCH") or 0) or None
+# Tope de tokens de contexto (libros + PDF + CSV) por pregunta
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS") or DEFAULT_MAX_CONTEXT_TOKENS)
+# Panel de latencias en la sidebar (también con ?debug=1 en la URL)
+DEBUG_METRICS = os.getenv("DEBUG_METRICS", "0") == "1"
+# Juegos de LLMChains de generación rápida (uno por perfil y modelo) en memoria
+QUICK_CHAINS_CACHE_SIZE = 64
+
+
+def finish_turn(timer, **values):
+    """
+    Cierra la medición del turno: la exporta (Prometheus/JSONL, ver
+    metrics.py) y la guarda para el panel de depuración.
+    """
+    for name, value in values.items():
+        timer.set(name, value)
+    record = timer.record()
+    get_metrics_registry().observe_turn(record)
+    st.session_state["last_turn_metrics"] = record
+
+
+def _warm_up(vs_path: str | None, mmap: bool, api_key: str, base_url: str | None):
+    """
+    Precarga de la ruta de chat: módulos pesados (callbacks, cadenas,
+    embeddings), el backend de OpenAI del proceso y el índice, textos y BM25
+    del vectorstore en el registro del proceso.
+    """
+    from vectorstore import warm_vectorstore
+    warm_vectorstore(vs_path, mmap=mmap)
+
+    from llm_backend import get_llm_backend
+    get_llm_backend(api_key, base_url=base_url)
+    import engine  # noqa: F401  (numpy, caché de respuestas)
+    import callbacks  # noqa: F401  (langchain_core)
+    import langchain.chains  # noqa: F401  (generación rápida)
+    if get_embedding_config()[0] == "openai":
+        import langchain_openai  # noqa: F401
+
+
+def _log_warmup_error(future: Future):
+    if future.exception() is not None:
+        # No es fatal: la primera pregunta volverá a intentarlo y mostrará el error
+        logger.error("Falló la precarga de la ruta de chat: %s", future.exception())
+
+
+@st.cache_resource(show_spinner=False)
+def start_warmup(vs_path: str | None, mmap: bool, api_key: str, base_url: str | None) -> Future:
+    """
+    Lanza `_warm_up` en un hilo una sola vez por proceso, en el primer rerun
+    tras arrancar el servidor, sin bloquear el render.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warmup")
+    future = executor.submit(_warm_up, vs_path, mmap, api_key, base_url)
+    future.add_done_callback(_log_warmup_error)
+    executor.shutdown(wait=False)
+    return future
+
+
+def build_quick_chains(llm, profile: dict) -> dict:
+    """
+    LLMChains de generación rápida por modo ("guion", "calendario", "ideas"),
+    con el perfil fijado en el prompt de sistema.
+    """
+    from langchain.chains import LLMChain
+    from langchain.prompts import (
+        ChatPromptTemplate,
+        SystemMessagePromptTemplate,
+        HumanMessagePromptTemplate
+    )
+    from quick_prompts import QUICK_MODES, QUICK_PROMPTS
+
+    human = HumanMessagePromptTemplate.from_template("{input}")
+    return {
+        mode: LLMChain(llm=llm,
+                       prompt=ChatPromptTemplate.from_messages(
+                           [SystemMessagePromptTemplate.from_template(QUICK_PROMPTS[mode]), human]
+                       ).partial(**profile),
+                       verbose=False)
+        for mode in QUICK_MODES
+    }
+
+
+def configure_chat_engine():
+    """
+    Motor RAG (engine.py) con los embeddings y el backend de OpenAI
+    compartidos del proceso; crearlo en cada turno es barato.
+    """
+    from engine import ChatEngine
+    from rerank import reranker_from_env
+
+    return ChatEngine(configure_embedding_model(), configure_llm_backend(),
+                      vs_path=VECTORSTORE_PATH, mmap=VECTORSTORE_MMAP,
+                      nprobe=VECTORSTORE_NPROBE, ef_search=VECTORSTORE_EF_SEARCH,
+                      max_context_tokens=CONTEXT_MAX_TOKENS, reranker=reranker_from_env())
+
+
+@st.cache_resource(max_entries=QUICK_CHAINS_CACHE_SIZE, show_spinner=False)
+def get_quick_chains(profile_hash: str, model_name: str, _profile: dict) -> dict:
+    """
+    `build_quick_chains` cacheado por (hash del perfil, modelo): se construye
+    la primera vez que se usa guion/calendario/ideas con ese perfil y se
+    comparte entre reruns y sesiones. `_profile` no forma parte de la clave
+    (Streamlit no hashea los argumentos con guion bajo inicial).
+    """
+    return build_quick_chains(configure_llm(model_name), _profile)
+
+
+def render_debug_panel():
+    """
+    Desglose de tiempos del último turno en la sidebar.
+    """
+    record = st.session_state.get("last_turn_metrics")
+    with st.sidebar.expander("⏱️ Latencia del último turno", expanded=True):
+        if record is None:
+            st.caption("Aún no hay turnos medidos.")
+            return
+        rows = [{"etapa": name, "ms": round(sec * 1000, 1)} for name, sec in record["stages"].items()]
+        rows.append({"etapa": "total", "ms": round(record["total_s"] * 1000, 1)})
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        if record.get("ttft_s") is not None:
+            st.caption(f"TTFT {record['ttft_s'] * 1000:.0f} ms · {record.get('tokens', 0)} tokens"
+                       + (f" · {record['tokens_per_s']:.1f} tok/s" if record.get("tokens_per_s") else ""))
+
 
 # ───────────────────────────────────────────────────────────────────────────────
 # 3) Función principal
@@ -69,52 +202,24 @@ def main():
     Renderiza la aplicación, maneja el flujo de chat, 
     la generación rápida de contenido y la lógica RAG/PDF/CSV.
     """
+    # Medición de etapas del rerun; solo se exporta si hay turno de chat
+    timer = start_turn()
+
     # 3.1) Header con logo y título
     st.markdown("## 🤖 EstrategIA MKT")
 
-    # 3.2) Configurar LLM, embeddings y cliente OpenAI
-    llm      = configure_llm()
-    embedder = configure_embedding_model()
-    client   = OpenAI(api_key=get_openai_api_key())
+    # 3.2) Modelo elegido y precarga de la ruta de chat en segundo plano (una
+    #      vez por proceso); el resto de clientes se crea al primer uso
+    with timer.stage("setup"):
+        api_key = get_openai_api_key()  # sin API key, avisa y detiene la app
+        model_name = choose_model()
+    start_warmup(VECTORSTORE_PATH, VECTORSTORE_MMAP, api_key, get_openai_base_url())
 
     # 3.3) Cargar perfil de usuario
-    profile = load_user_profile()
-
-    # 3.4) Definir prompt templates y LLMChains para generación rápida
-    script_sys = SystemMessagePromptTemplate.from_template(
-        "Eres un guionista experto en marketing digital para PYMEs.\n"
-        "Estructura del guion de video:\n"
-        "1. Intro/Hook\n"
-        "2. Problema\n"
-        "3. Pasos con ejemplos\n"
-        "4. Conclusión y CTA\n"
-        "Perfil: {nombreNegocio}, producto estrella: {productoEstrella}, público: {publicoObjetivo}."
-    )
-    calendar_sys = SystemMessagePromptTemplate.from_template(
-        "Eres un planificador de contenido para PYMEs.\n"
-        "Calendario de 7 días con:\n"
-        "- Fecha (YYYY-MM-DD)\n- Plataforma\n- Tipo de contenido\n- CTA\n- Hora\n"
-        "Perfil: {nombreNegocio}, contenido: {tipoContenidoMarca}, frecuencia: {frecuenciaPublicacion}."
-    )
-    ideas_sys = SystemMessagePromptTemplate.from_template(
-        "Eres un creativo digital para PYMEs.\n"
-        "Sugiere 5 ideas de publicaciones:\n"
-        "- How-to\n- Listas\n- Preguntas abiertas\n- UGC\n- Citas motivacionales\n"
-        "Perfil: {nombreNegocio}, público: {publicoObjetivo}."
-    )
-    human = HumanMessagePromptTemplate.from_template("{input}")
+    with timer.stage("profile"):
+        profile = load_user_profile()
 
-    script_chain   = LLMChain(llm=llm,
-                              prompt=ChatPromptTemplate.from_messages([script_sys, human]).partial(**profile),
-                              verbose=False)
-    calendar_chain = LLMChain(llm=llm,
-                              prompt=ChatPromptTemplate.from_messages([calendar_sys, human]).partial(**profile),
-                              verbose=False)
-    ideas_chain    = LLMChain(llm=llm,
-                              prompt=ChatPromptTemplate.from_messages([ideas_sys, human]).partial(**profile),
-                              verbose=False)
-
-    # 3.5) Sidebar: perfil
+    # 3.4) Sidebar: perfil
     with st.sidebar.expander("Perfil", expanded=False):
         labels = {
             "nombreNegocio":      "Nombre de Negocio",
@@ -130,7 +235,7 @@ def main():
         for key, val in profile.items():
             st.write(f"**{labels.get(key, key)}:** {val}")
 
-    # 3.6) Sidebar: generación rápida
+    # 3.5) Sidebar: generación rápida
     st.sidebar.markdown("---")
     st.sidebar.markdown("### Generar Contenido")
     if st.sidebar.button("📝 Guion"):
@@ -140,7 +245,7 @@ def main():
     if st.sidebar.button("💡 Ideas"):
         st.session_state.mode = "ideas"
 
-    # 3.7) Sidebar: carga de documentos opcionales
+    # 3.6) Sidebar: carga de documentos opcionales
     st.sidebar.markdown("---")
     st.sidebar.markdown("### Documentos (opcional)")
     pdf_file    = st.sidebar.file_uploader("📄 Subir PDF", type="pdf")
@@ -148,81 +253,114 @@ def main():
     csv_file    = st.sidebar.file_uploader("📑 Subir CSV", type="csv")
     include_csv = st.sidebar.checkbox("Incluir CSV en contexto")
 
-    # 3.8) Inicializar vectorstore para RAG
-    vectorstore = initialize_vectorstore(embedding_model=embedder)
+    with timer.stage("uploads"):
+        # Extraer el PDF en segundo plano desde que se sube (una vez por archivo)
+        if pdf_file:
+            from pdf_context import submit_extraction
+            submit_extraction(pdf_file.getvalue())
+        # Perfilar el CSV en segundo plano (una vez por archivo)
+        if csv_file:
+            from csv_context import get_csv_profile
+            get_csv_profile(csv_file)
 
-    # 3.9) Mostrar historial existente sin duplicar
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    for msg in st.session_state.messages:
+    if DEBUG_METRICS or st.query_params.get("debug") == "1":
+        render_debug_panel()
+
+    # 3.7) Mostrar la ventana visible del historial (acotada: los mensajes
+    #      antiguos se archivan y resumen, ver chat_history.py)
+    history = get_chat_history()
+    if history.archived_count:
+        st.caption(f"🗂️ {history.archived_count} mensajes anteriores archivados"
+                   + (" (resumiendo…)" if history.summarizing else " y resumidos"))
+    for msg in history.messages:
         st.chat_message(msg["role"]).write(msg["content"])
 
-    # 3.10) Entrada de usuario y lógica de respuesta
+    # 3.8) Entrada de usuario y lógica de respuesta
     prompt_label = "🔊 Escribe tu pregunta"
     if st.session_state.get("mode"):
         prompt_label += f" para generar {st.session_state.mode}"
     user_input = st.chat_input(f"{prompt_label}:")
 
     if user_input:
+        from answer_cache import profile_key
+        from callbacks import StreamHandler, StreamlitUICallbackHandler
+        from chat_history import llm_summarizer
+
         display_msg(user_input, author="user")
+        scroll_to_end()
         handler = StreamHandler(st.empty())
 
-        # 3.10.1) Generación rápida vía prompt templates
+        # 3.8.1) Generación rápida vía prompt templates, en streaming
         mode = st.session_state.get("mode")
         if mode:
-            if mode == "guion":
-                resp = script_chain.run(input=user_input)
-            elif mode == "calendario":
-                resp = calendar_chain.run(input=user_input)
-            else:
-                resp = ideas_chain.run(input=user_input)
-            display_msg(resp, author="assistant")
+            with timer.stage("chains"):
+                chains = get_quick_chains(profile_key(profile), model_name, profile)
+            ui_metrics = StreamlitUICallbackHandler(timer)
+            with timer.stage("llm_chain"):
+                resp = chains.get(mode, chains["ideas"]).run(input=user_input,
+                                                              callbacks=[handler, ui_metrics])
+            handler.flush()
+            history.append("assistant", resp)
             del st.session_state.mode
+            finish_turn(timer, mode=mode, model=model_name)
 
-        # 3.10.2) Flujo normal: RAG + PDF + CSV
+        # 3.8.2) Flujo normal: RAG + PDF + CSV (pipeline en engine.py)
         else:
-            docs = vectorstore.similarity_search(user_input, k=4)
-            rag_ctx = "\n\n".join(d.page_content for d in docs)
+            with timer.stage("setup"):
+                engine = configure_chat_engine()
+            # Vectorstore compartido por el proceso y normalmente ya precargado;
+            # si la precarga sigue en curso, se espera a que termine
+            try:
+                engine.vectorstore()
+            except ValueError as exc:
+                # Embeddings distintos de los del índice: las búsquedas no tendrían sentido
+                st.error(f"⚠️ {exc}")
+                st.stop()
+            query_vec = engine.embed_query(user_input)
 
-            pdf_ctx = ""
+            # Piezas de contexto del usuario (van antes que los libros)
+            pieces = []
+            if include_csv and csv_file:
+                from csv_context import get_csv_profile
+                with timer.stage("csv_context"):
+                    pieces += ranked("CSV", [get_csv_profile(csv_file).context(wait=2.0)], weight=2.0)
             if include_pdf and pdf_file:
-                reader = PyPDF2.PdfReader(pdf_file)
-                pdf_ctx = "PDF:\n" + "\n".join(p.extract_text() or "" for p in reader.pages)
+                from pdf_context import get_pdf_index
+                with timer.stage("pdf_context"), st.spinner("Procesando PDF..."):
+                    pdf_index = get_pdf_index(st.session_state, pdf_file.getvalue(), engine.embeddings)
+                    pieces += ranked("PDF (pasajes relevantes)", pdf_index.passages(query_vec, k=4), weight=1.5)
 
-            csv_ctx = ""
-            if include_csv and csv_file:
-                df = pd.read_csv(csv_file)
-                cols   = ", ".join(df.columns)
-                sample = df.head(5).to_csv(index=False)
-                csv_ctx = f"CSV columnas: {cols}\nEjemplo filas:\n{sample}"
-
-            all_ctx = "\n\n".join(c for c in (pdf_ctx, csv_ctx, rag_ctx) if c)
-            system_msg = {
-                "role": "system",
-                "content": (
-                    "Eres un asistente de marketing digital para PYMEs.\n"
-                    f"Perfil completo:\n{json.dumps(profile, ensure_ascii=False, indent=2)}"
-                )
-            }
-            user_msg = {
-                "role": "user",
-                "content": f"Contexto:\n{all_ctx}\n\nPregunta: {user_input}"
-            }
-
-            full_resp = ""
-            stream = client.chat.completions.create(
-                model=llm.model_name,
-                messages=[system_msg, user_msg],
-                stream=True
-            )
-            for chunk in stream:
-                tok = chunk.choices[0].delta.content or ""
-                if tok:
-                    handler.on_llm_new_token(tok)
-                    full_resp += tok
-
-            st.session_state.messages.append({"role":"assistant","content":full_resp})
+            # Memoria conversacional: resumen (en segundo plano) de los turnos archivados
+            summarize = llm_summarizer(engine.backend, model_name)
+            history.refresh_summary(summarize)
+
+            # Caché semántico: solo cuando el contexto no incluye archivos del usuario
+            use_cache = not (include_pdf and pdf_file) and not (include_csv and csv_file)
+            turn = engine.prepare(user_input, profile, model_name, query_vector=query_vec,
+                                  extra_pieces=pieces, memory=history.memory(model=model_name),
+                                  use_cache=use_cache)
+            if turn.cached is not None:
+                with timer.stage("replay"):
+                    for piece in engine.stream(turn):
+                        handler.on_llm_new_token(piece)
+                    handler.flush()
+                history.append("assistant", turn.cached)
+                finish_turn(timer, mode="chat", model=model_name, cached=True)
+                return
+
+            # TTFT y tokens/s: StreamlitUICallbackHandler los registra en el timer
+            ui_metrics = StreamlitUICallbackHandler(timer)
+            ui_metrics.on_llm_start()
+            for tok in engine.stream(turn):
+                ui_metrics.on_llm_new_token(tok)
+                handler.on_llm_new_token(tok)
+            handler.flush()
+            ui_metrics.on_llm_end()
 
+            history.append("assistant", handler.text)
+            history.refresh_summary(summarize)
+            finish_turn(timer, mode="chat", model=model_name, cached=False,
+                        context_tokens=turn.context_tokens)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,272 @@
+"""
+batch_generate.py
+
+Generación por lotes de guiones, calendarios e ideas para todos los perfiles
+del almacén (profile_store.py), pensada para correr de noche:
+
+  1) Un trabajo por (usuario, modo) con los mismos prompts que la app
+     (quick_prompts.py).
+  2) Peticiones idénticas (perfiles con los mismos datos) se envían una sola
+     vez y la respuesta se reparte entre sus trabajos. Los trabajos se
+     ordenan por modo, así las peticiones consecutivas comparten el prefijo
+     del prompt de sistema (prompt caching del proveedor).
+  3) Concurrencia acotada y límites de peticiones y tokens por minuto
+     (cubetas de tokens), de modo que el ritmo lo marcan los límites de la
+     API; los 429 que aun así lleguen los reintenta llm_backend.py.
+  4) Salida JSONL, una línea por trabajo escrita al terminarlo. El mismo
+     archivo es el checkpoint: al relanzar con la misma salida se saltan los
+     trabajos ya completados y se reintentan los fallidos.
+
+Configuración por entorno: OPENAI_API_KEY y OPENAI_BASE_URL.
+
+Uso:
+    python batch_generate.py --week 2026-10-19
+    python batch_generate.py --modes calendario --rpm 500 --tpm 200000 --concurrency 32
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import datetime
+
+from context_assembler import count_tokens
+from llm_backend import get_llm_backend
+from profile_store import DATA_DIR, ProfileStore, get_profile_store
+from quick_prompts import QUICK_MODES, quick_messages
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_CONCURRENCY = 16
+DEFAULT_RPM = 3_500
+DEFAULT_TPM = 90_000
+DEFAULT_MAX_TOKENS = 800
+PROGRESS_EVERY = 50
+
+# Petición de cada modo; {week} y {week_end} son el lunes y el domingo
+DEFAULT_INPUTS = {
+    "guion": "Escribe el guion de un video para publicar la semana del {week} al {week_end}.",
+    "calendario": "Crea el calendario de contenidos de la semana del {week} al {week_end}.",
+    "ideas": "Propón ideas de publicaciones para la semana del {week} al {week_end}.",
+}
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Límites de ritmo
+# ───────────────────────────────────────────────────────────────────────────────
+class RateLimiter:
+    """
+    Cubeta de tokens asíncrona: `per_minute` unidades por minuto, con ráfagas
+    de hasta un minuto de cupo. Las esperas se atienden por orden de llegada.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._level >= amount:
+                    self._level -= amount
+                    return
+                await asyncio.sleep((amount - self._level) / self.rate)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Trabajos
+# ───────────────────────────────────────────────────────────────────────────────
+def next_monday(today: datetime.date = None) -> datetime.date:
+    today = today or datetime.date.today()
+    return today + datetime.timedelta(days=7 - today.weekday())
+
+
+def build_jobs(profiles: dict, modes, week: datetime.date, model: str, max_tokens: int) -> list[dict]:
+    """
+    Un trabajo por (usuario, modo), ordenados por modo y petición. El `id`
+    incluye el modelo: cambiar de modelo no reutiliza la salida anterior. `key`
+    identifica la petición al LLM: trabajos con la misma `key` comparten
+    respuesta.
+    """
+    dates = {"week": week.isoformat(), "week_end": (week + datetime.timedelta(days=6)).isoformat()}
+    jobs = []
+    for mode in modes:
+        user_input = DEFAULT_INPUTS[mode].format(**dates)
+        for user, profile in profiles.items():
+            profile = {k: v for k, v in profile.items() if k != "user"}
+            messages = quick_messages(mode, profile, user_input)
+            payload = json.dumps([model, max_tokens, messages], ensure_ascii=False, sort_keys=True)
+            jobs.append({
+                "id": f"{user}|{mode}|{dates['week']}|{model}",
+                "user": user,
+                "mode": mode,
+                "week": dates["week"],
+                "messages": messages,
+                "key": hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16],
+            })
+    jobs.sort(key=lambda j: (QUICK_MODES.index(j["mode"]), j["key"]))
+    return jobs
+
+
+def load_done(path: str) -> set:
+    """
+    Ids de los trabajos ya completados en la salida `path` (checkpoint).
+    Ignora una última línea a medio escribir.
+    """
+    done = set()
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return done
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "output" in record:
+                done.add(record["id"])
+    return done
+
+
+def end_with_newline(path: str):
+    """
+    Termina `path` en salto de línea si un corte dejó la última línea a medias:
+    así el primer registro que se añada no queda pegado a ella.
+    """
+    try:
+        with open(path, "rb+") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    except FileNotFoundError:
+        pass
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 4) Ejecución
+# ───────────────────────────────────────────────────────────────────────────────
+async def run_batch(backend, jobs: list[dict], out, model: str,
+                    concurrency: int = DEFAULT_CONCURRENCY, rpm: float = DEFAULT_RPM,
+                    tpm: float = DEFAULT_TPM, max_tokens: int = DEFAULT_MAX_TOKENS) -> dict:
+    """
+    Ejecuta `jobs` con `concurrency` peticiones en vuelo como máximo y los
+    límites `rpm`/`tpm`, escribiendo en `out` una línea JSON por trabajo.
+    Debe correr en el loop de `backend` (`backend.run(...)`).
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job["key"], []).append(job)
+    pending = asyncio.Queue()
+    for group in groups.values():
+        pending.put_nowait(group)
+
+    request_limiter, token_limiter = RateLimiter(rpm), RateLimiter(tpm)
+    stats = {"jobs": len(jobs), "requests": len(groups), "errors": 0, "tokens_estimated": 0}
+    started = time.perf_counter()
+    finished = 0
+
+    def write(job: dict, **fields):
+        record = {"id": job["id"], "user": job["user"], "mode": job["mode"],
+                  "week": job["week"], "model": model, "key": job["key"], **fields}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    async def worker():
+        nonlocal finished
+        while not pending.empty():
+            group = pending.get_nowait()
+            messages = group[0]["messages"]
+            # Reserva del peor caso: prompt + max_tokens de respuesta
+            tokens = sum(count_tokens(m["content"], model) for m in messages) + max_tokens
+            await request_limiter.acquire()
+            await token_limiter.acquire(tokens)
+            stats["tokens_estimated"] += tokens
+            t0 = time.perf_counter()
+            try:
+                text = await backend.acomplete(messages, model, max_tokens=max_tokens)
+            except Exception as exc:
+                logger.warning("Fallo en %s: %s", group[0]["id"], exc)
+                stats["errors"] += len(group)
+                for job in group:
+                    write(job, error=f"{type(exc).__name__}: {exc}")
+            else:
+                elapsed = round(time.perf_counter() - t0, 3)
+                for i, job in enumerate(group):
+                    write(job, output=text, elapsed_s=elapsed, deduplicated=i > 0)
+            out.flush()
+            finished += 1
+            if finished % PROGRESS_EVERY == 0:
+                rate = finished / (time.perf_counter() - started)
+                logger.info("%d/%d peticiones (%.1f/s)", finished, len(groups), rate)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    stats["elapsed_s"] = round(time.perf_counter() - started, 3)
+    stats["requests_per_s"] = round(len(groups) / stats["elapsed_s"], 2) if stats["elapsed_s"] else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--week", type=datetime.date.fromisoformat, default=next_monday(),
+                        help="lunes de la semana a planificar (YYYY-MM-DD; por defecto, el próximo)")
+    parser.add_argument("--modes", nargs="+", choices=QUICK_MODES, default=list(QUICK_MODES))
+    parser.add_argument("--users", nargs="+", help="solo estos usuarios (email)")
+    parser.add_argument("--profiles", help="JSONL de encuestas a usar en lugar del almacén de la app")
+    parser.add_argument("--output", help="JSONL de salida y checkpoint (por defecto data/batch/<week>.jsonl)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="peticiones en vuelo como máximo")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM, help="límite de peticiones por minuto")
+    parser.add_argument("--tpm", type=float, default=DEFAULT_TPM, help="límite de tokens por minuto")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise SystemExit("Define OPENAI_API_KEY para generar el lote")
+    output = args.output or os.path.join(DATA_DIR, "batch", f"{args.week.isoformat()}.jsonl")
+
+    store = ProfileStore(jsonl_path=args.profiles, legacy_path="") if args.profiles else get_profile_store()
+    profiles = store.all_profiles()
+    if args.users:
+        profiles = {u: p for u, p in profiles.items() if u in set(args.users)}
+    jobs = build_jobs(profiles, args.modes, args.week, args.model, args.max_tokens)
+    done = load_done(output)
+    todo = [j for j in jobs if j["id"] not in done]
+    logger.info("%d perfiles, %d trabajos (%d ya completados en %s)",
+                len(profiles), len(jobs), len(jobs) - len(todo), output)
+    if not todo:
+        return
+
+    backend = get_llm_backend(api_key, base_url=os.getenv("OPENAI_BASE_URL") or None,
+                              max_concurrency=args.concurrency,
+                              max_connections=max(args.concurrency, 32))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    end_with_newline(output)
+    with open(output, "a", encoding="utf-8") as out:
+        stats = backend.run(run_batch(backend, todo, out, args.model, concurrency=args.concurrency,
+                                      rpm=args.rpm, tpm=args.tpm, max_tokens=args.max_tokens))
+    logger.info("Lote terminado: %s", json.dumps(stats))
+    if stats["errors"]:
+        logger.warning("%d trabajos fallaron; relanza el mismo comando para reintentarlos", stats["errors"])
+
+
+if __name__ == "__main__":
+    main()
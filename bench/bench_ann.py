@@ -0,0 +1,139 @@
+"""
+bench/bench_ann.py
+
+Compara el índice plano (exacto) con los índices aproximados del builder
+(IVF-Flat, HNSW, IVF-PQ): recall@k frente al plano, latencia por consulta
+(p50/p99, una consulta cada vez, como en la app), tiempo de construcción y
+tamaño serializado. Barre `nprobe`/`efSearch` para ver la curva
+recall-latencia.
+
+Vectores:
+  - sintéticos por defecto (gaussianas agrupadas, --n × --dim), o
+  - los del vectorstore real con --vs-dir (maestro 'index.flat.faiss' o
+    'index.faiss' plano); las consultas son vectores del corpus con ruido.
+
+Uso:
+    python bench/bench_ann.py --n 200000 --dim 1536
+    python bench/bench_ann.py --vs-dir book_vectorstore/vectorstores/books_faiss --k 4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "book_vectorstore"))
+
+from build_vectorstore import FLAT_INDEX_NAME, build_ann_index, master_vectors
+from vectorstore import apply_search_params
+
+SWEEPS = {
+    "flat": [None],
+    "ivf": [1, 4, 16, 64],
+    "hnsw": [16, 64, 256],
+    "ivfpq": [4, 16, 64],
+}
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """
+    Vectores agrupados alrededor de `clusters` centros, normalizados como
+    los embeddings de OpenAI.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype="float32")
+    x = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim), dtype="float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def load_vectors(vs_dir: str) -> np.ndarray:
+    path = os.path.join(vs_dir, FLAT_INDEX_NAME)
+    if not os.path.isfile(path):
+        path = os.path.join(vs_dir, "index.faiss")
+    index = faiss.read_index(path)
+    if not isinstance(index, faiss.IndexIDMap2):
+        raise ValueError(f"{path} no es un índice plano con ids; reconstruye con el builder")
+    vectors, _ = master_vectors(index)
+    return np.array(vectors)
+
+
+def make_queries(x: np.ndarray, nq: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = x[rng.choice(len(x), nq, replace=False)]
+    q = q + 0.05 * rng.standard_normal(q.shape, dtype="float32")
+    return np.ascontiguousarray(q / np.linalg.norm(q, axis=1, keepdims=True), dtype="float32")
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    latencies = np.empty(len(queries))
+    found = np.empty((len(queries), k), dtype="int64")
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies[i] = time.perf_counter() - t0
+        found[i] = ids[0]
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    lat = latencies * 1000
+    return {"recall": float(recall),
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p99_ms": float(np.percentile(lat, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vs-dir", help="usar los vectores de este vectorstore")
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--types", nargs="+", default=list(SWEEPS), choices=list(SWEEPS))
+    parser.add_argument("--threads", type=int, default=1,
+                        help="hilos OpenMP de FAISS (1 ≈ una consulta por sesión)")
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    build_threads = faiss.omp_get_max_threads()
+    x = load_vectors(args.vs_dir) if args.vs_dir else synthetic_vectors(args.n, args.dim)
+    ids = np.arange(len(x), dtype="int64")
+    queries = make_queries(x, min(args.queries, len(x)))
+    print(f"{len(x)} vectores × {x.shape[1]} dims, {len(queries)} consultas, k={args.k}")
+
+    flat = build_ann_index(x, ids, "flat")
+    _, truth = flat.search(queries, args.k)
+
+    results = []
+    for index_type in args.types:
+        faiss.omp_set_num_threads(build_threads)
+        t0 = time.perf_counter()
+        index = flat if index_type == "flat" else build_ann_index(x, ids, index_type)
+        build_s = time.perf_counter() - t0
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+        faiss.omp_set_num_threads(args.threads)
+        for value in SWEEPS[index_type]:
+            if index_type in ("ivf", "ivfpq"):
+                apply_search_params(index, nprobe=value)
+            elif index_type == "hnsw":
+                apply_search_params(index, ef_search=value)
+            r = measure(index, queries, truth, args.k)
+            results.append({"type": index_type, "param": value, "build_s": build_s,
+                            "size_mb": size_mb, **r})
+
+    print(f"{'índice':<8}{'param':>8}{'recall@' + str(args.k):>11}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'build s':>9}{'MB':>9}")
+    for r in results:
+        param = "-" if r["param"] is None else str(r["param"])
+        print(f"{r['type']:<8}{param:>8}{r['recall']:>11.3f}{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}"
+              f"{r['build_s']:>9.2f}{r['size_mb']:>9.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"n": len(x), "dim": int(x.shape[1]), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
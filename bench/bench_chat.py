@@ -0,0 +1,367 @@
+"""
+bench/bench_chat.py
+
+Benchmark reproducible y sin red del camino de chat de app.py, ejecutado
+sin navegador con `streamlit.testing.v1.AppTest` (el script real, con sus
+cachés de proceso):
+
+  - Embeddings falsos y deterministas (hash del texto → vector), sin API.
+  - Servidor OpenAI local (bench/fake_openai_server.py) con TTFT y ritmo de
+    tokens configurables.
+  - Vectorstores sintéticos de 10k–1M fragmentos (FAISS + chunk store +
+    BM25), generados una vez y reutilizados desde --workdir.
+
+Por cada tamaño se lanza un proceso nuevo que mide:
+  - cold start: desde el arranque del proceso hasta el primer render, y
+    hasta que el vectorstore está cargado (la app lo precarga en segundo
+    plano); los turnos se miden a partir de ese momento,
+  - latencia por turno (p50/p95) y desglose por etapa (metrics.py),
+  - throughput con N sesiones concurrentes (un proceso por sesión, ya que
+    AppTest no admite varias sesiones por proceso) y su latencia p50/p95,
+  - pico de memoria residente (ru_maxrss).
+
+Los resultados se guardan en JSON (--json) con el commit y el entorno, para
+compararlos entre commits con bench/compare.py.
+
+Uso:
+    python bench/bench_chat.py --sizes 10000 100000 --json base.json
+    python bench/bench_chat.py --sizes 1000000 --sessions 8 --turns 5 --json big.json
+    python bench/compare.py base.json nuevo.json
+"""
+
+import os
+import sys
+import json
+import time
+
+T_START = time.perf_counter()   # antes de cualquier import pesado (cold start)
+
+import hashlib
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "estrategia_bench")
+BM25_MAX_DOCS = 200_000
+WORDS = (
+    "marca contenido reels instagram tiktok audiencia campaña anuncio venta cliente "
+    "producto historia comunidad hashtag engagement alcance seguidores video guion "
+    "calendario oferta descuento lanzamiento testimonio emoción confianza precio "
+    "embudo conversión lead correo newsletter influencer colaboración tendencia "
+    "publicación comentario respuesta llamada acción valor beneficio problema "
+    "solución estrategia objetivo métrica análisis presupuesto segmento nicho"
+).split()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Embeddings falsos y vectorstore sintético
+# ───────────────────────────────────────────────────────────────────────────────
+def _fake_vector(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype("float32")
+    return vec / np.linalg.norm(vec)
+
+
+def make_fake_embeddings(dim: int):
+    """
+    Modelo de embeddings determinista (sin red) con la interfaz de LangChain.
+    """
+    from langchain_core.embeddings import Embeddings
+
+    class FakeEmbeddings(Embeddings):
+        backend = "fake"
+        model = "fake-hash"
+        dimensions = dim
+
+        def embed_documents(self, texts):
+            return [_fake_vector(t, dim).tolist() for t in texts]
+
+        def embed_query(self, text):
+            return _fake_vector(text, dim).tolist()
+
+    return FakeEmbeddings()
+
+
+def build_synthetic_vectorstore(out_dir: str, n: int, dim: int, bm25: bool, seed: int = 0):
+    """
+    Genera (una vez) un vectorstore de `n` fragmentos con textos de
+    vocabulario de marketing y vectores aleatorios normalizados.
+    """
+    import faiss
+    from chunkstore import ChunkStoreWriter
+    from bm25 import build_bm25
+
+    marker = os.path.join(out_dir, "bench.json")
+    if os.path.isfile(marker):
+        return
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS)
+    batch = 50_000
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    texts_for_bm25 = []
+    t0 = time.perf_counter()
+    with ChunkStoreWriter(out_dir) as writer:
+        for start in range(0, n, batch):
+            size = min(batch, n - start)
+            picks = words[rng.integers(0, len(words), (size, 40))]
+            for i, row in enumerate(picks):
+                text = f"Consejo {start + i}: " + " ".join(row)
+                writer.append(text, {"source": f"libro{(start + i) % 50}.epub"})
+                if bm25:
+                    texts_for_bm25.append(text)
+            vectors = rng.standard_normal((size, dim), dtype="float32")
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            index.add_with_ids(vectors, np.arange(start, start + size, dtype="int64"))
+    faiss.write_index(index, os.path.join(out_dir, "index.faiss"))
+    if bm25:
+        build_bm25(enumerate(texts_for_bm25), out_dir)
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({"n": n, "dim": dim, "bm25": bm25, "build_s": time.perf_counter() - t0}, f)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Worker: un proceso por tamaño
+# ───────────────────────────────────────────────────────────────────────────────
+def _percentiles(values) -> dict:
+    if not values:
+        return {"p50_s": None, "p95_s": None}
+    arr = np.asarray(values)
+    return {"p50_s": float(np.percentile(arr, 50)), "p95_s": float(np.percentile(arr, 95))}
+
+
+def _new_app(base_url: str):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.secrets["openai"] = {"api_key": "sk-bench", "base_url": base_url}
+    return at
+
+
+def _ask(at, question: str) -> float:
+    t0 = time.perf_counter()
+    at.chat_input[0].set_value(question).run()
+    elapsed = time.perf_counter() - t0
+    if at.exception:
+        raise RuntimeError(f"Excepción en la app: {at.exception[0].value}")
+    return elapsed
+
+
+def _prepare_process(args):
+    """
+    Entorno común de los procesos que ejecutan la app: vectorstore
+    sintético, caché de embeddings temporal y embeddings falsos.
+    """
+    os.environ["VECTORSTORE_PATH"] = args.vs_dir
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "embeddings.sqlite")
+    os.environ.pop("METRICS_JSONL", None)
+    os.environ.pop("METRICS_PORT", None)
+    import embedding_backends
+
+    embedding_backends.make_embeddings = lambda *a, **k: make_fake_embeddings(args.dim)
+
+
+def _wait_until_ready():
+    """
+    Espera a que termine la precarga que la app lanza en segundo plano tras
+    el primer render (hilo "warmup": vectorstore, backend de OpenAI...).
+    """
+    for thread in threading.enumerate():
+        if thread.name.startswith("warmup"):
+            thread.join()
+
+
+def run_session(args):
+    """
+    Proceso de una sesión concurrente: renderiza la app, avisa con "ready",
+    espera "go" en stdin y responde `turns` preguntas. Imprime sus latencias.
+    """
+    _prepare_process(args)
+    at = _new_app(args.base_url)
+    at.run()
+    _wait_until_ready()
+    print("ready", flush=True)
+    sys.stdin.readline()
+    latencies = [_ask(at, f"sesión {args.session} pregunta {i}: {WORDS[(args.session + i) % len(WORDS)]}")
+                 for i in range(args.turns)]
+    print(json.dumps({"latencies": latencies,
+                      "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}), flush=True)
+
+
+def _run_concurrent(args, base_url: str) -> dict:
+    """
+    N sesiones simultáneas, cada una en su propio proceso (AppTest no admite
+    varias sesiones en un mismo proceso), como N workers de la app detrás de
+    un balanceador. Se mide desde que todas están listas.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), "--session-worker", "--vs-dir", args.vs_dir,
+           "--dim", str(args.dim), "--turns", str(args.turns), "--base-url", base_url]
+    procs = [subprocess.Popen(cmd + ["--session", str(i)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True, cwd=ROOT)
+             for i in range(args.sessions)]
+    errors = []
+    for p in procs:
+        if p.stdout.readline().strip() != "ready":
+            errors.append(f"sesión sin arrancar (código {p.poll()})")
+    t0 = time.perf_counter()
+    for p in procs:
+        if p.poll() is None:
+            p.stdin.write("go\n")
+            p.stdin.flush()
+    latencies, rss = [], []
+    for p in procs:
+        out = p.stdout.read().strip().splitlines()
+        p.wait()
+        if p.returncode != 0 or not out:
+            errors.append(f"sesión con código {p.returncode}")
+            continue
+        data = json.loads(out[-1])
+        latencies += data["latencies"]
+        rss.append(data["peak_rss_mb"])
+    wall = time.perf_counter() - t0
+    return {
+        "sessions": args.sessions,
+        "turns": len(latencies),
+        "throughput_tps": len(latencies) / wall if wall > 0 and latencies else None,
+        **_percentiles(latencies),
+        "peak_rss_mb_per_session": max(rss) if rss else None,
+        "errors": errors[:5],
+    }
+
+
+def run_worker(args) -> dict:
+    """
+    Proceso que mide un tamaño: cold start, turnos secuenciales y sesiones
+    concurrentes contra un servidor OpenAI falso propio.
+    """
+    from fake_openai_server import serve_in_thread
+
+    _, base_url = serve_in_thread(ttft_s=args.ttft_ms / 1000, token_s=args.token_ms / 1000, dim=args.dim)
+    _prepare_process(args)
+
+    # Cold start: imports de la app + carga del vectorstore + primer render
+    at = _new_app(base_url)
+    t0 = time.perf_counter()
+    at.run()
+    first_run_s = time.perf_counter() - t0
+    cold_start_s = time.perf_counter() - T_START
+    _wait_until_ready()
+    ready_s = time.perf_counter() - T_START
+    if at.exception:
+        raise RuntimeError(f"Excepción en la app: {at.exception[0].value}")
+
+    # Turnos secuenciales (preguntas distintas: sin aciertos del caché de respuestas)
+    latencies, stages, ttfts = [], {}, []
+    for i in range(args.turns):
+        latencies.append(_ask(at, f"pregunta {i}: ideas de {WORDS[i % len(WORDS)]} para mi marca"))
+        record = at.session_state["last_turn_metrics"]
+        for name, sec in record["stages"].items():
+            stages.setdefault(name, []).append(sec)
+        if record.get("ttft_s") is not None:
+            ttfts.append(record["ttft_s"])
+
+    return {
+        "size": args.size,
+        "dim": args.dim,
+        "cold_start_s": cold_start_s,
+        "first_run_s": first_run_s,
+        "ready_s": ready_s,
+        "turn": {**_percentiles(latencies), "n": len(latencies)},
+        "stages_ms": {name: 1000 * float(np.mean(v)) for name, v in stages.items()},
+        "ttft_s": float(np.mean(ttfts)) if ttfts else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "concurrent": _run_concurrent(args, base_url),
+    }
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Orquestación
+# ───────────────────────────────────────────────────────────────────────────────
+def _git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--turns", type=int, default=10, help="turnos por sesión")
+    parser.add_argument("--sessions", type=int, default=4, help="sesiones concurrentes")
+    parser.add_argument("--ttft-ms", type=float, default=50)
+    parser.add_argument("--token-ms", type=float, default=2)
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="caché de vectorstores sintéticos")
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    # Uso interno: proceso hijo que mide un tamaño
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--vs-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--session-worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--session", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.session_worker:
+        run_session(args)
+        return
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    results = []
+    for size in args.sizes:
+        vs_dir = os.path.join(args.workdir, f"synth_{size}_{args.dim}")
+        print(f"▶ {size} fragmentos: preparando {vs_dir}", flush=True)
+        build_synthetic_vectorstore(vs_dir, size, args.dim, bm25=size <= BM25_MAX_DOCS)
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--size", str(size),
+               "--vs-dir", vs_dir, "--dim", str(args.dim), "--turns", str(args.turns),
+               "--sessions", str(args.sessions), "--ttft-ms", str(args.ttft_ms),
+               "--token-ms", str(args.token_ms)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+        if proc.returncode != 0:
+            print(proc.stderr[-2000:], file=sys.stderr)
+            raise SystemExit(f"El worker de {size} fragmentos falló")
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(r)
+        c = r["concurrent"]
+        print(f"  cold start {r['cold_start_s']:.2f}s (primer render {r['first_run_s']:.2f}s, listo {r.get('ready_s', r['cold_start_s']):.2f}s) · "
+              f"turno p50 {r['turn']['p50_s'] * 1000:.0f}ms p95 {r['turn']['p95_s'] * 1000:.0f}ms · "
+              f"{c['sessions']} sesiones: {c['throughput_tps']:.1f} turnos/s, "
+              f"p95 {c['p95_s'] * 1000:.0f}ms · RSS pico {r['peak_rss_mb']:.0f} MB")
+        top = sorted(r["stages_ms"].items(), key=lambda kv: -kv[1])[:5]
+        print("  etapas (ms): " + ", ".join(f"{k} {v:.1f}" for k, v in top))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {k: getattr(args, k) for k in ("dim", "turns", "sessions", "ttft_ms", "token_ms")},
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Resultados en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+bench/bench_chunkstore.py
+
+Compara el arranque en frío del docstore en pickle (index.pkl) frente al
+chunk store mapeado en memoria: tiempo hasta poder servir la primera
+consulta (abrir + decodificar k resultados) y RSS añadido por proceso.
+
+Cada modo se mide en un subproceso limpio para que el caché de objetos de
+Python no contamine la medición.
+
+Uso:
+    python bench/bench_chunkstore.py                       # corpus sintético
+    python bench/bench_chunkstore.py --vs-dir book_vectorstore/vectorstores/books_faiss
+    python bench/bench_chunkstore.py --chunks 200000 --json resultados.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import pickle
+import argparse
+import resource
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _rss_kb() -> int:
+    """
+    RSS actual del proceso en KB. Lee /proc en Linux; en otros sistemas usa
+    el máximo de getrusage (KB en Linux, bytes en macOS).
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def make_synthetic(vs_dir: str, n_chunks: int, seed: int = 0):
+    """
+    Genera un index.pkl y un chunk store equivalentes con `n_chunks`
+    fragmentos de ~1000 caracteres.
+    """
+    from langchain.docstore.in_memory import InMemoryDocstore
+    from langchain.schema import Document
+    from chunkstore import convert_pickle
+
+    rng = random.Random(seed)
+    words = ["marketing", "seguidores", "contenido", "instagram", "tiktok",
+             "audiencia", "marca", "estrategia", "campaña", "conversión"]
+    docs, mapping = {}, {}
+    for i in range(n_chunks):
+        text = " ".join(rng.choice(words) for _ in range(110))[:1000]
+        doc_id = f"doc-{i}"
+        docs[doc_id] = Document(page_content=text, metadata={"source": f"libro{i % 20}.epub"})
+        mapping[i] = doc_id
+    os.makedirs(vs_dir, exist_ok=True)
+    with open(os.path.join(vs_dir, "index.pkl"), "wb") as f:
+        pickle.dump((InMemoryDocstore(docs), mapping), f)
+    convert_pickle(vs_dir)
+
+
+def _child(mode: str, vs_dir: str, k: int):
+    """
+    Ejecutado en el subproceso: abre el docstore y decodifica k filas.
+    """
+    import numpy  # noqa: F401  (importado antes de medir RSS base)
+    import langchain.schema  # noqa: F401
+    from chunkstore import load_docstore
+
+    base_rss = _rss_kb()
+    t0 = time.perf_counter()
+    if mode == "pickle":
+        with open(os.path.join(vs_dir, "index.pkl"), "rb") as f:
+            docstore, mapping = pickle.load(f)
+    else:
+        docstore, mapping = load_docstore(vs_dir)
+    t_open = time.perf_counter() - t0
+
+    rows = random.Random(1).sample(range(len(mapping)), k)
+    t1 = time.perf_counter()
+    for r in rows:
+        docstore.search(mapping[r])
+    t_fetch = time.perf_counter() - t1
+
+    print(json.dumps({
+        "mode": mode,
+        "open_s": t_open,
+        "fetch_k_s": t_fetch,
+        "cold_start_s": t_open + t_fetch,
+        "rss_delta_mb": (_rss_kb() - base_rss) / 1024,
+    }))
+
+
+def run(vs_dir: str, k: int, repeats: int) -> list[dict]:
+    results = []
+    for mode in ("pickle", "chunkstore"):
+        runs = []
+        for _ in range(repeats):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--vs-dir", vs_dir, "--k", str(k)],
+                check=True, capture_output=True, text=True
+            )
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        best = min(runs, key=lambda r: r["cold_start_s"])
+        results.append(best)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vs-dir", help="vectorstore existente con index.pkl")
+    parser.add_argument("--chunks", type=int, default=50000, help="tamaño del corpus sintético")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.vs_dir, args.k)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vs_dir = args.vs_dir
+        if vs_dir is None:
+            vs_dir = tmp
+            make_synthetic(vs_dir, args.chunks)
+        else:
+            from chunkstore import has_chunk_store, convert_pickle
+            if not has_chunk_store(vs_dir):
+                convert_pickle(vs_dir)
+        results = run(vs_dir, args.k, args.repeats)
+
+    print(f"{'modo':<12}{'abrir (s)':>12}{'k docs (s)':>12}{'total (s)':>12}{'RSS (MB)':>12}")
+    for r in results:
+        print(f"{r['mode']:<12}{r['open_s']:>12.4f}{r['fetch_k_s']:>12.5f}"
+              f"{r['cold_start_s']:>12.4f}{r['rss_delta_mb']:>12.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
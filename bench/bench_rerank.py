@@ -0,0 +1,158 @@
+"""
+bench/bench_rerank.py
+
+Calidad frente a latencia de la etapa de reordenación (rerank.py) sobre la
+búsqueda híbrida:
+
+  - top-k:      los k primeros de la fusión RRF (lo que hace la app sin etapa)
+  - mmr:        `fetch_k` candidatos reordenados con MMR (λ de `--lambda`)
+  - cross:      cross-encoder local, sin MMR (`--cross-encoder`)
+  - cross+mmr:  puntuaciones del cross-encoder como relevancia de MMR
+
+Por variante mide recall@k (consultas de ítem conocido, como
+bench/eval_retrieval.py, o `--queries`), redundancia de los k pasajes
+(similitud coseno media entre pares, pares casi duplicados y pares de
+fragmentos contiguos del mismo libro, que se solapan CHUNK_OVERLAP
+caracteres), latencia añadida por la etapa (p50/p95) y cuántas veces se
+agotó el presupuesto.
+
+Los embeddings de las consultas deben venir del modelo del índice (el del
+manifiesto por defecto); `--base-url` para un servidor compatible.
+
+Uso:
+    python bench/bench_rerank.py --vs-dir book_vectorstore/vectorstores/books_faiss
+    python bench/bench_rerank.py --fetch-k 30 50 --budget-ms 50 --cross-encoder Xenova/ms-marco-MiniLM-L-6-v2
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chunkstore import ChunkStore
+from embedding_backends import embed_queries, make_embeddings, recorded_embedding
+from eval_retrieval import is_relevant, load_queries, synthetic_queries
+from rerank import DEFAULT_BUDGET_MS, DEFAULT_MMR_LAMBDA, Reranker, get_cross_encoder
+from vectorstore import DEFAULT_VS_SUBPATH, RetrievalService
+
+NEAR_DUPLICATE = 0.95   # coseno a partir del cual dos pasajes cuentan como casi iguales
+
+
+def redundancy(entry, store: ChunkStore, ids) -> dict:
+    """
+    Redundancia de los pasajes `ids`: coseno medio entre pares, fracción de
+    pares casi duplicados y fracción de pares contiguos del mismo libro.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    if len(ids) < 2:
+        return {"mean_cos": 0.0, "near_dup": 0.0, "adjacent": 0.0}
+    vectors = entry.vectors(ids)
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    upper = np.triu_indices(len(ids), k=1)
+    cos = (unit @ unit.T)[upper]
+    sources = [store.metadata(int(i)).get("source") for i in ids]
+    adjacent = [abs(int(ids[a]) - int(ids[b])) == 1 and sources[a] == sources[b] for a, b in zip(*upper)]
+    return {"mean_cos": float(cos.mean()), "near_dup": float((cos >= NEAR_DUPLICATE).mean()),
+            "adjacent": float(np.mean(adjacent))}
+
+
+def evaluate(name: str, select, queries: list[dict], k: int, entry, store: ChunkStore) -> dict:
+    """
+    Ejecuta `select(i) -> ids` para cada consulta y agrega calidad y latencia.
+    """
+    hits, latencies, red = 0, [], []
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        ids = list(select(i))
+        latencies.append(time.perf_counter() - t0)
+        hits += any(is_relevant(q, int(d), store) for d in ids[:k])
+        red.append(redundancy(entry, store, ids[:k]))
+    lat = np.asarray(latencies) * 1000
+    return {
+        "method": name,
+        f"recall@{k}": hits / len(queries),
+        **{key: float(np.mean([r[key] for r in red])) for key in ("mean_cos", "near_dup", "adjacent")},
+        "added_p50_ms": float(np.percentile(lat, 50)),
+        "added_p95_ms": float(np.percentile(lat, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vs-dir", default=os.path.join(ROOT, DEFAULT_VS_SUBPATH))
+    parser.add_argument("--queries", help="JSONL con consultas y relevantes")
+    parser.add_argument("--n", type=int, default=200, help="consultas sintéticas")
+    parser.add_argument("--k", type=int, default=4, help="pasajes finales por pregunta")
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[50], help="candidatos a reordenar")
+    parser.add_argument("--lambda", dest="mmr_lambda", type=float, nargs="+", default=[DEFAULT_MMR_LAMBDA])
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--cross-encoder", help="modelo de fastembed (sin él, solo MMR)")
+    parser.add_argument("--embeddings", help="backend de embeddings (por defecto, el del manifiesto)")
+    parser.add_argument("--model", help="modelo de embeddings (por defecto, el del manifiesto)")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"))
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    recorded = recorded_embedding(args.vs_dir) or {}
+    embeddings = make_embeddings(args.embeddings or recorded.get("backend") or "openai",
+                                 args.model or recorded.get("model"),
+                                 api_key=os.getenv("OPENAI_API_KEY", "sk-local"), base_url=args.base_url)
+    service = RetrievalService(embeddings, vs_subpath=os.path.abspath(args.vs_dir))
+    entry = service.entry()
+    store = ChunkStore(args.vs_dir)
+
+    if args.queries:
+        queries = load_queries(args.queries)
+    else:
+        live_ids = np.unique(np.asarray(entry.sparse.docs)) if entry.sparse is not None else np.arange(len(store))
+        queries = synthetic_queries(store, live_ids, args.n)
+    vectors = embed_queries(embeddings, [q["query"] for q in queries])
+
+    cross_encoder = None
+    if args.cross_encoder:
+        try:
+            cross_encoder = get_cross_encoder(args.cross_encoder)
+        except ImportError:
+            print("fastembed no está instalado: se omiten las variantes con cross-encoder")
+
+    k = args.k
+    baseline = [service.hybrid_search_ids(q["query"], vectors[i], k) for i, q in enumerate(queries)]
+    results = [evaluate("top-k", lambda i: baseline[i], queries, k, entry, store)]
+    for fetch_k in args.fetch_k:
+        # Los candidatos se recuperan una vez: solo se cronometra la etapa
+        candidates = [service.hybrid_search_ids(q["query"], vectors[i], fetch_k) for i, q in enumerate(queries)]
+        variants = [(f"mmr λ={lam}", lam, None) for lam in args.mmr_lambda]
+        if cross_encoder is not None:
+            variants += [("cross", None, cross_encoder)]
+            variants += [(f"cross+mmr λ={lam}", lam, cross_encoder) for lam in args.mmr_lambda]
+        for name, lam, ce in variants:
+            reranker = Reranker(fetch_k=fetch_k, mmr_lambda=lam, cross_encoder=ce, budget_ms=args.budget_ms)
+
+            def select(i, reranker=reranker):
+                return reranker.rerank(queries[i]["query"], vectors[i], candidates[i], k,
+                                       vectors=entry.vectors, texts=entry.texts)
+
+            result = evaluate(f"{name} @{fetch_k}", select, queries, k, entry, store)
+            result["fallbacks"] = reranker.fallbacks
+            results.append(result)
+
+    header = (f"{'variante':<24}{'R@' + str(k):>8}{'cos':>8}{'dup':>8}{'contig':>8}"
+              f"{'+p50 ms':>10}{'+p95 ms':>10}{'fallback':>10}")
+    print(f"{len(queries)} consultas, k={k}, presupuesto {args.budget_ms:.0f} ms\n{header}")
+    for r in results:
+        print(f"{r['method']:<24}{r[f'recall@{k}']:>8.3f}{r['mean_cos']:>8.3f}{r['near_dup']:>8.3f}"
+              f"{r['adjacent']:>8.3f}{r['added_p50_ms']:>10.2f}{r['added_p95_ms']:>10.2f}"
+              f"{r.get('fallbacks', 0):>10}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"queries": len(queries), "k": k, "budget_ms": args.budget_ms, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+bench/bench_stream_render.py
+
+Micro-benchmark del renderizado en streaming: llamadas a `.markdown()`,
+caracteres enviados al contenedor y CPU por cada 1k tokens, comparando el
+handler anterior (re-render completo por token) con `callbacks.StreamHandler`.
+
+El contenedor es un doble que solo cuenta; el coste medido es el del lado
+Python (concatenación + serialización del texto que Streamlit enviaría por el
+websocket), no el del navegador.
+
+Uso:
+    python bench/bench_stream_render.py --tokens 2000 --delay-ms 5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from callbacks import StreamHandler
+
+
+class CountingContainer:
+    """
+    Sustituto de `st.empty()` que cuenta renderizados y bytes enviados.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.chars = 0
+
+    def markdown(self, text: str):
+        self.calls += 1
+        self.chars += len(text)
+        # Simula la codificación del mensaje que viaja al navegador
+        text.encode("utf-8")
+
+
+class LegacyStreamHandler:
+    """
+    Comportamiento anterior: concatena y re-renderiza en cada token.
+    """
+    def __init__(self, container):
+        self.container = container
+        self.text = ""
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self.text += token
+        self.container.markdown(self.text)
+
+    def flush(self):
+        pass
+
+
+def synthetic_tokens(n: int) -> list[str]:
+    words = ["Publica", " contenido", " educativo", " tres", " veces", " por",
+             " semana", " en", " Instagram", ",", " usa", " reels", ".\n"]
+    return [words[i % len(words)] for i in range(n)]
+
+
+def run(handler_cls, tokens: list[str], delay_s: float, **kwargs) -> dict:
+    container = CountingContainer()
+    handler = handler_cls(container, **kwargs)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    for tok in tokens:
+        handler.on_llm_new_token(tok)
+        if delay_s:
+            time.sleep(delay_s)  # ritmo de llegada de tokens del LLM
+    handler.flush()
+    cpu = time.process_time() - cpu0
+    per_k = 1000 / len(tokens)
+    return {
+        "handler": handler_cls.__name__,
+        "tokens": len(tokens),
+        "render_calls_per_1k": container.calls * per_k,
+        "chars_sent_per_1k": container.chars * per_k,
+        "cpu_ms_per_1k": cpu * 1000 * per_k,
+        "wall_s": time.perf_counter() - wall0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--delay-ms", type=float, default=5.0,
+                        help="pausa entre tokens (0 = tan rápido como sea posible)")
+    parser.add_argument("--flush-interval", type=float, default=None)
+    parser.add_argument("--flush-chars", type=int, default=None)
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    tokens = synthetic_tokens(args.tokens)
+    kwargs = {}
+    if args.flush_interval is not None:
+        kwargs["flush_interval"] = args.flush_interval
+    if args.flush_chars is not None:
+        kwargs["flush_chars"] = args.flush_chars
+
+    results = [
+        run(LegacyStreamHandler, tokens, args.delay_ms / 1000),
+        run(StreamHandler, tokens, args.delay_ms / 1000, **kwargs),
+    ]
+    print(f"{'handler':<22}{'renders/1k':>12}{'chars/1k':>14}{'CPU ms/1k':>12}")
+    for r in results:
+        print(f"{r['handler']:<22}{r['render_calls_per_1k']:>12.1f}"
+              f"{r['chars_sent_per_1k']:>14.0f}{r['cpu_ms_per_1k']:>12.2f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+bench/compare.py
+
+Compara dos resultados de bench/bench_chat.py (p. ej. de dos commits) y
+marca las regresiones que superan un umbral relativo. Sale con código 1 si
+hay alguna, para poder usarlo en CI.
+
+Uso:
+    python bench/compare.py base.json nuevo.json --threshold 0.10
+"""
+
+import sys
+import json
+import argparse
+
+# (métrica, ruta en el resultado, True si "más alto es mejor")
+METRICS = (
+    ("cold start s", ("cold_start_s",), False),
+    ("primer render s", ("first_run_s",), False),
+    ("listo s", ("ready_s",), False),
+    ("turno p50 s", ("turn", "p50_s"), False),
+    ("turno p95 s", ("turn", "p95_s"), False),
+    ("concurrente turnos/s", ("concurrent", "throughput_tps"), True),
+    ("concurrente p95 s", ("concurrent", "p95_s"), False),
+    ("RSS pico MB", ("peak_rss_mb",), False),
+)
+
+
+def _get(result: dict, path: tuple):
+    for key in path:
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def compare(base: dict, new: dict, threshold: float) -> list[str]:
+    """
+    Imprime la tabla de cambios y devuelve las regresiones detectadas.
+    """
+    regressions = []
+    base_by_size = {r["size"]: r for r in base["results"]}
+    print(f"base {base['meta']['commit']}  →  nuevo {new['meta']['commit']}")
+    for r in new["results"]:
+        old = base_by_size.get(r["size"])
+        if old is None:
+            print(f"\n{r['size']} fragmentos: sin base para comparar")
+            continue
+        print(f"\n{r['size']} fragmentos")
+        print(f"  {'métrica':<24}{'base':>12}{'nuevo':>12}{'cambio':>10}")
+        for label, path, higher_is_better in METRICS:
+            a, b = _get(old, path), _get(r, path)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a if a else 0.0
+            worse = -change if higher_is_better else change
+            flag = "  ⚠️" if worse > threshold else ""
+            if flag:
+                regressions.append(f"{r['size']}: {label} {change:+.1%}")
+            print(f"  {label:<24}{a:>12.4g}{b:>12.4g}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="empeoramiento relativo que cuenta como regresión")
+    args = parser.parse_args()
+    with open(args.base, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print("\nRegresiones:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("\nSin regresiones por encima del umbral.")
+
+
+if __name__ == "__main__":
+    main()
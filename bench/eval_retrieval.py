@@ -0,0 +1,172 @@
+"""
+bench/eval_retrieval.py
+
+Evaluación offline de la recuperación: recall@k y latencia (p50/p95) para
+búsqueda densa, BM25 y la híbrida con RRF, sobre vectorstore.RetrievalService
+(el mismo camino que la app y la API):
+
+  - dense:       `search_ids`, una consulta por llamada
+  - dense-lote:  `search_vectors` con todas las consultas en una sola
+                 `index.search` (latencia amortizada por consulta)
+  - bm25:        el índice BM25 del vectorstore
+  - hybrid:      `hybrid_search_ids` (RRF de densa y BM25)
+
+El caché de búsquedas del servicio se vacía antes de cada método: las
+latencias son en frío.
+
+Consultas:
+  - `--queries archivo.jsonl`, una por línea:
+        {"query": "...", "relevant_ids": [12, 40]}
+        {"query": "...", "relevant_sources": ["libro.epub"]}
+  - Sin archivo se generan consultas de "ítem conocido": una ventana de
+    palabras de un fragmento al azar, cuyo fragmento de origen es el relevante.
+
+Los embeddings de las consultas deben venir del mismo modelo que construyó el
+índice (el del manifiesto por defecto; OPENAI_API_KEY para OpenAI), o
+`--base-url` para un servidor compatible (p. ej. bench/fake_openai_server.py
+si el índice se construyó con él).
+
+Uso:
+    python bench/eval_retrieval.py --vs-dir book_vectorstore/vectorstores/books_faiss
+    python bench/eval_retrieval.py --queries consultas.jsonl --k 1 4 10 --json eval.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chunkstore import ChunkStore
+from embedding_backends import embed_queries, make_embeddings, recorded_embedding
+from vectorstore import DEFAULT_VS_SUBPATH, RetrievalService
+
+
+def synthetic_queries(store: ChunkStore, live_ids, n: int, seed: int = 0) -> list[dict]:
+    """
+    Consultas de ítem conocido: 8–14 palabras consecutivas de un fragmento.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for doc_id in rng.sample(list(live_ids), min(n, len(live_ids))):
+        words = store.text(doc_id).split()
+        if len(words) < 20:
+            continue
+        size = rng.randint(8, 14)
+        start = rng.randint(0, len(words) - size)
+        queries.append({"query": " ".join(words[start:start + size]), "relevant_ids": [doc_id]})
+    return queries
+
+
+def load_queries(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def is_relevant(q: dict, doc_id: int, store: ChunkStore) -> bool:
+    if "relevant_ids" in q:
+        return doc_id in q["relevant_ids"]
+    return store.metadata(doc_id).get("source") in q.get("relevant_sources", [])
+
+
+def evaluate(name: str, search, queries: list[dict], ks: list[int], store: ChunkStore) -> dict:
+    """
+    Ejecuta `search(i, q) -> ids` para cada consulta y calcula recall@k
+    (fracción de consultas con algún relevante en el top-k) y latencias.
+    """
+    rankings, latencies = [], []
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        rankings.append(list(search(i, q)))
+        latencies.append(time.perf_counter() - t0)
+    return summarize(name, rankings, latencies, queries, ks, store)
+
+
+def summarize(name: str, rankings, latencies, queries: list[dict], ks: list[int], store: ChunkStore) -> dict:
+    """
+    recall@k de `rankings` (ids por consulta) y percentiles de `latencies` (s).
+    """
+    hits = {k: 0 for k in ks}
+    for q, ids in zip(queries, rankings):
+        for k in ks:
+            if any(is_relevant(q, int(d), store) for d in ids[:k]):
+                hits[k] += 1
+    lat = np.asarray(latencies) * 1000
+    return {
+        "method": name,
+        **{f"recall@{k}": hits[k] / len(queries) for k in ks},
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vs-dir", default=os.path.join(ROOT, DEFAULT_VS_SUBPATH))
+    parser.add_argument("--queries", help="JSONL con consultas y relevantes")
+    parser.add_argument("--n", type=int, default=200, help="consultas sintéticas")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--embeddings", help="backend de embeddings (por defecto, el del manifiesto)")
+    parser.add_argument("--model", help="modelo de embeddings (por defecto, el del manifiesto)")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"))
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    recorded = recorded_embedding(args.vs_dir) or {}
+    embeddings = make_embeddings(args.embeddings or recorded.get("backend") or "openai",
+                                 args.model or recorded.get("model"),
+                                 api_key=os.getenv("OPENAI_API_KEY", "sk-local"), base_url=args.base_url)
+    service = RetrievalService(embeddings, vs_subpath=os.path.abspath(args.vs_dir))
+    entry = service.entry()
+    store = ChunkStore(args.vs_dir)
+
+    if args.queries:
+        queries = load_queries(args.queries)
+    else:
+        live_ids = np.unique(np.asarray(entry.sparse.docs)) if entry.sparse is not None else np.arange(len(store))
+        queries = synthetic_queries(store, live_ids, args.n)
+
+    # Embeddings de consulta fuera de la medición: se compara el coste de buscar
+    vectors = embed_queries(embeddings, [q["query"] for q in queries])
+    depth = max(max(args.k), args.fetch_k)
+
+    def dense(i, q):
+        return service.search_ids(vectors[i], depth)
+
+    def bm25(i, q):
+        return entry.sparse.search(q["query"], k=depth)[0]
+
+    def hybrid(i, q):
+        return service.hybrid_search_ids(q["query"], vectors[i], depth, fetch_k=args.fetch_k)
+
+    methods = [("dense", dense)] + ([("bm25", bm25), ("hybrid", hybrid)] if entry.sparse is not None else [])
+    results = []
+    for name, fn in methods:
+        entry.queries.clear()
+        results.append(evaluate(name, fn, queries, args.k, store))
+        if name == "dense":
+            entry.queries.clear()
+            t0 = time.perf_counter()
+            rankings = service.search_vectors(vectors, depth)
+            per_query = (time.perf_counter() - t0) / len(queries)
+            results.append(summarize("dense-lote", rankings, [per_query] * len(queries), queries, args.k, store))
+
+    header = f"{'método':<12}" + "".join(f"{'R@' + str(k):>9}" for k in args.k) + f"{'p50 ms':>10}{'p95 ms':>10}"
+    print(f"{len(queries)} consultas\n{header}")
+    for r in results:
+        print(f"{r['method']:<12}" + "".join(f"{r[f'recall@{k}']:>9.3f}" for k in args.k)
+              + f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"queries": len(queries), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+bench/fake_openai_server.py
+
+Servidor local compatible con la API de OpenAI para pruebas y benchmarks sin
+red ni coste:
+
+  - POST /v1/chat/completions  (con y sin `stream`, en formato SSE)
+  - POST /v1/embeddings        (vectores deterministas a partir del texto)
+
+Permite simular latencia hasta el primer token, ritmo de tokens y una
+fracción de respuestas 429 para ejercitar los reintentos de llm_backend.py.
+
+Uso:
+    python bench/fake_openai_server.py --port 8765 --ttft-ms 200 --token-ms 10
+    # y en .streamlit/secrets.toml:  [openai] base_url = "http://127.0.0.1:8765/v1"
+"""
+
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = (
+    "Para crecer en Instagram publica reels cortos tres veces por semana, "
+    "responde a cada comentario durante la primera hora y cierra cada "
+    "publicación con una llamada a la acción clara."
+)
+
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    """
+    Vector pseudoaleatorio y determinista para `text`, normalizado.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    vec = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = {
+        "ttft_s": 0.0,
+        "token_s": 0.0,
+        "fail_rate": 0.0,
+        "answer": DEFAULT_ANSWER,
+        "dim": 1536,
+    }
+    stats = {"chat": 0, "embeddings": 0, "rate_limited": 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if random.random() < self.config["fail_rate"]:
+            self._count("rate_limited")
+            self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                            {"retry-after": "0.05"})
+            return
+        if self.path.endswith("/chat/completions"):
+            self._count("chat")
+            self._chat(body)
+        elif self.path.endswith("/embeddings"):
+            self._count("embeddings")
+            self._embeddings(body)
+        else:
+            self._send_json(404, {"error": {"message": f"ruta desconocida {self.path}"}})
+
+    def _tokens(self) -> list[str]:
+        words = self.config["answer"].split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    def _chat(self, body: dict):
+        model = body.get("model", "fake")
+        time.sleep(self.config["ttft_s"])
+        if not body.get("stream"):
+            time.sleep(self.config["token_s"] * len(self._tokens()))
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": self.config["answer"]}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for i, tok in enumerate(self._tokens()):
+            if i:
+                time.sleep(self.config["token_s"])
+            send_event(json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}],
+            }))
+        send_event(json.dumps({
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk",
+            "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _embeddings(self, body: dict):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = int(body.get("dimensions") or self.config["dim"])
+        data = []
+        for i, text in enumerate(inputs):
+            if not isinstance(text, str):  # tokens ya codificados
+                text = json.dumps(text)
+            data.append({"object": "embedding", "index": i, "embedding": fake_embedding(text, dim)})
+        self._send_json(200, {"object": "list", "data": data, "model": body.get("model", "fake"),
+                              "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+
+def serve_in_thread(port: int = 0, **config):
+    """
+    Arranca el servidor en un hilo y devuelve (server, base_url).
+    `config` acepta ttft_s, token_s, fail_rate, answer y dim.
+    """
+    FakeOpenAIHandler.config = {**FakeOpenAIHandler.config, **config}
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft-ms", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+    FakeOpenAIHandler.config.update(ttft_s=args.ttft_ms / 1000, token_s=args.token_ms / 1000,
+                                    fail_rate=args.fail_rate, dim=args.dim)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeOpenAIHandler)
+    print(f"Servidor OpenAI falso en http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+bench/import_profile.py
+
+Perfil de imports de app.py con `python -X importtime`: ejecuta solo las
+sentencias de import de nivel de módulo de app.py (lo que Streamlit carga
+antes del primer render) en un intérprete nuevo y resume:
+
+  - tiempo total de import (mínimo de --repeat ejecuciones),
+  - paquetes de primer nivel más costosos (tiempo acumulado),
+  - qué dependencias pesadas (pandas, faiss, PyPDF2, openai...) se cargan.
+
+Con --baseline REV perfila además app.py de otra revisión de git (extraída
+a un directorio temporal con `git archive`) para comparar.
+
+Uso:
+    python bench/import_profile.py
+    python bench/import_profile.py --baseline HEAD~1 --repeat 5
+"""
+
+import os
+import re
+import ast
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = (
+    "pandas", "pyarrow", "PyPDF2", "faiss", "openai", "httpx", "langchain_openai",
+    "langchain_community", "langchain.chains", "langchain.vectorstores", "langchain_text_splitters",
+)
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def app_imports(tree_dir: str) -> str:
+    """
+    Sentencias de import de nivel de módulo de app.py (incluidas las de
+    bloques try), como código ejecutable.
+    """
+    with open(os.path.join(tree_dir, "app.py"), "r", encoding="utf-8") as f:
+        module = ast.parse(f.read())
+    statements = []
+    for node in module.body:
+        nodes = [node] + (node.body if isinstance(node, ast.Try) else [])
+        statements += [ast.unparse(n) for n in nodes if isinstance(n, (ast.Import, ast.ImportFrom))]
+    return "\n".join(statements)
+
+
+def profile_once(tree_dir: str) -> dict:
+    """
+    Un intérprete nuevo con -X importtime; devuelve el total y el tiempo
+    acumulado de cada módulo importado.
+    """
+    code = "import sys\nsys.path.insert(0, '.')\n" + app_imports(tree_dir)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=tree_dir,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Fallo al importar app.py en {tree_dir}:\n{proc.stderr[-2000:]}")
+    cumulative, top_level = {}, {}
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        cum_us, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        cumulative[name] = cum_us
+        if not indent:
+            root = name.split(".")[0]
+            top_level[root] = top_level.get(root, 0) + cum_us
+    return {"total_ms": sum(top_level.values()) / 1000, "modules": cumulative, "top_level": top_level}
+
+
+def profile(tree_dir: str, repeat: int) -> dict:
+    runs = [profile_once(tree_dir) for _ in range(repeat)]
+    return min(runs, key=lambda r: r["total_ms"])
+
+
+def extract_revision(rev: str, out_dir: str) -> str:
+    """
+    Copia el árbol de `rev` a `out_dir` (sin historial) con git archive.
+    """
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", out_dir], input=archive.stdout, check=True)
+    return out_dir
+
+
+def report(label: str, result: dict, top: int):
+    print(f"\n{label}: {result['total_ms']:.0f} ms, {len(result['modules'])} módulos")
+    for name, us in sorted(result["top_level"].items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {name:<28}{us / 1000:>9.1f} ms")
+    loaded = [m for m in HEAVY_MODULES if m in result["modules"]]
+    print("  pesados cargados: " + (", ".join(loaded) if loaded else "ninguno"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", help="revisión de git con la que comparar (p. ej. HEAD~1)")
+    parser.add_argument("--repeat", type=int, default=3, help="ejecuciones por árbol (se toma la mínima)")
+    parser.add_argument("--top", type=int, default=12, help="paquetes a listar")
+    args = parser.parse_args()
+
+    current = profile(ROOT, args.repeat)
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tmp:
+            base = profile(extract_revision(args.baseline, tmp), args.repeat)
+        report(f"base ({args.baseline})", base, args.top)
+    report("actual", current, args.top)
+    if args.baseline:
+        saved = base["total_ms"] - current["total_ms"]
+        print(f"\nimports de app.py: {base['total_ms']:.0f} ms → {current['total_ms']:.0f} ms "
+              f"({saved:+.0f} ms ahorrados, {saved / base['total_ms']:+.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+bm25.py
+
+Índice disperso BM25 sobre los mismos fragmentos del chunk store, guardado
+junto a 'index.faiss':
+
+  - bm25.vocab.json   → {"terms": {término: id}, "k1", "b", "num_docs"}
+  - bm25.indptr.npy   → inicio de la lista de postings de cada término (CSR)
+  - bm25.docs.npy     → ids de fragmento (fila del chunk store) por posting
+  - bm25.weights.npy  → peso BM25 ya calculado (idf · tf saturado) por posting
+
+Como los pesos se precalculan al construir, puntuar una consulta es sumar
+los postings de sus términos: un `np.bincount` sobre arrays mapeados en
+memoria. El tokenizador conserva hashtags (#marca → "#marca" y "marca") y
+normaliza tildes, útil para nombres de marca y términos de marketing.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import re
+import json
+import math
+import unicodedata
+from array import array
+from collections import Counter
+
+import numpy as np
+
+VOCAB_FILE = "bm25.vocab.json"
+INDPTR_FILE = "bm25.indptr.npy"
+DOCS_FILE = "bm25.docs.npy"
+WEIGHTS_FILE = "bm25.weights.npy"
+BM25_FILES = (VOCAB_FILE, INDPTR_FILE, DOCS_FILE, WEIGHTS_FILE)
+
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+_TOKEN_RE = re.compile(r"#?\w+", re.UNICODE)
+STOPWORDS = frozenset("""
+a al algo como con de del el ella en era es esa ese eso esta este esto han hay
+la las le les lo los mas me mi muy no nos o para pero por que se si sin son su
+sus te tu un una uno unos y ya yo
+an and are as at be but by for from has have he i if in into is it its of on
+or our she so that the their them there they this to was we were what when
+which who will with you your
+""".split())
+
+
+def has_bm25(index_dir: str) -> bool:
+    return all(os.path.isfile(os.path.join(index_dir, name)) for name in BM25_FILES)
+
+
+def _fold(text: str) -> str:
+    """
+    Minúsculas y sin tildes (campaña → campana, acción → accion).
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Tokens para BM25: palabras sin stopwords; los hashtags se indexan con y
+    sin '#', para que "#marca" y "marca" se encuentren mutuamente.
+    """
+    tokens = []
+    for tok in _TOKEN_RE.findall(_fold(text)):
+        if tok.startswith("#"):
+            tokens.append(tok)
+            tok = tok[1:]
+        if len(tok) > 1 and tok not in STOPWORDS:
+            tokens.append(tok)
+    return tokens
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Construcción
+# ───────────────────────────────────────────────────────────────────────────────
+def build_bm25(docs, out_dir: str, k1: float = DEFAULT_K1, b: float = DEFAULT_B,
+               publish: bool = True) -> int:
+    """
+    Construye y guarda el índice a partir de un iterable de (id, texto).
+    Devuelve el número de documentos indexados. Con `publish=False` los
+    archivos quedan como '.tmp' para que quien llama los publique.
+    """
+    terms = {}
+    postings = []   # por término: array de (doc_id, tf) intercalados
+    doc_lens = {}
+    for doc_id, text in docs:
+        counts = Counter(tokenize(text))
+        doc_lens[doc_id] = sum(counts.values())
+        for term, tf in counts.items():
+            tid = terms.setdefault(term, len(terms))
+            if tid == len(postings):
+                postings.append(array("q"))
+            postings[tid].extend((doc_id, tf))
+
+    num_docs = len(doc_lens)
+    avgdl = (sum(doc_lens.values()) / num_docs) if num_docs else 0.0
+    indptr = np.zeros(len(terms) + 1, dtype="int64")
+    for tid, plist in enumerate(postings):
+        indptr[tid + 1] = indptr[tid] + len(plist) // 2
+    docs_arr = np.empty(indptr[-1], dtype="int64")
+    weights = np.empty(indptr[-1], dtype="float32")
+
+    for tid, plist in enumerate(postings):
+        pairs = np.frombuffer(plist, dtype="int64").reshape(-1, 2)
+        ids, tf = pairs[:, 0], pairs[:, 1].astype("float64")
+        df = len(ids)
+        idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+        dl = np.fromiter((doc_lens[i] for i in ids), dtype="float64", count=df)
+        norm = k1 * (1 - b + b * dl / (avgdl or 1.0))
+        start, end = indptr[tid], indptr[tid + 1]
+        docs_arr[start:end] = ids
+        weights[start:end] = idf * tf * (k1 + 1) / (tf + norm)
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = ((INDPTR_FILE, indptr), (DOCS_FILE, docs_arr), (WEIGHTS_FILE, weights))
+    for name, arr in arrays:
+        with open(os.path.join(out_dir, name + ".tmp"), "wb") as f:
+            np.save(f, arr)
+    with open(os.path.join(out_dir, VOCAB_FILE + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump({"terms": terms, "k1": k1, "b": b, "num_docs": num_docs}, f, ensure_ascii=False)
+    if not publish:
+        return num_docs
+    for name in (INDPTR_FILE, DOCS_FILE, WEIGHTS_FILE, VOCAB_FILE):
+        os.replace(os.path.join(out_dir, name + ".tmp"), os.path.join(out_dir, name))
+    return num_docs
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Consulta
+# ───────────────────────────────────────────────────────────────────────────────
+def ids_in_ranges(ids: np.ndarray, id_ranges: np.ndarray) -> np.ndarray:
+    """
+    Máscara de los `ids` que caen en algún rango [inicio, fin) de
+    `id_ranges` (array (m, 2) ordenado por inicio y sin solapes).
+    """
+    if not len(id_ranges):
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.searchsorted(id_ranges[:, 0], ids, side="right") - 1
+    return (pos >= 0) & (ids < id_ranges[np.maximum(pos, 0), 1])
+
+
+class BM25Index:
+    """
+    Índice BM25 de solo lectura con los postings mapeados en memoria.
+    """
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, VOCAB_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.terms = meta["terms"]
+        self.num_docs = meta["num_docs"]
+        self.indptr = np.load(os.path.join(index_dir, INDPTR_FILE), mmap_mode="r")
+        self.docs = np.load(os.path.join(index_dir, DOCS_FILE), mmap_mode="r")
+        self.weights = np.load(os.path.join(index_dir, WEIGHTS_FILE), mmap_mode="r")
+
+    def search(self, query: str, k: int = 4, id_ranges: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Devuelve (ids, puntuaciones) de los k fragmentos con mayor BM25,
+        ordenados de mayor a menor. Arrays vacíos si ningún término coincide.
+        Con `id_ranges` (ver `ids_in_ranges`) solo compiten esos fragmentos.
+        """
+        tids = {self.terms[t] for t in tokenize(query) if t in self.terms}
+        if not tids:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        slices = [(self.indptr[t], self.indptr[t + 1]) for t in tids]
+        ids = np.concatenate([self.docs[s:e] for s, e in slices])
+        w = np.concatenate([self.weights[s:e] for s, e in slices])
+        uniq, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=w).astype("float32")
+        if id_ranges is not None:
+            keep = ids_in_ranges(uniq, id_ranges)
+            uniq, scores = uniq[keep], scores[keep]
+            if not len(uniq):
+                return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        k = min(k, len(uniq))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return uniq[top], scores[top]
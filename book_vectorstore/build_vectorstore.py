@@ -3,66 +3,542 @@
 """
 Script para construir y guardar tu FAISS vectorstore a partir de EPUBs.
 Úsalo solo una vez (o cuando agregues más libros).
+
+La ingesta funciona como un pipeline en streaming:
+  1) Un pool de procesos parsea los EPUB (ebooklib + BeautifulSoup) en paralelo;
+     el texto extraído se cachea por hash del archivo (ingest.py, compartido
+     con cost.py).
+  2) Cada capítulo se fragmenta y los chunks fluyen por un generador.
+  3) Los chunks se agrupan en lotes que se embeben en paralelo (hilos) y se
+     añaden al índice FAISS; los textos van directo al chunk store en disco.
+En memoria solo viven unos pocos libros y lotes a la vez, no la biblioteca.
+
+Las reconstrucciones son incrementales: 'manifest.json' guarda el hash de
+cada EPUB y de cada uno de sus fragmentos. Solo se parsean los libros nuevos o
+modificados, solo se embeben los fragmentos cuyo hash no existía, y los
+fragmentos de libros eliminados se borran del índice (IndexIDMap2, donde el id
+de cada vector es su fila en el chunk store). Indicar algunos EPUB actualiza
+solo esos: los demás libros del índice se conservan mientras su archivo siga
+en la carpeta, salvo con `--prune`.
+
+Junto al índice denso se guarda un índice BM25 (bm25.py) para la búsqueda
+híbrida de la app.
+
+Tipo de índice denso (`--index`):
+  - flat   → búsqueda exacta (por defecto); coste lineal en el nº de fragmentos.
+  - ivf    → IVF-Flat: k-means en `nlist` listas, se exploran `nprobe`.
+  - hnsw   → grafo HNSW; se ajusta con `efSearch`.
+  - ivfpq  → IVF con Product Quantization: vectores comprimidos (~24x menos).
+Con un tipo aproximado, el índice plano con ids se conserva como maestro en
+'index.flat.faiss' (es el que se actualiza incrementalmente) e 'index.faiss'
+se regenera a partir de él, entrenando sobre una muestra.
+
+Uso:
+    python build_vectorstore.py                 # todos los .epub de esta carpeta
+    python build_vectorstore.py libro1.epub libro2.epub   # añade o actualiza esos libros
+    python build_vectorstore.py --prune libro1.epub       # el índice queda solo con libro1
+    python build_vectorstore.py --full          # ignora el manifiesto
+    python build_vectorstore.py --index ivf     # índice aproximado
 """
 
 import os
-import pickle
+import sys
+import json
+import glob
+import math
+import argparse
+from itertools import islice
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
 from dotenv import load_dotenv
-from ebooklib import epub
-from ebooklib.epub import EpubHtml
-from bs4 import BeautifulSoup
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
-
-# 1) Carga API key desde .env o entorno
-load_dotenv()  # Busca un archivo .env en cwd
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("Falta la variable OPENAI_API_KEY en el entorno o en .env")
-
-def epub_to_document(epub_path: str) -> Document:
-    """
-    Convierte un archivo .epub a un objeto langchain.schema.Document.
-    """
-    book = epub.read_epub(epub_path)
-    full_text = []
-    for item in book.get_items():
-        if isinstance(item, EpubHtml):
-            soup = BeautifulSoup(item.get_body_content(), "html.parser")
-            full_text.append(soup.get_text(separator="\n"))
-    return Document(
-        page_content="\n".join(full_text),
-        metadata={"source": os.path.basename(epub_path)}
-    )
 
+# Módulos propios (raíz del repositorio)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from chunkstore import ChunkStore, ChunkStoreWriter, has_chunk_store
+from embedding_cache import CachedEmbeddings
+from embedding_backends import (
+    DEFAULT_FASTEMBED_MODEL,
+    DEFAULT_OPENAI_MODEL,
+    EMBEDDING_BACKENDS,
+    make_embeddings
+)
+from bm25 import BM25_FILES, build_bm25, has_bm25
+from ingest import (
+    bounded_map,
+    chunk_hash,
+    file_hash,
+    iter_chunks,
+    make_splitter
+)
+
+EMBED_BATCH_SIZE = 256
+EMBED_WORKERS = 4
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+FLAT_INDEX_NAME = "index.flat.faiss"
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+MIN_POINTS_PER_LIST = 39      # mínimo de k-means en FAISS por centroide
+TRAIN_POINTS_PER_LIST = 64    # tamaño de la muestra de entrenamiento
+ADD_BATCH_SIZE = 65_536
+
+
+def get_openai_api_key() -> str:
+    """
+    Carga la API key desde .env (cwd) o el entorno.
+    """
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Falta la variable OPENAI_API_KEY en el entorno o en .env")
+    return api_key
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Pipeline en streaming
+# ───────────────────────────────────────────────────────────────────────────────
+def batched(iterable, n: int):
+    """
+    Agrupa un iterable en listas de hasta `n` elementos.
+    """
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Manifiesto de hashes
+# ───────────────────────────────────────────────────────────────────────────────
+def _empty_manifest() -> dict:
+    return {"version": MANIFEST_VERSION, "next_id": 0, "ntotal": 0, "files": {}}
+
+
+def load_manifest(output_dir: str) -> dict:
+    """
+    Lee 'manifest.json' o devuelve uno vacío.
+
+    Estructura:
+      {"version", "next_id", "ntotal",
+       "files": {nombre: {"sha256": ..., "chunks": [[hash, id], ...]}}}
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _empty_manifest()
+    if manifest.get("version") != MANIFEST_VERSION:
+        return _empty_manifest()
+    return manifest
+
+
+def save_manifest(output_dir: str, manifest: dict, publish: bool = True):
+    """
+    Guarda el manifiesto de forma atómica (con `publish=False`, solo el '.tmp').
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    if publish:
+        os.replace(path + ".tmp", path)
+
+
+def _load_incremental_index(output_dir: str, manifest: dict):
+    """
+    Devuelve el índice existente si admite actualizaciones por id y coincide
+    con el manifiesto; None si hay que reconstruir desde cero.
+    """
+    faiss_path = _master_path(output_dir)
+    if not manifest["files"] or not os.path.isfile(faiss_path) or not has_chunk_store(output_dir):
+        return None
+    if len(ChunkStore(output_dir)) != manifest["next_id"]:
+        print("ℹ️  Chunk store desalineado con el manifiesto: reconstrucción completa")
+        return None
+    index = faiss.read_index(faiss_path)
+    if not isinstance(index, faiss.IndexIDMap2) or index.ntotal != manifest["ntotal"]:
+        print("ℹ️  Índice sin manifiesto compatible: reconstrucción completa")
+        return None
+    return index
+
+
+def _build_sparse_index(output_dir: str, files: dict, staged: bool = False):
+    """
+    (Re)construye el índice BM25 sobre los fragmentos vivos del manifiesto.
+    No requiere embeddings: coste de tokenizar el corpus, sin llamadas a la API.
+    Con `staged=True` lee el chunk store sin publicar y deja el BM25 en '.tmp'.
+    """
+    store = ChunkStore(output_dir, staged=staged)
+    live_ids = sorted(cid for entry in files.values() for _, cid in entry["chunks"])
+    n = build_bm25(((i, store.text(i)) for i in live_ids), output_dir, publish=not staged)
+    print(f"   Índice BM25: {n} fragmentos")
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Índices aproximados (ANN)
+# ───────────────────────────────────────────────────────────────────────────────
+def _master_path(output_dir: str) -> str:
+    """
+    Índice plano con ids (maestro de las actualizaciones incrementales):
+    'index.flat.faiss' si se sirve un índice aproximado, si no 'index.faiss'.
+    """
+    path = os.path.join(output_dir, FLAT_INDEX_NAME)
+    return path if os.path.isfile(path) else os.path.join(output_dir, "index.faiss")
+
+
+def _write_index(index, path: str, publish: bool = True):
+    """
+    Escritura atómica: los procesos que sirven el índice nunca leen uno a medias.
+    """
+    faiss.write_index(index, path + ".tmp")
+    if publish:
+        os.replace(path + ".tmp", path)
+
+
+def default_nlist(n: int) -> int:
+    """
+    ~4·√n listas, con al menos MIN_POINTS_PER_LIST vectores por lista.
+    """
+    return max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_LIST))
+
+
+def default_pq_m(dim: int) -> int:
+    """
+    Mayor nº de subcuantizadores que divide la dimensión, con al menos 4
+    dimensiones por subvector y como mucho 64 (1536 dims → 64 bytes/vector).
+    """
+    return next(m for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1) if dim % m == 0 and m * 4 <= max(dim, 4))
+
+
+def master_vectors(master) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (vectores, ids) de un IndexIDMap2(IndexFlatL2) sin copiarlos: vistas
+    numpy sobre la memoria del propio índice.
+    """
+    flat = faiss.downcast_index(master.index)
+    n, dim = flat.ntotal, flat.d
+    vectors = faiss.rev_swig_ptr(flat.get_xb(), n * dim).reshape(n, dim)
+    return vectors, faiss.vector_to_array(master.id_map)
+
+
+def build_ann_index(vectors: np.ndarray, ids: np.ndarray, index_type: str = "flat",
+                    nlist: int = None, pq_m: int = None, hnsw_m: int = HNSW_M,
+                    nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH,
+                    seed: int = 0):
+    """
+    Construye un índice FAISS del tipo pedido con `ids` como etiquetas.
+
+    Los tipos IVF se entrenan sobre una muestra aleatoria de
+    TRAIN_POINTS_PER_LIST·nlist vectores. `nprobe` y `efSearch` se guardan
+    en el propio índice como valores por defecto de búsqueda (se pueden
+    cambiar al cargar, ver `initialize_vectorstore`).
+
+    Raises:
+      ValueError: si `index_type` no es uno de INDEX_TYPES.
+    """
+    n, dim = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    elif index_type == "hnsw":
+        # HNSW no admite ids propios: se envuelve en un IDMap2
+        hnsw = faiss.IndexHNSWFlat(dim, hnsw_m)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = ef_search
+        index = faiss.IndexIDMap2(hnsw)
+    elif index_type in ("ivf", "ivfpq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            # 8 bits por código salvo corpus diminutos (k-means necesita ≥ 2^nbits puntos)
+            nbits = max(1, min(8, int(math.log2(max(n, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m or default_pq_m(dim), nbits)
+        sample_size = min(n, nlist * TRAIN_POINTS_PER_LIST)
+        rng = np.random.default_rng(seed)
+        sample = vectors if sample_size == n else vectors[np.sort(rng.choice(n, sample_size, replace=False))]
+        index.train(np.ascontiguousarray(sample, dtype="float32"))
+        index.nprobe = min(nprobe, nlist)
+    else:
+        raise ValueError(f"Tipo de índice desconocido: {index_type!r} (opciones: {', '.join(INDEX_TYPES)})")
+
+    for start in range(0, n, ADD_BATCH_SIZE):
+        index.add_with_ids(np.ascontiguousarray(vectors[start:start + ADD_BATCH_SIZE]),
+                           np.ascontiguousarray(ids[start:start + ADD_BATCH_SIZE], dtype="int64"))
+    return index
+
+
+def _index_info(index_type: str, params: dict) -> dict:
+    """
+    Descripción del índice servido que se guarda en el manifiesto.
+    """
+    if index_type == "flat":
+        return {"type": "flat"}
+    return {"type": index_type, **{k: v for k, v in params.items() if v is not None}}
+
+
+def _save_dense_index(output_dir: str, master, index_type: str, publish: bool = True, **params) -> dict:
+    """
+    Guarda el índice que sirve la app ('index.faiss') y, si es aproximado,
+    el maestro plano en 'index.flat.faiss'. Devuelve la descripción para el
+    manifiesto. Con `publish=False` los deja en '.tmp' (ver `_publish_staged`).
+    """
+    faiss_path = os.path.join(output_dir, "index.faiss")
+    flat_path = os.path.join(output_dir, FLAT_INDEX_NAME)
+    if index_type == "flat":
+        _write_index(master, faiss_path, publish=publish)
+        if publish and os.path.isfile(flat_path):
+            os.remove(flat_path)
+        return {"type": "flat"}
+    info = _index_info(index_type, params)
+    _write_index(master, flat_path, publish=publish)
+    vectors, ids = master_vectors(master)
+    ann = build_ann_index(vectors, ids, index_type, **{k: v for k, v in info.items() if k != "type"})
+    _write_index(ann, faiss_path, publish=publish)
+    print(f"   Índice {index_type} regenerado desde el maestro ({len(ids)} vectores)")
+    return info
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Publicación
+# ───────────────────────────────────────────────────────────────────────────────
+STAGED_FILES = BM25_FILES + (FLAT_INDEX_NAME, "index.faiss", MANIFEST_NAME)
+
+
+def _publish_staged(output_dir: str, writer: ChunkStoreWriter, index_type: str):
+    """
+    Publica una construcción preparada en '.tmp': chunk store, BM25, índices
+    y, al final, el manifiesto. El manifiesto hace de marca de generación:
+    vectorstore.py rechaza un índice o chunk store que no cuadre con él, así
+    la app nunca sirve textos nuevos con el índice viejo entre dos renombres.
+    """
+    writer.publish()
+    for name in STAGED_FILES[:-1]:
+        tmp = os.path.join(output_dir, name + ".tmp")
+        if os.path.isfile(tmp):
+            os.replace(tmp, os.path.join(output_dir, name))
+    flat_path = os.path.join(output_dir, FLAT_INDEX_NAME)
+    if index_type == "flat" and os.path.isfile(flat_path):
+        os.remove(flat_path)
+    os.replace(os.path.join(output_dir, MANIFEST_NAME + ".tmp"), os.path.join(output_dir, MANIFEST_NAME))
+
+
+def _discard_staged(output_dir: str, writer: ChunkStoreWriter):
+    """
+    Descarta una construcción fallida: lo publicado queda intacto.
+    """
+    writer.abort()
+    for name in STAGED_FILES:
+        try:
+            os.remove(os.path.join(output_dir, name + ".tmp"))
+        except FileNotFoundError:
+            pass
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Construcción
+# ───────────────────────────────────────────────────────────────────────────────
 def build_vectorstore(epub_paths: list[str],
-                      output_dir: str = "vectorstores/books_faiss"):
+                      output_dir: str = "vectorstores/books_faiss",
+                      batch_size: int = EMBED_BATCH_SIZE,
+                      max_workers: int = None,
+                      embed_workers: int = EMBED_WORKERS,
+                      full: bool = False,
+                      index_type: str = "flat",
+                      embedding_backend: str = "openai",
+                      embedding_model: str = None,
+                      prune: bool = False,
+                      **index_params):
     """
     Lee cada .epub de la lista, los fragmenta, genera embeddings y guarda
-    el FAISS index + pickle en `output_dir`.
-    """
-    # 2) EPUB → Document
-    docs = [epub_to_document(p) for p in epub_paths]
+    el FAISS index + chunk store en `output_dir`.
 
-    # 3) Fragmentación
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = splitter.split_documents(docs)
+    Si hay un manifiesto previo compatible, solo procesa los cambios: libros
+    nuevos o modificados se parsean, sus fragmentos nuevos se embeben y se
+    añaden con `add_with_ids`, y los fragmentos que ya no existen se eliminan
+    del índice. Los libros indexados que no están en `epub_paths` se
+    conservan, salvo con `prune=True` o si su archivo ya no está en la
+    carpeta de ninguno de los EPUB indicados. Las filas eliminadas quedan
+    huérfanas en el chunk store hasta un `full=True`.
 
-    # 4) Embeddings y FAISS
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-    vectorstore = FAISS.from_documents(chunks, embeddings)
+    Args:
+      epub_paths: rutas a los .epub que se añaden o actualizan.
+      output_dir: directorio de salida ('index.faiss' + chunk store + manifiesto).
+      batch_size: fragmentos por llamada a `embed_documents`.
+      max_workers: procesos para parsear EPUBs (por defecto, núcleos).
+      embed_workers: llamadas de embeddings concurrentes.
+      full: si True, ignora el manifiesto y reconstruye todo.
+      index_type: tipo de índice servido (ver INDEX_TYPES).
+      embedding_backend: "openai" o "fastembed" (local); ver embedding_backends.py.
+      embedding_model: modelo del backend (por defecto, el del backend).
+      prune: si True, `epub_paths` es la biblioteca completa y los demás
+             libros se eliminan del índice.
+      **index_params: nlist, pq_m, hnsw_m, nprobe, ef_search para `build_ann_index`.
 
-    # 5) Guardado local
+    Raises:
+      ValueError: si `epub_paths` está vacío, o con un tipo de índice o
+                  backend de embeddings desconocido.
+    """
+    if not epub_paths:
+        raise ValueError("No hay EPUBs que indexar: indica las rutas o deja los .epub junto al script")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {index_type!r} (opciones: {', '.join(INDEX_TYPES)})")
+    if embedding_backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend de embeddings desconocido: {embedding_backend!r} "
+                         f"(opciones: {', '.join(EMBEDDING_BACKENDS)})")
+    embedding_model = embedding_model or (
+        DEFAULT_FASTEMBED_MODEL if embedding_backend == "fastembed" else DEFAULT_OPENAI_MODEL)
     os.makedirs(output_dir, exist_ok=True)
-    vectorstore.save_local(output_dir)
-    print(f"✅ Vectorstore guardado en '{output_dir}'")
+    manifest = _empty_manifest() if full else load_manifest(output_dir)
+    # Los manifiestos anteriores a los backends siempre usaron OpenAI ada-002
+    recorded = manifest.get("embedding", {"backend": "openai", "model": DEFAULT_OPENAI_MODEL})
+    if manifest["files"] and (recorded["backend"], recorded["model"]) != (embedding_backend, embedding_model):
+        print(f"ℹ️  Cambio de embeddings ({recorded['backend']}:{recorded['model']} → "
+              f"{embedding_backend}:{embedding_model}): reconstrucción completa")
+        manifest = _empty_manifest()
+    index = None if full else _load_incremental_index(output_dir, manifest)
+    if index is None:
+        manifest = _empty_manifest()
+    old_files = manifest["files"]
+
+    # 1) Diferencias por hash de archivo
+    hashes = {os.path.basename(p): file_hash(p) for p in epub_paths}
+    changed = [p for p in epub_paths
+               if old_files.get(os.path.basename(p), {}).get("sha256") != hashes[os.path.basename(p)]]
+    # Libros indexados que no se indicaron: se conservan salvo con `prune` o si
+    # su archivo ya no está en las carpetas de los EPUB indicados
+    library_dirs = {os.path.dirname(os.path.abspath(p)) for p in epub_paths}
+    pruned = [name for name in old_files if name not in hashes and (
+        prune or not any(os.path.isfile(os.path.join(d, name)) for d in library_dirs))]
+    files = {name: entry for name, entry in old_files.items()
+             if hashes.get(name, entry["sha256"]) == entry["sha256"] and name not in pruned}
+    stale_ids = [cid for name in pruned for _, cid in old_files[name]["chunks"]]
+
+    # Fragmentos reutilizables de los libros modificados: hash → ids
+    reusable = {}
+    for path in changed:
+        name = os.path.basename(path)
+        pool = defaultdict(list)
+        for h, cid in old_files.get(name, {}).get("chunks", []):
+            pool[h].append(cid)
+        reusable[name] = pool
+        files[name] = {"sha256": hashes[name], "chunks": []}
+
+    if not changed and not stale_ids:
+        if index is not None and manifest.get("index", {"type": "flat"}) != _index_info(index_type, index_params):
+            # Solo cambia el tipo o los parámetros: se regenera desde el maestro
+            manifest["index"] = _save_dense_index(output_dir, index, index_type, **index_params)
+            save_manifest(output_dir, manifest)
+        if index is not None and "embedding" not in manifest:
+            manifest["embedding"] = {"backend": embedding_backend, "model": embedding_model,
+                                     "dim": int(index.d)}
+            save_manifest(output_dir, manifest)
+        if not has_bm25(output_dir):
+            _build_sparse_index(output_dir, files)
+        print(f"✅ Vectorstore al día en '{output_dir}' (sin cambios)")
+        return
+
+    # 2) Fragmentos nuevos: solo estos se embeben
+    splitter = make_splitter()
+    # Caché compartido con la app: un --full o un libro re-añadido no se vuelve a pagar
+    api_key = get_openai_api_key() if embedding_backend == "openai" else None
+    embeddings = CachedEmbeddings(make_embeddings(embedding_backend, embedding_model, api_key=api_key,
+                                                  base_url=os.getenv("OPENAI_BASE_URL")))
+
+    def new_chunks():
+        for path, text, metadata in iter_chunks(changed, splitter, max_workers=max_workers, hashes=hashes):
+            name = os.path.basename(path)
+            h = chunk_hash(text)
+            entry = files[name]["chunks"]
+            if reusable[name].get(h):
+                entry.append([h, reusable[name][h].pop()])
+                continue
+            entry.append([h, None])
+            yield entry[-1], text, metadata
+
+    def embed_batch(batch):
+        vectors = embeddings.embed_documents([text for _, text, _ in batch])
+        return batch, np.asarray(vectors, dtype="float32")
+
+    # Todo se prepara en '.tmp' y se publica junto al final (`_publish_staged`);
+    # si algo falla, lo publicado no cambia.
+    added = 0
+    writer = ChunkStoreWriter(output_dir, append=index is not None)
+    try:
+        with ThreadPoolExecutor(max_workers=embed_workers) as embed_pool:
+            for batch, vectors in bounded_map(embed_pool, embed_batch,
+                                              batched(new_chunks(), batch_size),
+                                              window=embed_workers * 2):
+                if index is None:
+                    index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+                ids = np.empty(len(batch), dtype="int64")
+                for j, (slot, text, metadata) in enumerate(batch):
+                    slot[1] = ids[j] = writer.append(text, metadata)
+                index.add_with_ids(vectors, ids)
+                added += len(batch)
+        if index is None:
+            raise ValueError("No se extrajo ningún fragmento de los EPUBs indicados")
+        writer.close(publish=False)
+        next_id = len(writer)
+
+        # 3) Eliminar fragmentos que desaparecieron
+        stale_ids += [cid for pool in reusable.values() for ids in pool.values() for cid in ids]
+        if stale_ids:
+            index.remove_ids(np.asarray(stale_ids, dtype="int64"))
+
+        # 4) Índice servido (y maestro si es aproximado), manifiesto y BM25
+        index_info = _save_dense_index(output_dir, index, index_type, publish=False, **index_params)
+        save_manifest(output_dir, {"version": MANIFEST_VERSION, "next_id": next_id,
+                                   "ntotal": int(index.ntotal), "files": files,
+                                   "index": index_info,
+                                   "embedding": {"backend": embedding_backend, "model": embedding_model,
+                                                 "dim": int(index.d)}},
+                      publish=False)
+        _build_sparse_index(output_dir, files, staged=True)
+    except BaseException:
+        _discard_staged(output_dir, writer)
+        raise
+
+    # 5) Publicar
+    _publish_staged(output_dir, writer, index_type)
+    print(f"✅ Vectorstore guardado en '{output_dir}' ({index.ntotal} fragmentos: "
+          f"{added} nuevos, {len(stale_ids)} eliminados, {len(changed)} libros procesados)")
+    stats = embeddings.stats()
+    print(f"   Caché de embeddings: {stats['hits']} aciertos, {stats['misses']} fallos "
+          f"({stats['hit_rate']:.0%})")
+
 
 if __name__ == "__main__":
-    # Ejemplo: ajusta las rutas a tus archivos .epub
-    epub_files = [
-        "assets/Nancy Harhut - Using Behavioral Science in Marketing.epub",
-        "assets/Brendan Kane - One Million Followers.epub",
-    ]
-    build_vectorstore(epub_files)
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Construye el vectorstore de libros")
+    parser.add_argument("epubs", nargs="*", help="EPUBs (por defecto, todos los de esta carpeta)")
+    parser.add_argument("--full", action="store_true", help="ignora el manifiesto")
+    parser.add_argument("--prune", action="store_true",
+                        help="elimina del índice los libros que no se indican")
+    parser.add_argument("--index", choices=INDEX_TYPES, default="flat", help="tipo de índice denso")
+    parser.add_argument("--nlist", type=int, help="listas IVF (por defecto ~4·√n)")
+    parser.add_argument("--pq-m", type=int, help="subcuantizadores PQ (ivfpq)")
+    parser.add_argument("--nprobe", type=int, help=f"listas exploradas por defecto ({DEFAULT_NPROBE})")
+    parser.add_argument("--ef-search", type=int, help=f"efSearch HNSW por defecto ({DEFAULT_EF_SEARCH})")
+    parser.add_argument("--embeddings", choices=EMBEDDING_BACKENDS, default="openai",
+                        help="backend de embeddings (fastembed = modelo local, sin red)")
+    parser.add_argument("--embedding-model", help="modelo del backend de embeddings")
+    args = parser.parse_args()
+    ann_params = {"nlist": args.nlist, "pq_m": args.pq_m}
+    if args.nprobe:
+        ann_params["nprobe"] = args.nprobe
+    if args.ef_search:
+        ann_params["ef_search"] = args.ef_search
+    build_vectorstore(args.epubs or sorted(glob.glob(os.path.join(here, "*.epub"))),
+                      output_dir=os.path.join(here, "vectorstores", "books_faiss"),
+                      full=args.full, index_type=args.index,
+                      embedding_backend=args.embeddings, embedding_model=args.embedding_model,
+                      prune=args.prune, **ann_params)
@@ -1,52 +1,150 @@
 # cost.py
 
-# --- 1) Instala dependencias:
-# pip install ebooklib beautifulsoup4 tiktoken
+"""
+Estimador de tokens y coste de embeber la biblioteca.
+
+Usa la misma extracción y fragmentación que build_vectorstore.py (ingest.py:
+RecursiveCharacterTextSplitter de 1000 caracteres por capítulo), así que
+cuenta exactamente los fragmentos que la ingesta enviará a la API:
+
+  - Un proceso por libro; el texto de cada EPUB sale del caché por hash que
+    comparten ambos scripts (solo el primer uso paga el parseo).
+  - Los tokens se cuentan con `tiktoken` `encode_batch` por libro.
+  - Informe por libro (fragmentos, tokens, coste) y total; `--json` lo guarda.
+
+Sin acceso a la codificación de tiktoken, los tokens se estiman por
+caracteres y el informe lo indica.
+
+Uso:
+    python cost.py                              # todos los .epub de esta carpeta
+    python cost.py libro1.epub libro2.epub --model text-embedding-3-small
+    python cost.py --json coste.json
+"""
 
 import os
-from ebooklib import epub
-from bs4 import BeautifulSoup
-import tiktoken
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from context_assembler import CHARS_PER_TOKEN
+from embedding_backends import DEFAULT_OPENAI_MODEL
+from ingest import TEXT_CACHE_DIR, extract_sections, make_splitter, split_sections
+
+# USD por 1k tokens
+PRICES_PER_1K_TOKENS = {
+    "text-embedding-ada-002": 0.0001,
+    "text-embedding-3-small": 0.00002,
+    "text-embedding-3-large": 0.00013,
+}
+ENCODING = "cl100k_base"   # la de todos los modelos de embeddings de OpenAI
+
+_splitter = None
+_encoding = None
 
-# Configuración
-EMBEDDING_MODEL = "text-embedding-ada-002"
-PRICE_PER_1K_TOKENS = 0.0001  # USD por 1k tokens
 
-def epub_to_text(epub_path: str) -> str:
+def _get_encoding():
     """
-    Extrae y concatena el texto de todos los capítulos de un EPUB.
+    Codificación tiktoken del proceso, o False si no se puede cargar.
     """
-    book = epub.read_epub(epub_path)
-    parts = []
-    for item in book.get_items():
-        if isinstance(item, epub.EpubHtml):
-            soup = BeautifulSoup(item.get_body_content(), "html.parser")
-            parts.append(soup.get_text(separator="\n"))
-    return "\n".join(parts)
-
-def estimate_embedding_cost(epub_paths, chunk_size=1000, chunk_overlap=200):
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING)
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def book_stats(job: tuple) -> dict:
     """
-    Estima tokens y coste para embeddings usando la misma lógica de chunks.
+    Fragmentos, caracteres y tokens de un libro. Se ejecuta en los procesos
+    del pool, por eso es una función de módulo.
+    """
+    global _splitter
+    path, cache_dir, threads = job
+    if _splitter is None:
+        _splitter = make_splitter()
+    chunks = split_sections(extract_sections(path, cache_dir=cache_dir), _splitter)
+    chars = sum(len(c) for c in chunks)
+    enc = _get_encoding()
+    if enc:
+        tokens = sum(map(len, enc.encode_batch(chunks, num_threads=threads, disallowed_special=())))
+    else:
+        tokens = sum(len(c) // CHARS_PER_TOKEN + 1 for c in chunks)
+    return {"book": os.path.basename(path), "chunks": len(chunks), "chars": chars,
+            "tokens": tokens, "exact": bool(enc)}
+
+
+def estimate_embedding_cost(epub_paths: list[str], model: str = DEFAULT_OPENAI_MODEL,
+                            price_per_1k: float = None, max_workers: int = None,
+                            cache_dir: str = TEXT_CACHE_DIR) -> dict:
+    """
+    Tokens y coste de embeber `epub_paths` con `model`.
+
+    Raises:
+      ValueError: si no hay precio conocido para `model` ni `price_per_1k`.
     """
-    enc = tiktoken.encoding_for_model(EMBEDDING_MODEL)
-    total_tokens = 0
-    step = chunk_size - chunk_overlap
+    if price_per_1k is None:
+        if model not in PRICES_PER_1K_TOKENS:
+            raise ValueError(f"Precio desconocido para {model!r}: indícalo con --price")
+        price_per_1k = PRICES_PER_1K_TOKENS[model]
+    started = time.perf_counter()
+    books = []
+    if epub_paths:
+        cpus = os.cpu_count() or 1
+        max_workers = min(max_workers or cpus, len(epub_paths))
+        # Hilos de encode_batch por libro: los núcleos que no ocupan los procesos
+        threads = max(1, cpus // max_workers)
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            books = list(pool.map(book_stats, [(p, cache_dir, threads) for p in epub_paths]))
+    for book in books:
+        book["cost_usd"] = book["tokens"] / 1000 * price_per_1k
+    total = {key: sum(b[key] for b in books) for key in ("chunks", "chars", "tokens", "cost_usd")}
+    return {
+        "model": model,
+        "price_per_1k": price_per_1k,
+        "exact": all(b["exact"] for b in books),
+        "books": books,
+        "total": total,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
 
-    for path in epub_paths:
-        text = epub_to_text(path)
-        words = text.split()
-        for i in range(0, len(words), step):
-            chunk = " ".join(words[i : i + chunk_size])
-            total_tokens += len(enc.encode(chunk))
 
-    cost_usd = (total_tokens / 1000) * PRICE_PER_1K_TOKENS
-    print(f"Total aproximado de tokens: {total_tokens:,}")
-    print(f"Costo estimado (@${PRICE_PER_1K_TOKENS}/1k tokens): ${cost_usd:.4f}")
+def print_report(report: dict):
+    width = min(60, max([len(b["book"]) for b in report["books"]] + [5]))
+    print(f"{'Libro':<{width}} {'fragmentos':>10} {'tokens':>12} {'USD':>10}")
+    for b in report["books"]:
+        name = b["book"] if len(b["book"]) <= width else b["book"][:width - 1] + "…"
+        print(f"{name:<{width}} {b['chunks']:>10,} {b['tokens']:>12,} {b['cost_usd']:>10.4f}")
+    t = report["total"]
+    print(f"{'Total':<{width}} {t['chunks']:>10,} {t['tokens']:>12,} {t['cost_usd']:>10.4f}")
+    print(f"Modelo {report['model']} @ ${report['price_per_1k']}/1k tokens; "
+          f"{len(report['books'])} libros en {report['elapsed_s']:.2f}s")
+    if not report["exact"]:
+        print(f"⚠️  tiktoken no disponible: tokens estimados (~{CHARS_PER_TOKEN} caracteres por token)")
 
 
 if __name__ == "__main__":
-    epub_files = [
-        "Nancy Harhut - Using Behavioral Science in Marketing_ Drive Customer Action and Loyalty by Prompting Instinctive Responses-Kogan Page (2022).epub",
-        "Brendan Kane - One Million Followers, Updated Edition-BenBella Books (2020).epub",
-    ]
-    estimate_embedding_cost(epub_files)
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Estima tokens y coste de embeber los EPUBs")
+    parser.add_argument("epubs", nargs="*", help="EPUBs (por defecto, todos los de esta carpeta)")
+    parser.add_argument("--model", default=DEFAULT_OPENAI_MODEL, help="modelo de embeddings de OpenAI")
+    parser.add_argument("--price", type=float, help="USD por 1k tokens (por defecto, el del modelo)")
+    parser.add_argument("--workers", type=int, help="procesos (por defecto, núcleos)")
+    parser.add_argument("--no-cache", action="store_true", help="no usar el caché de textos extraídos")
+    parser.add_argument("--json", help="guarda el informe en este archivo")
+    args = parser.parse_args()
+    report = estimate_embedding_cost(args.epubs or sorted(glob.glob(os.path.join(here, "*.epub"))),
+                                     model=args.model, price_per_1k=args.price, max_workers=args.workers,
+                                     cache_dir=None if args.no_cache else TEXT_CACHE_DIR)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
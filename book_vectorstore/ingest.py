@@ -0,0 +1,158 @@
+# book_vectorstore/ingest.py
+
+"""
+Extracción y fragmentación de EPUBs, compartida por build_vectorstore.py y
+cost.py para que el estimador cuente exactamente los fragmentos que luego se
+embeben:
+
+  1) `extract_sections`: texto de cada capítulo (ebooklib + BeautifulSoup),
+     cacheado en disco por hash del archivo. Parsear un EPUB cuesta segundos;
+     leer su texto cacheado, milisegundos.
+  2) `make_splitter`: el RecursiveCharacterTextSplitter de la ingesta
+     (CHUNK_SIZE caracteres, CHUNK_OVERLAP de solapamiento), aplicado por
+     capítulo.
+  3) `iter_chunks`: pipeline en streaming con un pool de procesos que
+     extrae los libros en paralelo.
+"""
+
+import os
+import json
+import gzip
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+TEXT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vectorstores", "text_cache")
+EXTRACT_VERSION = 1   # súbelo si cambia la extracción: invalida el caché de textos
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Hashes
+# ───────────────────────────────────────────────────────────────────────────────
+def file_hash(path: str) -> str:
+    """
+    SHA-256 del contenido de un archivo, leído por bloques.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Hash corto del texto de un fragmento.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Extracción (con caché por hash)
+# ───────────────────────────────────────────────────────────────────────────────
+def epub_to_sections(epub_path: str) -> list[str]:
+    """
+    Extrae el texto de cada capítulo (EpubHtml) de un .epub.
+    """
+    from ebooklib import epub
+    from ebooklib.epub import EpubHtml
+    from bs4 import BeautifulSoup
+
+    book = epub.read_epub(epub_path)
+    sections = []
+    for item in book.get_items():
+        if isinstance(item, EpubHtml):
+            soup = BeautifulSoup(item.get_body_content(), "html.parser")
+            sections.append(soup.get_text(separator="\n"))
+    return sections
+
+
+def _cache_path(sha: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{sha}.v{EXTRACT_VERSION}.json.gz")
+
+
+def extract_sections(path: str, sha: str = None, cache_dir: str = TEXT_CACHE_DIR) -> list[str]:
+    """
+    Capítulos de `path`, leídos del caché de textos si el archivo (por su
+    hash `sha`, que se calcula si no se da) ya se extrajo antes.
+    Con `cache_dir=None` no se usa caché.
+    """
+    if cache_dir is None:
+        return epub_to_sections(path)
+    cached = _cache_path(sha or file_hash(path), cache_dir)
+    try:
+        with gzip.open(cached, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, EOFError, OSError, json.JSONDecodeError):
+        pass
+    sections = epub_to_sections(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{cached}.{os.getpid()}.tmp"
+    # compresslevel bajo: el caché se escribe una vez por libro y se lee muchas
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=3) as f:
+        json.dump(sections, f, ensure_ascii=False)
+    os.replace(tmp, cached)
+    return sections
+
+
+def _extract_job(job: tuple) -> list[str]:
+    # Se ejecuta en los procesos del pool, por eso es una función de módulo
+    path, sha, cache_dir = job
+    return extract_sections(path, sha, cache_dir)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Fragmentación
+# ───────────────────────────────────────────────────────────────────────────────
+def make_splitter():
+    """
+    Splitter de la ingesta; cualquier estimación debe usar este mismo.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def split_sections(sections: list[str], splitter) -> list[str]:
+    """
+    Fragmentos de un libro, capítulo a capítulo.
+    """
+    return [chunk for section in sections for chunk in splitter.split_text(section)]
+
+
+def bounded_map(executor, fn, items, window: int):
+    """
+    Como `executor.map`, pero con como mucho `window` tareas en vuelo y
+    resultados en el orden de entrada. Limita la memoria cuando `fn`
+    devuelve objetos grandes (libros completos, lotes de embeddings).
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_chunks(epub_paths: list[str], splitter, max_workers: int = None,
+                hashes: dict = None, cache_dir: str = TEXT_CACHE_DIR):
+    """
+    Genera (ruta, texto, metadatos) de cada fragmento. La extracción corre
+    en un pool de procesos con una ventana de libros en vuelo proporcional a
+    los workers; `hashes` ({nombre: sha256}) evita volver a hashear.
+    """
+    if not epub_paths:
+        return
+    hashes = hashes or {}
+    jobs = [(p, hashes.get(os.path.basename(p)), cache_dir) for p in epub_paths]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(epub_paths))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        books = bounded_map(pool, _extract_job, jobs, window=max_workers * 2)
+        for path, sections in zip(epub_paths, books):
+            metadata = {"source": os.path.basename(path)}
+            for section in sections:
+                for chunk in splitter.split_text(section):
+                    yield path, chunk, metadata
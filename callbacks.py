@@ -2,44 +2,95 @@
 callbacks.py
 
 Módulo que define handlers de callback para integrar LangChain con Streamlit.
-Permite mostrar respuestas en streaming token a token y otros hooks de UI personalizados.
+Permite mostrar respuestas en streaming token a token (StreamHandler) y medir
+TTFT y tokens por segundo (StreamlitUICallbackHandler).
 """
 
 # ───────────────────────────────────────────────────────────────────────────────
 # Imports
 # ───────────────────────────────────────────────────────────────────────────────
+import time
+
 from langchain_core.callbacks import BaseCallbackHandler
 
+# Política de refresco por defecto: re-renderizar como mucho cada 50 ms o
+# cuando se acumulen 200 caracteres nuevos, lo que ocurra primero.
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_FLUSH_CHARS = 200
+
 
 # ───────────────────────────────────────────────────────────────────────────────
 # StreamHandler
 # ───────────────────────────────────────────────────────────────────────────────
 class StreamHandler(BaseCallbackHandler):
     """
-    Callback handler que muestra cada token generado por el LLM
+    Callback handler que muestra los tokens generados por el LLM
     en tiempo real dentro de un contenedor de Streamlit.
+
+    Los tokens se acumulan en un buffer y el contenedor se re-renderiza por
+    lotes (según tiempo o caracteres pendientes), en lugar de enviar el
+    documento completo al navegador con cada token.
     """
-    def __init__(self, container, initial_text: str = ""):
+    def __init__(self, container, initial_text: str = "",
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 flush_chars: int = DEFAULT_FLUSH_CHARS):
         """
         Args:
             container: objeto Streamlit que debe tener método .markdown()
                        para renderizar texto actualizado.
             initial_text (str): texto inicial antes de iniciar el streaming.
+            flush_interval (float): segundos máximos entre renderizados.
+            flush_chars (int): caracteres pendientes que fuerzan un renderizado.
+                               Con 0 se renderiza en cada token.
         """
         self.container = container
-        self.text = initial_text
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self._parts = [initial_text] if initial_text else []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self.render_calls = 0
+
+    @property
+    def text(self) -> str:
+        """
+        Texto acumulado hasta ahora (incluye lo aún no renderizado).
+        """
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
 
     def on_llm_new_token(self, token: str, **kwargs):
         """
         Método invocado por LangChain con cada nuevo token.
-        Acumula el token y re-renderiza el contenedor completo.
+        Acumula el token y re-renderiza si se cumple la política de refresco.
 
         Args:
             token (str): fragmento de texto generado por el LLM.
         """
-        self.text += token
+        self._parts.append(token)
+        self._pending_chars += len(token)
+        if (self._pending_chars >= self.flush_chars
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Renderiza el texto acumulado si hay tokens pendientes.
+        """
+        if not self._pending_chars:
+            return
         # Reemplaza el contenido previo por la nueva cadena completa
         self.container.markdown(self.text)
+        self.render_calls += 1
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def on_llm_end(self, response, **kwargs):
+        """
+        Al terminar la generación, muestra lo que quede en el buffer.
+        """
+        self.flush()
 
 
 # ───────────────────────────────────────────────────────────────────────────────
@@ -47,8 +98,53 @@ class StreamHandler(BaseCallbackHandler):
 # ───────────────────────────────────────────────────────────────────────────────
 class StreamlitUICallbackHandler(BaseCallbackHandler):
     """
-    Ejemplo de handler adicional para personalizaciones de UI en Streamlit.
-    Actualmente no implementa lógica; se puede extender según necesidades.
+    Handler de métricas del streaming: tiempo hasta el primer token (TTFT),
+    número de tokens y tokens por segundo. No renderiza nada; se usa junto
+    a StreamHandler, como callback de LangChain o llamando a sus métodos
+    desde un bucle de streaming propio.
+
+    Si se le pasa un `TurnTimer` (metrics.py), al terminar registra en él
+    `ttft_s`, `tokens`, `tokens_per_s` y la etapa `llm_stream`.
     """
-    def __init__(self):
+    def __init__(self, timer=None):
         super().__init__()
+        self.timer = timer
+        self.started = None
+        self.first_token = None
+        self.ended = None
+        self.tokens = 0
+
+    def on_llm_start(self, serialized=None, prompts=None, **kwargs):
+        self.started = time.perf_counter()
+
+    def on_chat_model_start(self, serialized=None, messages=None, **kwargs):
+        self.on_llm_start()
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self.started is None:
+            self.started = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.tokens += 1
+
+    def on_llm_end(self, response=None, **kwargs):
+        self.ended = time.perf_counter()
+        if self.timer is not None:
+            for name, value in self.stats().items():
+                self.timer.set(name, value)
+            if self.started is not None:
+                self.timer.stages["llm_stream"] = self.ended - self.started
+
+    def stats(self) -> dict:
+        """
+        {"ttft_s", "tokens", "tokens_per_s"}; la velocidad se mide desde el
+        primer token (el TTFT ya se reporta aparte).
+        """
+        ttft = None
+        if self.started is not None and self.first_token is not None:
+            ttft = self.first_token - self.started
+        rate = None
+        end = self.ended or time.perf_counter()
+        if self.first_token is not None and self.tokens > 1 and end > self.first_token:
+            rate = (self.tokens - 1) / (end - self.first_token)
+        return {"ttft_s": ttft, "tokens": self.tokens, "tokens_per_s": rate}
@@ -0,0 +1,170 @@
+"""
+chat_history.py
+
+Historial de chat acotado para sesiones largas:
+
+  1) Solo los últimos `max_rendered` mensajes quedan en la ventana visible
+     (`messages`) y se renderizan en cada rerun, así el coste por rerun no
+     crece con la duración de la sesión.
+  2) Los mensajes más antiguos se archivan por bloques, comprimidos (zlib
+     sobre JSON); el archivo también está acotado (`max_blocks`).
+  3) Cada bloque archivado se resume en segundo plano con el LLM junto con
+     el resumen anterior; el resumen acumulado (`memory`) sirve de memoria
+     conversacional en el prompt.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import json
+import zlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from context_assembler import truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+MAX_RENDERED_MESSAGES = 40
+COMPACT_BATCH = 20            # mensajes que se archivan de una vez
+MAX_ARCHIVED_BLOCKS = 50      # bloques comprimidos que se conservan
+SUMMARY_MAX_WORDS = 150
+SUMMARY_MAX_TOKENS = 300      # tope del resumen al ir al prompt
+MAX_TRANSCRIPT_CHARS = 1_500  # por mensaje, al pedir el resumen
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Resumen de turnos antiguos
+# ───────────────────────────────────────────────────────────────────────────────
+def summary_messages(previous: str, messages: list[dict]) -> list[dict]:
+    """
+    Prompt para integrar `messages` en el resumen `previous`.
+    """
+    transcript = "\n".join(
+        f"{'Usuario' if m['role'] == 'user' else 'Asistente'}: {m['content'][:MAX_TRANSCRIPT_CHARS]}"
+        for m in messages
+    )
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Resumes conversaciones entre una PYME y su asistente de marketing digital. "
+                f"Escribe en español, en {SUMMARY_MAX_WORDS} palabras como máximo, un resumen "
+                "que conserve datos concretos: productos, fechas, decisiones, preferencias y "
+                "encargos pendientes. Integra el resumen previo si lo hay."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"Resumen previo:\n{previous or '(ninguno)'}\n\nNuevos mensajes:\n{transcript}",
+        },
+    ]
+
+
+def llm_summarizer(backend, model: str):
+    """
+    Función (resumen previo, mensajes) → resumen nuevo que usa `backend`
+    (llm_backend.LLMBackend) y `model`.
+    """
+    def summarize(previous: str, messages: list[dict]) -> str:
+        return backend.complete(summary_messages(previous, messages), model=model, temperature=0).strip()
+    return summarize
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Historial acotado
+# ───────────────────────────────────────────────────────────────────────────────
+class ChatHistory:
+    """
+    Historial de una sesión: ventana visible, archivo comprimido y resumen.
+
+    Args:
+      max_rendered: mensajes como máximo en la ventana visible.
+      compact_batch: mensajes que pasan al archivo cada vez que se llena.
+      max_blocks: bloques archivados que se conservan (los más antiguos se
+                  descartan; siguen presentes en el resumen).
+    """
+    def __init__(self, max_rendered: int = MAX_RENDERED_MESSAGES,
+                 compact_batch: int = COMPACT_BATCH,
+                 max_blocks: int = MAX_ARCHIVED_BLOCKS):
+        self.max_rendered = max_rendered
+        self.compact_batch = max(1, min(compact_batch, max_rendered))
+        self.messages = []
+        self.archived_count = 0
+        self.summary = ""
+        self._blocks = deque(maxlen=max_blocks)
+        self._unsummarized = []   # bloques archivados aún sin resumir
+        self._in_flight = []      # bloques del resumen en curso
+        self._pending = None      # Future[str] del resumen en curso
+
+    def __len__(self) -> int:
+        return self.archived_count + len(self.messages)
+
+    def append(self, role: str, content: str):
+        """
+        Añade un mensaje; si la ventana se llena, archiva los más antiguos.
+        """
+        self.messages.append({"role": role, "content": content})
+        if len(self.messages) > self.max_rendered:
+            self._compact()
+
+    def clear(self):
+        self.messages = []
+        self.archived_count = 0
+        self.summary = ""
+        self._blocks.clear()
+        self._unsummarized = []
+        self._in_flight = []
+        # Un resumen en curso se ignora al terminar
+        self._pending = None
+
+    def _compact(self):
+        batch, self.messages = self.messages[:self.compact_batch], self.messages[self.compact_batch:]
+        block = zlib.compress(json.dumps(batch, ensure_ascii=False).encode("utf-8"))
+        self._blocks.append(block)
+        self._unsummarized.append(block)
+        self.archived_count += len(batch)
+
+    def archived(self) -> list[dict]:
+        """
+        Mensajes archivados que aún se conservan, del más antiguo al más reciente.
+        """
+        return [m for block in self._blocks for m in json.loads(zlib.decompress(block))]
+
+    def refresh_summary(self, summarize) -> bool:
+        """
+        Recoge el resumen terminado, si lo hay, y lanza en segundo plano el de
+        los bloques archivados pendientes con `summarize(previo, mensajes)`.
+        No bloquea. Devuelve True si el resumen cambió.
+        """
+        changed = False
+        if self._pending is not None and self._pending.done():
+            future, self._pending = self._pending, None
+            try:
+                self.summary = future.result()
+                changed = True
+            except Exception:
+                logger.exception("No se pudo resumir el historial; se reintentará en el próximo turno")
+                self._unsummarized = (self._in_flight + self._unsummarized)[-self._blocks.maxlen:]
+            self._in_flight = []
+        if self._pending is None and self._unsummarized:
+            self._in_flight, self._unsummarized = self._unsummarized, []
+            messages = [m for block in self._in_flight for m in json.loads(zlib.decompress(block))]
+            self._pending = _executor.submit(summarize, self.summary, messages)
+        return changed
+
+    @property
+    def summarizing(self) -> bool:
+        """
+        True mientras hay un resumen en curso.
+        """
+        return self._pending is not None
+
+    def memory(self, max_tokens: int = SUMMARY_MAX_TOKENS, model: str = "gpt-3.5-turbo") -> str:
+        """
+        Resumen de los turnos archivados para el prompt (vacío si no hay).
+        """
+        return truncate_tokens(self.summary, max_tokens, model) if self.summary else ""
@@ -0,0 +1,313 @@
+"""
+chunkstore.py
+
+Almacén compacto de fragmentos (chunks) en disco, alternativa al pickle del
+docstore de LangChain:
+
+  - chunks.bin      → textos concatenados en UTF-8.
+  - chunks.idx.npy  → offsets int64 (n+1) de cada texto dentro de chunks.bin.
+  - meta.bin        → metadatos de cada fila serializados como JSON.
+  - meta.idx.npy    → offsets int64 (n+1) dentro de meta.bin.
+
+La fila `i` corresponde a la posición (o id) `i` del índice FAISS. Los archivos
+se mapean en memoria y solo se decodifican las filas que devuelve una búsqueda,
+así que abrir el almacén es instantáneo y el coste en RAM lo comparten todos
+los procesos que lo usan.
+
+Uso como script (convierte un 'index.pkl' existente):
+    python chunkstore.py book_vectorstore/vectorstores/books_faiss
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import sys
+import json
+import mmap
+import pickle
+from array import array
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain.schema import Document
+
+TEXT_BLOB = "chunks.bin"
+TEXT_OFFSETS = "chunks.idx.npy"
+META_BLOB = "meta.bin"
+META_OFFSETS = "meta.idx.npy"
+STORE_FILES = (TEXT_BLOB, TEXT_OFFSETS, META_BLOB, META_OFFSETS)
+
+
+def has_chunk_store(store_dir: str) -> bool:
+    """
+    Indica si `store_dir` contiene todos los archivos del almacén.
+    """
+    return all(os.path.isfile(os.path.join(store_dir, name)) for name in STORE_FILES)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Escritura
+# ───────────────────────────────────────────────────────────────────────────────
+class ChunkStoreWriter:
+    """
+    Escribe fragmentos en streaming: cada `append` va directo al blob en disco,
+    en memoria solo se conservan los offsets (8 bytes por fila).
+
+    Se escribe sobre archivos temporales que se renombran al cerrar, así los
+    lectores que ya tienen el almacén mapeado nunca ven archivos truncados.
+    Usado como context manager, solo se publica si el bloque termina sin
+    excepción; si no, se descarta lo escrito (`abort`).
+
+    Con `append=True` se continúa un almacén existente: los blobs crecen en
+    su sitio (las filas ya publicadas no cambian) y solo las tablas de offsets
+    se reemplazan al cerrar.
+    """
+    def __init__(self, store_dir: str, append: bool = False):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.append_mode = append and has_chunk_store(store_dir)
+        if self.append_mode:
+            self._text_offsets = array("q", np.load(os.path.join(store_dir, TEXT_OFFSETS)).tolist())
+            self._meta_offsets = array("q", np.load(os.path.join(store_dir, META_OFFSETS)).tolist())
+            self._text_f = self._open_for_append(TEXT_BLOB, self._text_offsets[-1])
+            self._meta_f = self._open_for_append(META_BLOB, self._meta_offsets[-1])
+        else:
+            self._text_f = open(self._tmp(TEXT_BLOB), "wb")
+            self._meta_f = open(self._tmp(META_BLOB), "wb")
+            self._text_offsets = array("q", [0])
+            self._meta_offsets = array("q", [0])
+        self._closed = False
+
+    def _open_for_append(self, name: str, end: int):
+        """
+        Abre un blob para continuar tras el último offset publicado,
+        descartando restos de una escritura interrumpida.
+        """
+        f = open(os.path.join(self.store_dir, name), "r+b")
+        f.truncate(end)
+        f.seek(end)
+        return f
+
+    def _tmp(self, name: str) -> str:
+        return os.path.join(self.store_dir, name + ".tmp")
+
+    def __len__(self) -> int:
+        return len(self._text_offsets) - 1
+
+    def append(self, text: str, metadata: dict = None) -> int:
+        """
+        Añade un fragmento y devuelve su número de fila.
+        """
+        data = text.encode("utf-8")
+        meta = json.dumps(metadata or {}, ensure_ascii=False).encode("utf-8")
+        self._text_f.write(data)
+        self._meta_f.write(meta)
+        self._text_offsets.append(self._text_offsets[-1] + len(data))
+        self._meta_offsets.append(self._meta_offsets[-1] + len(meta))
+        return len(self) - 1
+
+    def close(self, publish: bool = True):
+        """
+        Cierra los blobs y escribe las tablas de offsets. Con `publish=False`
+        los archivos quedan como '.tmp' (ver `ChunkStore(staged=True)`) hasta
+        llamar a `publish`, para publicarlos junto con el resto del índice.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._text_f.close()
+        self._meta_f.close()
+        # np.save añade '.npy' si el nombre no lo trae: usar un handle abierto
+        for name, offsets in ((TEXT_OFFSETS, self._text_offsets),
+                              (META_OFFSETS, self._meta_offsets)):
+            with open(self._tmp(name), "wb") as f:
+                np.save(f, np.frombuffer(offsets, dtype=np.int64))
+        if publish:
+            self.publish()
+
+    def publish(self):
+        """
+        Renombra los archivos escritos por `close` a su nombre definitivo.
+        """
+        # Los offsets se publican al final: un lector nunca ve offsets nuevos
+        # apuntando a un blob viejo más corto.
+        names = (TEXT_OFFSETS, META_OFFSETS)
+        if not self.append_mode:
+            names = (TEXT_BLOB, META_BLOB) + names
+        for name in names:
+            os.replace(self._tmp(name), os.path.join(self.store_dir, name))
+
+    def __enter__(self):
+        return self
+
+    def abort(self):
+        """
+        Descarta lo escrito: borra los temporales y, en modo append, recorta
+        los blobs al último offset publicado. El almacén queda como estaba.
+        """
+        self._closed = True
+        self._text_f.close()
+        self._meta_f.close()
+        if self.append_mode:
+            for name, offsets in ((TEXT_BLOB, TEXT_OFFSETS), (META_BLOB, META_OFFSETS)):
+                end = int(np.load(os.path.join(self.store_dir, offsets))[-1])
+                os.truncate(os.path.join(self.store_dir, name), end)
+        for name in STORE_FILES:
+            try:
+                os.remove(self._tmp(name))
+            except FileNotFoundError:
+                pass
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Lectura
+# ───────────────────────────────────────────────────────────────────────────────
+def _map_file(path: str):
+    """
+    Mapea un archivo en solo lectura; los archivos vacíos no se pueden mapear.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ChunkStore:
+    """
+    Lector de solo lectura sobre los archivos mapeados en memoria.
+
+    Con `staged=True` lee los '.tmp' que deja `ChunkStoreWriter.close(publish=False)`
+    (y los publicados para lo que no tenga temporal), p. ej. para construir
+    el BM25 antes de publicar.
+    """
+    def __init__(self, store_dir: str, staged: bool = False):
+        def path(name):
+            tmp = os.path.join(store_dir, name + ".tmp")
+            return tmp if staged and os.path.isfile(tmp) else os.path.join(store_dir, name)
+
+        if not all(os.path.isfile(path(name)) for name in STORE_FILES):
+            raise FileNotFoundError(f"No se encontró un chunk store en {store_dir}")
+        self.store_dir = store_dir
+        self._text_offsets = np.load(path(TEXT_OFFSETS), mmap_mode="r")
+        self._meta_offsets = np.load(path(META_OFFSETS), mmap_mode="r")
+        self._text_blob = _map_file(path(TEXT_BLOB))
+        self._meta_blob = _map_file(path(META_BLOB))
+
+    def __len__(self) -> int:
+        return len(self._text_offsets) - 1
+
+    def text(self, row: int) -> str:
+        """
+        Decodifica el texto de la fila `row`.
+        """
+        start, end = self._text_offsets[row], self._text_offsets[row + 1]
+        return self._text_blob[start:end].decode("utf-8")
+
+    def metadata(self, row: int) -> dict:
+        """
+        Decodifica los metadatos de la fila `row`.
+        """
+        start, end = self._meta_offsets[row], self._meta_offsets[row + 1]
+        return json.loads(self._meta_blob[start:end])
+
+    def document(self, row: int) -> Document:
+        """
+        Construye el `Document` de la fila `row`.
+        """
+        return Document(id=str(row), page_content=self.text(row), metadata=self.metadata(row))
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 4) Adaptadores para langchain FAISS
+# ───────────────────────────────────────────────────────────────────────────────
+class ChunkDocstore(Docstore):
+    """
+    Docstore de LangChain respaldado por un `ChunkStore`; decodifica
+    perezosamente solo los documentos que se piden.
+    """
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def search(self, search: str):
+        """
+        Devuelve el Document con id `search` (número de fila) o, como
+        InMemoryDocstore, un mensaje si no existe.
+        """
+        try:
+            row = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        if not 0 <= row < len(self.store):
+            return f"ID {search} not found."
+        return self.store.document(row)
+
+
+class RowIdMapping:
+    """
+    Sustituto de solo lectura de `index_to_docstore_id`: la posición/id que
+    devuelve FAISS es directamente la fila del chunk store.
+    """
+    def __init__(self, size: int):
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, i) -> bool:
+        return 0 <= int(i) < self.size
+
+    def __getitem__(self, i) -> str:
+        if i not in self:
+            raise KeyError(i)
+        return str(int(i))
+
+    def get(self, i, default=None):
+        return self[i] if i in self else default
+
+
+def load_docstore(store_dir: str):
+    """
+    Abre el chunk store y devuelve (docstore, index_to_docstore_id) listos
+    para `langchain.vectorstores.FAISS`.
+    """
+    store = ChunkStore(store_dir)
+    return ChunkDocstore(store), RowIdMapping(len(store))
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 5) Conversión desde index.pkl
+# ───────────────────────────────────────────────────────────────────────────────
+def convert_pickle(vs_dir: str) -> int:
+    """
+    Convierte el 'index.pkl' de `vs_dir` (docstore + index_to_docstore_id) al
+    formato de chunk store, respetando el orden de posiciones del índice FAISS.
+    Devuelve el número de fragmentos escritos. El pickle no se borra.
+    """
+    pkl_path = os.path.join(vs_dir, "index.pkl")
+    if not os.path.isfile(pkl_path):
+        raise FileNotFoundError(f"No se encontró 'index.pkl' en {pkl_path}")
+    with open(pkl_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    with ChunkStoreWriter(vs_dir) as writer:
+        for pos in range(len(index_to_docstore_id)):
+            doc = docstore.search(index_to_docstore_id[pos])
+            if not isinstance(doc, Document):
+                raise ValueError(f"Documento no encontrado para la posición {pos}: {doc}")
+            writer.append(doc.page_content, doc.metadata)
+        return len(writer)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Uso: python chunkstore.py <directorio_vectorstore>")
+        sys.exit(1)
+    n = convert_pickle(sys.argv[1])
+    print(f"✅ {n} fragmentos convertidos en '{sys.argv[1]}'")
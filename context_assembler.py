@@ -0,0 +1,224 @@
+"""
+context_assembler.py
+
+Ensambla el contexto del prompt (pasajes de libros, PDF y CSV) dentro de un
+presupuesto de tokens por modelo:
+
+  1) Los fragmentos se recorren de mayor a menor puntuación.
+  2) Se descartan los casi duplicados (Jaccard de shingles de palabras).
+  3) Se recorta el solapamiento entre fragmentos contiguos: el splitter repite
+     hasta CHUNK_OVERLAP caracteres al inicio de cada fragmento.
+  4) Se añaden mientras quepan en el presupuesto; el último puede truncarse.
+
+Los tokens se cuentan con tiktoken (como book_vectorstore/cost.py); si la
+codificación no está disponible (sin red para descargarla), se estima con
+~4 caracteres por token.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import json
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # dependencia opcional
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Ventana de contexto por modelo (tokens)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16_385,
+    "gpt-3.5-turbo-16k": 16_385,
+    "gpt-4o-mini": 128_000,
+}
+DEFAULT_CONTEXT_WINDOW = 8_192
+DEFAULT_MAX_CONTEXT_TOKENS = 3_000   # tope de contexto: más tokens = más coste y latencia
+RESERVED_OUTPUT_TOKENS = 1_024
+CHARS_PER_TOKEN = 4
+ELLIPSIS = " …"   # marca de texto recortado
+
+MIN_OVERLAP_CHARS = 30
+MAX_OVERLAP_CHARS = 400
+SHINGLE_WORDS = 3
+DUPLICATE_JACCARD = 0.8
+MIN_TRUNCATED_TOKENS = 64
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Conteo de tokens
+# ───────────────────────────────────────────────────────────────────────────────
+@lru_cache(maxsize=None)
+def _encoder(model: str):
+    """
+    Codificación tiktoken del modelo, o None si no se puede cargar.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as exc:
+        logger.warning("tiktoken no disponible para %s (%s); se estiman los tokens", model, exc)
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    Tokens de `text` para `model`. Cacheado: los fragmentos de libros se
+    repiten entre preguntas.
+    """
+    enc = _encoder(model)
+    if enc is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-3.5-turbo") -> str:
+    """
+    Recorta `text` a `max_tokens` tokens, terminando en un espacio si es posible.
+    La marca de recorte (" …") cuenta dentro de `max_tokens`.
+    """
+    enc = _encoder(model)
+    keep = max(0, max_tokens - count_tokens(ELLIPSIS, model))
+    if enc is None:
+        if len(text) <= max_tokens * CHARS_PER_TOKEN:
+            return text
+        cut = text[:keep * CHARS_PER_TOKEN]
+    else:
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = enc.decode(tokens[:keep])
+    if " " in cut:
+        cut = cut[:cut.rfind(" ")]
+    return cut + ELLIPSIS
+
+
+def context_budget(model: str, prompt_tokens: int = 0,
+                   max_context_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS) -> int:
+    """
+    Tokens disponibles para el contexto: lo que deja libre la ventana del
+    modelo tras el resto del prompt y la respuesta, con tope `max_context_tokens`.
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(0, min(max_context_tokens, window - prompt_tokens - RESERVED_OUTPUT_TOKENS))
+
+
+def compact_profile(profile: dict) -> str:
+    """
+    Perfil como JSON compacto y sin campos vacíos (la versión con `indent=2`
+    gasta tokens en espacios).
+    """
+    profile = {k: v for k, v in profile.items() if v not in (None, "", [], {})}
+    return json.dumps(profile, ensure_ascii=False, separators=(",", ":"))
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Duplicados y solapamientos
+# ───────────────────────────────────────────────────────────────────────────────
+def _shingles(text: str) -> frozenset:
+    words = text.lower().split()
+    if len(words) < SHINGLE_WORDS:
+        return frozenset([hash(" ".join(words))])
+    return frozenset(hash(" ".join(words[i:i + SHINGLE_WORDS]))
+                     for i in range(len(words) - SHINGLE_WORDS + 1))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def overlap_length(prev: str, text: str) -> int:
+    """
+    Longitud del mayor sufijo de `prev` que es prefijo de `text`
+    (al menos MIN_OVERLAP_CHARS), o 0.
+    """
+    longest = min(len(prev), len(text), MAX_OVERLAP_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if prev.endswith(text[:size]):
+            return size
+    return 0
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 4) Ensamblado
+# ───────────────────────────────────────────────────────────────────────────────
+def ranked(label: str, texts, weight: float = 1.0) -> list[tuple]:
+    """
+    Convierte textos ordenados por relevancia en piezas (etiqueta, texto,
+    puntuación) con puntuación `weight / (rango + 1)`, comparable entre fuentes.
+    """
+    return [(label, text, weight / (rank + 1)) for rank, text in enumerate(texts) if text]
+
+
+def assemble_context(pieces, budget_tokens: int, model: str = "gpt-3.5-turbo") -> tuple[str, dict]:
+    """
+    Empaqueta las piezas de mayor puntuación en `budget_tokens` tokens.
+
+    Args:
+      pieces: iterable de (etiqueta, texto, puntuación); ver `ranked`.
+      budget_tokens: tokens máximos del contexto (ver `context_budget`).
+      model: modelo para contar tokens.
+
+    Returns:
+      (contexto, estadísticas): el contexto agrupa las piezas por etiqueta,
+      en el orden de entrada; las estadísticas incluyen tokens usados y
+      piezas descartadas por duplicadas o por presupuesto.
+    """
+    pieces = list(pieces)
+    order = sorted(range(len(pieces)), key=lambda i: -pieces[i][2])
+    chosen = {}   # índice de entrada → texto final
+    signatures = []
+    used = 0
+    stats = {"duplicates": 0, "over_budget": 0, "overlap_chars": 0, "truncated": 0}
+
+    for i in order:
+        label, text, _ = pieces[i]
+        sig = _shingles(text)
+        if any(_jaccard(sig, other) >= DUPLICATE_JACCARD for other in signatures):
+            stats["duplicates"] += 1
+            continue
+        # Recortar lo ya incluido por otra pieza: cabeza repetida del final de
+        # otra, o cola repetida del inicio de otra
+        for kept in chosen.values():
+            head = overlap_length(kept, text)
+            if head:
+                text = text[head:]
+                stats["overlap_chars"] += head
+            tail = overlap_length(text, kept)
+            if tail:
+                text = text[:-tail]
+                stats["overlap_chars"] += tail
+        text = text.strip()
+        if not text:
+            stats["duplicates"] += 1
+            continue
+
+        tokens = count_tokens(text, model)
+        remaining = budget_tokens - used
+        if tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                stats["over_budget"] += 1
+                continue
+            text = truncate_tokens(text, remaining, model)
+            tokens = count_tokens(text, model)
+            stats["truncated"] += 1
+        chosen[i] = text
+        signatures.append(sig)
+        used += tokens
+
+    sections = {}
+    for i in sorted(chosen):
+        sections.setdefault(pieces[i][0], []).append(chosen[i])
+    context = "\n\n".join(f"{label}:\n" + "\n...\n".join(texts) for label, texts in sections.items())
+    stats.update(tokens=used, budget=budget_tokens, pieces=len(chosen))
+    return context, stats
@@ -0,0 +1,223 @@
+"""
+csv_context.py
+
+Contexto a partir de CSVs subidos por el usuario, sin releer el archivo
+completo en cada pregunta:
+
+  1) Cabecera y filas de ejemplo se leen con `nrows` (coste constante).
+  2) Las estadísticas por columna se calculan una sola vez por hash del
+     archivo, en streaming por bloques (`chunksize`) y en segundo plano.
+
+El contenido subido se vuelca una vez a un directorio temporal, del que se
+leen las estadísticas, y se borra cuando el perfil sale del caché.
+
+El contexto resultante se cachea por hash: el coste por pregunta no depende
+del tamaño del archivo.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import uuid
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_ROWS = 5
+INFER_ROWS = 1000
+CHUNK_ROWS = 200_000
+TOP_VALUES = 3
+MAX_DISTINCT = 50_000
+MAX_CACHED_FILES = 16
+MAX_CACHED_DIGESTS = 256    # file_id → hash recordados (solo texto, baratos)
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "estrategia_csv_cache")
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="csv-profile")
+_profiles = OrderedDict()   # hash → CsvProfile
+_digests = OrderedDict()    # file_id de Streamlit → hash
+_profiles_lock = threading.Lock()
+
+
+def file_digest(data) -> str:
+    """
+    SHA-256 de un buffer (bytes/memoryview) sin copiarlo.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def _buffer(uploaded) -> memoryview:
+    """
+    Vista sin copia del contenido de un archivo subido (UploadedFile/BytesIO).
+    """
+    if hasattr(uploaded, "getbuffer"):
+        return uploaded.getbuffer()
+    return memoryview(uploaded)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Perfil del CSV
+# ───────────────────────────────────────────────────────────────────────────────
+class CsvProfile:
+    """
+    Cabecera, muestra y estadísticas de un CSV. El contenido se vuelca una vez
+    a disco (CACHE_DIR) y se lee desde ahí por bloques; las estadísticas se
+    completan en segundo plano (`stats_future`). Cada instancia tiene su
+    propia copia: dos sesiones que suben el mismo archivo a la vez no
+    escriben ni borran el archivo de la otra.
+    """
+    def __init__(self, digest: str, data, infer_dtypes: bool = True):
+        self.digest = digest
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.csv_path = os.path.join(CACHE_DIR, f"{digest}-{uuid.uuid4().hex}.csv")
+        with open(self.csv_path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(self.csv_path + ".tmp", self.csv_path)
+        head = pd.read_csv(self.csv_path, nrows=INFER_ROWS)
+        self.columns = list(head.columns)
+        self.sample = head.head(SAMPLE_ROWS)
+        # Tipos inferidos de la muestra: evitan re-inferir en cada bloque
+        self.dtypes = head.dtypes.to_dict() if infer_dtypes else None
+        self._context = None
+        self.stats_future = _executor.submit(self._compute_stats)
+
+    def _scan(self, dtypes) -> dict:
+        """
+        Recorre el archivo por bloques acumulando estadísticas por columna.
+        """
+        n_rows = 0
+        num = {}     # columna → [count, sum, min, max]
+        counts = {}  # columna → Series de frecuencias
+        high_card = set()  # columnas con demasiados valores distintos (IDs, fechas...)
+        for chunk in pd.read_csv(self.csv_path, chunksize=CHUNK_ROWS, dtype=dtypes):
+            n_rows += len(chunk)
+            for col in chunk.columns:
+                series = chunk[col]
+                if pd.api.types.is_numeric_dtype(series):
+                    values = series.to_numpy(dtype="float64", na_value=np.nan)
+                    valid = values[~np.isnan(values)]
+                    if valid.size == 0:
+                        continue
+                    acc = num.setdefault(col, [0, 0.0, np.inf, -np.inf])
+                    acc[0] += valid.size
+                    acc[1] += float(valid.sum())
+                    acc[2] = min(acc[2], float(valid.min()))
+                    acc[3] = max(acc[3], float(valid.max()))
+                elif col not in high_card:
+                    vc = series.value_counts()
+                    counts[col] = vc if col not in counts else counts[col].add(vc, fill_value=0)
+                    if len(counts[col]) > MAX_DISTINCT:
+                        high_card.add(col)
+                        del counts[col]
+
+        stats = {}
+        for col, (count, total, lo, hi) in num.items():
+            stats[col] = {"tipo": "numérica", "no_nulos": count, "media": total / count,
+                          "min": lo, "max": hi, "suma": total}
+        for col, vc in counts.items():
+            top = vc.sort_values(ascending=False).head(TOP_VALUES)
+            stats[col] = {"tipo": "categórica", "no_nulos": int(vc.sum()),
+                          "distintos": int(len(vc)),
+                          "top": {str(k): int(v) for k, v in top.items()}}
+        for col in high_card:
+            stats[col] = {"tipo": "categórica", "distintos": f">{MAX_DISTINCT}", "top": {}}
+        return {"filas": n_rows, "columnas": stats}
+
+    def _compute_stats(self) -> dict:
+        if self.dtypes is None:
+            return self._scan(None)
+        try:
+            return self._scan(self.dtypes)
+        except (ValueError, TypeError):
+            # La muestra no representaba todo el archivo (p. ej. nulos en una
+            # columna entera más abajo): dejar que pandas infiera por bloque
+            return self._scan(None)
+
+    # 2.1) Contexto para el prompt ------------------------------------------
+    def context(self, wait: float = 0.0) -> str:
+        """
+        Texto compacto para el prompt. Si las estadísticas aún no están listas
+        tras `wait` segundos, incluye solo cabecera y muestra.
+        """
+        if self._context is not None:
+            return self._context
+        parts = [f"CSV columnas: {', '.join(map(str, self.columns))}",
+                 f"Ejemplo filas:\n{self.sample.to_csv(index=False)}"]
+        try:
+            stats = self.stats_future.result(timeout=wait)
+        except Exception:
+            return "\n".join(parts)
+        lines = [f"Total filas: {stats['filas']}"]
+        for col, s in stats["columnas"].items():
+            if s["tipo"] == "numérica":
+                lines.append(f"- {col}: media {s['media']:.4g}, min {s['min']:.4g}, "
+                             f"max {s['max']:.4g}, suma {s['suma']:.4g}")
+            else:
+                top = ", ".join(f"{k} ({v})" for k, v in s["top"].items())
+                lines.append(f"- {col}: {s['distintos']} valores distintos"
+                             + (f"; más frecuentes: {top}" if top else ""))
+        parts.append("Resumen por columna:\n" + "\n".join(lines))
+        self._context = "\n".join(parts)
+        return self._context
+
+    def discard(self):
+        """
+        Borra la copia en disco al desalojar el perfil del caché, cuando
+        termine el cálculo de estadísticas que la está leyendo.
+        """
+        self.stats_future.add_done_callback(lambda _: self._remove_copy())
+
+    def _remove_copy(self):
+        try:
+            os.remove(self.csv_path)
+        except FileNotFoundError:
+            pass
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Caché por hash
+# ───────────────────────────────────────────────────────────────────────────────
+def get_csv_profile(uploaded, infer_dtypes: bool = True) -> CsvProfile:
+    """
+    Devuelve el CsvProfile del archivo subido, creándolo la primera vez que
+    se ve su contenido (hash). El hash se memoriza por `file_id` de Streamlit,
+    así que en los reruns siguientes no se vuelve a leer el archivo.
+    """
+    file_id = getattr(uploaded, "file_id", None)
+    with _profiles_lock:
+        digest = _digests.get(file_id) if file_id else None
+        if digest is not None:
+            _digests.move_to_end(file_id)
+    data = None
+    if digest is None:
+        data = _buffer(uploaded)
+        digest = file_digest(data)
+        if file_id:
+            with _profiles_lock:
+                _digests[file_id] = digest
+                while len(_digests) > MAX_CACHED_DIGESTS:
+                    _digests.popitem(last=False)
+    with _profiles_lock:
+        profile = _profiles.get(digest)
+        if profile is not None:
+            _profiles.move_to_end(digest)
+            return profile
+    if data is None:
+        data = _buffer(uploaded)
+    created = CsvProfile(digest, data, infer_dtypes=infer_dtypes)
+    evicted = []
+    with _profiles_lock:
+        profile = _profiles.setdefault(digest, created)
+        if profile is not created:
+            # Otra sesión lo creó a la vez: se usa el suyo y se descarta la copia
+            evicted.append(created)
+        while len(_profiles) > MAX_CACHED_FILES:
+            evicted.append(_profiles.popitem(last=False)[1])
+    for old in evicted:
+        old.discard()
+    return profile
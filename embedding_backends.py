@@ -0,0 +1,205 @@
+"""
+embedding_backends.py
+
+Backends de embeddings intercambiables por configuración:
+
+  - "openai"    → OpenAIEmbeddings (API remota; una petición por consulta).
+  - "fastembed" → modelo ONNX local en CPU vía fastembed: sin red, lotes en
+                  un pool de hilos (onnxruntime libera el GIL).
+
+El builder guarda en 'manifest.json' qué backend, modelo y dimensión generó
+el índice (`embedding_info`), y vectorstore.py se niega a cargar el índice
+con un modelo de embeddings distinto (`check_compatible`): los vectores de
+modelos diferentes no son comparables aunque coincida la dimensión.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKENDS = ("openai", "fastembed")
+DEFAULT_BACKEND = "openai"
+DEFAULT_OPENAI_MODEL = "text-embedding-ada-002"
+# Multilingüe (los libros y las preguntas mezclan español e inglés), 384 dims
+DEFAULT_FASTEMBED_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+FASTEMBED_BATCH_SIZE = 64
+FASTEMBED_WORKERS = 4
+MANIFEST_NAME = "manifest.json"   # escrito por book_vectorstore/build_vectorstore.py
+
+# Dimensiones conocidas de los modelos de OpenAI (sin llamar a la API)
+OPENAI_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Backend local (fastembed)
+# ───────────────────────────────────────────────────────────────────────────────
+class FastEmbedEmbeddings(Embeddings):
+    """
+    Embeddings locales con fastembed (ONNX Runtime en CPU).
+
+    El modelo se descarga la primera vez a `cache_dir` y después funciona sin
+    red. Los textos se embeben por lotes de `batch_size`; con varios lotes se
+    reparten entre `workers` hilos que comparten la misma sesión ONNX, cada
+    una con `cpu_count // workers` hilos internos para no sobresuscribir.
+
+    Args:
+      model_name: modelo soportado por fastembed.
+      batch_size: textos por inferencia.
+      workers: lotes en paralelo.
+      cache_dir: carpeta de los modelos descargados (por defecto la de fastembed).
+    """
+    backend = "fastembed"
+
+    def __init__(self, model_name: str = DEFAULT_FASTEMBED_MODEL,
+                 batch_size: int = FASTEMBED_BATCH_SIZE,
+                 workers: int = FASTEMBED_WORKERS,
+                 cache_dir: str = None):
+        from fastembed import TextEmbedding
+
+        self.model = model_name
+        self.batch_size = batch_size
+        threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+        self._model = TextEmbedding(model_name=model_name, threads=threads, cache_dir=cache_dir)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fastembed")
+        self._dimension = None
+        self._dimension_lock = threading.Lock()
+
+    @property
+    def dimension(self) -> int:
+        """
+        Dimensión de los vectores (de la ficha del modelo, o probando uno).
+        """
+        with self._dimension_lock:
+            if self._dimension is None:
+                for spec in self._model.list_supported_models():
+                    if spec.get("model") == self.model:
+                        self._dimension = int(spec["dim"])
+                        break
+                else:
+                    self._dimension = len(self.embed_query("dimensión"))
+            return self._dimension
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return [v.tolist() for v in self._model.embed(texts, batch_size=len(texts))]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            return self._embed_batch(texts) if texts else []
+        return [v for batch in self._pool.map(self._embed_batch, batches) for v in batch]
+
+    def embed_query(self, text: str) -> list[float]:
+        # query_embed aplica el prefijo de consulta de los modelos que lo usan (e5, bge)
+        return next(iter(self._model.query_embed(text))).tolist()
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Varias consultas en una sola inferencia (con el prefijo de consulta).
+        """
+        return [v.tolist() for v in self._model.query_embed(texts, batch_size=max(1, len(texts)))]
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Fábrica y metadatos
+# ───────────────────────────────────────────────────────────────────────────────
+def make_embeddings(backend: str = DEFAULT_BACKEND, model: str = None,
+                    api_key: str = None, base_url: str = None) -> Embeddings:
+    """
+    Crea el modelo de embeddings del backend indicado (sin caché; envolver
+    con `CachedEmbeddings` si se quiere).
+
+    Raises:
+      ValueError: si `backend` no es uno de EMBEDDING_BACKENDS, o falta la
+                  API key para "openai".
+    """
+    if backend == "fastembed":
+        return FastEmbedEmbeddings(model or DEFAULT_FASTEMBED_MODEL)
+    if backend == "openai":
+        if not api_key:
+            raise ValueError("El backend 'openai' requiere una API key")
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model or DEFAULT_OPENAI_MODEL, api_key=api_key, base_url=base_url)
+    raise ValueError(
+        f"Backend de embeddings desconocido: {backend!r} (opciones: {', '.join(EMBEDDING_BACKENDS)})"
+    )
+
+
+def embed_queries(embeddings, texts: list[str]) -> list[list[float]]:
+    """
+    Embeddings de varias consultas en una llamada si el modelo lo permite:
+    su propio `embed_queries` (fastembed, CachedEmbeddings) o, en OpenAI,
+    `embed_documents` (ahí consultas y documentos se embeben igual). Con
+    otros modelos, una a una con `embed_query`.
+    """
+    if not texts:
+        return []
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if "OpenAI" in type(embeddings).__name__:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(t) for t in texts]
+
+
+def embedding_info(embeddings) -> dict:
+    """
+    {"backend", "model", "dim"} de un modelo de embeddings (atraviesa
+    `CachedEmbeddings`). `dim` es None si no se conoce sin llamar al modelo.
+    """
+    inner = getattr(embeddings, "embeddings", embeddings)
+    backend = getattr(inner, "backend", None)
+    if backend is None:
+        backend = "openai" if "OpenAI" in type(inner).__name__ else type(inner).__name__
+    model = getattr(inner, "model", None) or getattr(inner, "model_name", None)
+    if backend == "fastembed":
+        dim = inner.dimension
+    elif getattr(inner, "openai_api_base", None):
+        # Servidor compatible: el nombre del modelo no determina la dimensión
+        dim = getattr(inner, "dimensions", None)
+    else:
+        dim = getattr(inner, "dimensions", None) or OPENAI_DIMENSIONS.get(model)
+    return {"backend": backend, "model": model, "dim": dim}
+
+
+def recorded_embedding(vs_dir: str) -> dict | None:
+    """
+    Backend/modelo/dimensión con que se construyó el índice de `vs_dir`,
+    según su manifiesto; None si no consta (índices antiguos).
+    """
+    try:
+        with open(os.path.join(vs_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f).get("embedding")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def check_compatible(recorded: dict | None, embeddings, index_dim: int):
+    """
+    Verifica que `embeddings` pueda consultar un índice construido con
+    `recorded` (de 'manifest.json'; None en índices antiguos) y dimensión
+    `index_dim`.
+
+    Raises:
+      ValueError: si el backend/modelo o la dimensión no coinciden.
+    """
+    info = embedding_info(embeddings)
+    if recorded and (recorded.get("backend"), recorded.get("model")) != (info["backend"], info["model"]):
+        raise ValueError(
+            f"El índice se construyó con embeddings {recorded.get('backend')}:{recorded.get('model')} "
+            f"pero la app usa {info['backend']}:{info['model']}. Reconstruye el vectorstore "
+            "o configura el mismo backend."
+        )
+    if info["dim"] is not None and info["dim"] != index_dim:
+        raise ValueError(
+            f"Dimensión de embeddings incompatible: el índice tiene {index_dim} y "
+            f"{info['backend']}:{info['model']} produce {info['dim']}."
+        )
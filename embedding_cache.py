@@ -0,0 +1,253 @@
+"""
+embedding_cache.py
+
+Caché persistente de embeddings en SQLite, compartido por la ingesta
+(build_vectorstore.py) y las consultas de la app.
+
+`CachedEmbeddings` envuelve cualquier objeto con `embed_documents` /
+`embed_query` (p. ej. OpenAIEmbeddings). La clave es (modelo, sha256 del
+texto); solo los textos ausentes se envían al proveedor. Cuando el tamaño
+total supera `max_bytes` se eliminan las entradas usadas hace más tiempo (LRU).
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from embedding_backends import embed_queries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "embedding_cache.sqlite"
+)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key         TEXT PRIMARY KEY,
+    vector      BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings(last_access);
+"""
+
+
+def model_name_of(embeddings) -> str:
+    """
+    Nombre del modelo de un objeto de embeddings, para separar sus entradas.
+    """
+    for attr in ("model", "model_name"):
+        name = getattr(embeddings, attr, None)
+        if name:
+            return str(name)
+    return type(embeddings).__name__
+
+
+def _pack(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> list[float]:
+    vec = array("f")
+    vec.frombytes(blob)
+    return vec.tolist()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Almacén SQLite
+# ───────────────────────────────────────────────────────────────────────────────
+class EmbeddingCache:
+    """
+    Tabla clave → vector en SQLite (modo WAL, seguro entre hilos y procesos).
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Una conexión por hilo: sqlite3 no comparte conexiones entre hilos.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return model + ":" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict:
+        """
+        Devuelve {clave: vector} para las claves presentes y actualiza su
+        último acceso.
+        """
+        found = {}
+        conn = self._conn()
+        # SQLite limita el número de parámetros por consulta
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            marks = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part
+            ).fetchall()
+            found.update((k, _unpack(v)) for k, v in rows)
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_access=? WHERE key=?",
+                             [(now, k) for k in found])
+        return found
+
+    def put_many(self, items: dict):
+        """
+        Guarda {clave: vector} y, cada cierto número de escrituras, aplica
+        la política de tamaño.
+        """
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = _pack(vector)
+            rows.append((key, blob, len(blob) + len(key), now))
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings(key, vector, size, last_access) VALUES (?,?,?,?)",
+            rows
+        )
+        with self._lock:
+            self._writes_since_evict += len(rows)
+            should_evict = self._writes_since_evict >= 1000
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def total_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def evict(self):
+        """
+        Elimina las entradas menos recientes hasta quedar en el 90% de
+        `max_bytes`, dejando margen para no desalojar en cada escritura.
+        """
+        total = before = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        conn = self._conn()
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_access").fetchall():
+            if total <= target:
+                break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM embeddings WHERE key=?", victims)
+        logger.info("Caché de embeddings: %d entradas desalojadas (%d bytes liberados, quedan %d)",
+                    len(victims), before - total, total)
+
+    def clear(self):
+        self._conn().execute("DELETE FROM embeddings")
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Envoltorio de embeddings
+# ───────────────────────────────────────────────────────────────────────────────
+class CachedEmbeddings(Embeddings):
+    """
+    Envoltorio de un modelo de embeddings que consulta primero el caché.
+
+    Args:
+      embeddings: objeto con `embed_documents` y `embed_query`.
+      cache: EmbeddingCache compartido (por defecto, uno en data/).
+      namespace: nombre del modelo para la clave (por defecto se deduce).
+    """
+    def __init__(self, embeddings, cache: EmbeddingCache = None, namespace: str = None):
+        self.embeddings = embeddings
+        self.cache = cache or EmbeddingCache()
+        self.namespace = namespace or model_name_of(embeddings)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, hits: int, misses: int):
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self) -> dict:
+        """
+        Estadísticas de aciertos/fallos desde la creación del envoltorio.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [EmbeddingCache.make_key(self.namespace, t) for t in texts]
+        return self._embed_cached(keys, texts, self.embeddings.embed_documents)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Como `embed_query` para varias consultas; las ausentes del caché se
+        embeben en una sola llamada (ver embedding_backends.embed_queries).
+        """
+        keys = [EmbeddingCache.make_key(self.namespace, "query:" + t) for t in texts]
+        return self._embed_cached(keys, texts, lambda batch: embed_queries(self.embeddings, batch))
+
+    def _embed_cached(self, keys: list[str], texts: list[str], embed) -> list[list[float]]:
+        found = self.cache.get_many(list(set(keys)))
+
+        # Textos ausentes (sin repetir) → una sola llamada al proveedor
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self._count(len(texts) - len(missing), len(missing))
+        if missing:
+            vectors = embed(list(missing.values()))
+            # Redondeo a float32 como en el caché: mismo texto → mismo vector
+            fresh = {k: _unpack(_pack(v)) for k, v in zip(missing.keys(), vectors)}
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        # Espacio de claves propio: algunos modelos embeben distinto las consultas
+        key = EmbeddingCache.make_key(self.namespace, "query:" + text)
+        found = self.cache.get_many([key])
+        if key in found:
+            self._count(1, 0)
+            return found[key]
+        self._count(0, 1)
+        vector = _unpack(_pack(self.embeddings.embed_query(text)))
+        self.cache.put_many({key: vector})
+        return vector
+
+    def __getattr__(self, name):
+        # Expone atributos del modelo envuelto (p. ej. `model`)
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
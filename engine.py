@@ -0,0 +1,208 @@
+"""
+engine.py
+
+Motor de chat RAG independiente de la interfaz, compartido por app.py (en
+proceso) y api_server.py (HTTP + SSE, varios workers):
+
+  1) `ChatEngine.prepare`: embedding de la pregunta, búsqueda híbrida,
+     caché semántico de respuestas y ensamblado del prompt (perfil, memoria
+     conversacional, piezas del usuario y pasajes de los libros dentro del
+     presupuesto de tokens) → `PreparedTurn`.
+  2) `ChatEngine.stream` / `astream`: tokens de la respuesta (o el replay de
+     la respuesta cacheada); al terminar, la respuesta se guarda en el caché.
+
+El motor no guarda estado por conversación: el historial, los archivos
+subidos y la memoria los aporta quien llama. Las etapas se miden con
+`metrics.stage`, así el TurnTimer activo del llamador las recoge.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+from answer_cache import AnswerCache, doc_key, get_answer_cache, replay_chunks
+from context_assembler import (
+    DEFAULT_MAX_CONTEXT_TOKENS,
+    assemble_context,
+    compact_profile,
+    context_budget,
+    count_tokens,
+    ranked
+)
+from metrics import stage
+from vectorstore import RetrievalService, get_vectorstore, vectorstore_version
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_K = 4
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Turno preparado
+# ───────────────────────────────────────────────────────────────────────────────
+class PreparedTurn:
+    """
+    Resultado de `ChatEngine.prepare`: mensajes para el LLM (o la respuesta
+    cacheada) y lo necesario para guardar la respuesta al terminar.
+    """
+    __slots__ = ("model", "messages", "cached", "sources", "context_tokens", "_cache_args")
+
+    def __init__(self, model: str, messages: list[dict], cached: str | None,
+                 sources: list[str], context_tokens: int, cache_args: dict | None):
+        self.model = model
+        self.messages = messages
+        self.cached = cached
+        self.sources = sources
+        self.context_tokens = context_tokens
+        self._cache_args = cache_args
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Motor
+# ───────────────────────────────────────────────────────────────────────────────
+class ChatEngine:
+    """
+    Pipeline de recuperación, contexto y respuesta en streaming.
+
+    Es seguro usar una misma instancia desde varios hilos y sesiones: el
+    vectorstore, el caché de respuestas y el backend son compartidos por el
+    proceso.
+
+    Args:
+      embeddings: modelo con `.embed_query` (el mismo backend/modelo del índice).
+      backend: `llm_backend.LLMBackend` para las completions.
+      vs_path: directorio del vectorstore (None: vectorstore.DEFAULT_VS_SUBPATH).
+      mmap: mapear el índice FAISS en memoria (páginas compartidas entre workers).
+      nprobe, ef_search: recall/latencia de índices aproximados (None: los del build).
+      max_context_tokens: tope de tokens de contexto por pregunta.
+      k: pasajes de los libros por pregunta.
+      answer_cache: caché semántico (por defecto, el del proceso).
+      reranker: etapa de reordenación (`rerank.Reranker`) sobre más
+                candidatos, o None para quedarse con el top-k fusionado.
+    """
+    def __init__(self, embeddings, backend, vs_path: str = None, mmap: bool = True,
+                 nprobe: int = None, ef_search: int = None,
+                 max_context_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS,
+                 k: int = DEFAULT_K, answer_cache: AnswerCache = None, reranker=None):
+        self.embeddings = embeddings
+        self.backend = backend
+        self.vs_path = vs_path
+        self.mmap = mmap
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.max_context_tokens = max_context_tokens
+        self.k = k
+        self.answer_cache = answer_cache or get_answer_cache()
+        self.reranker = reranker
+
+    def vectorstore(self):
+        """
+        FAISS vectorstore compartido del proceso.
+
+        Raises:
+          ValueError: si los embeddings no son los del índice.
+          FileNotFoundError: si falta el vectorstore.
+        """
+        with stage("vectorstore"):
+            return get_vectorstore(embedding_model=self.embeddings, vs_subpath=self.vs_path, mmap=self.mmap,
+                                   nprobe=self.nprobe, ef_search=self.ef_search)
+
+    def retrieval(self) -> RetrievalService:
+        """
+        Servicio de recuperación (caché de búsquedas, lotes, filtro por libro)
+        sobre el mismo vectorstore.
+        """
+        return RetrievalService(self.embeddings, vs_subpath=self.vs_path, mmap=self.mmap,
+                                nprobe=self.nprobe, ef_search=self.ef_search)
+
+    def embed_query(self, question: str) -> list[float]:
+        with stage("embed_query"):
+            return self.embeddings.embed_query(question)
+
+    def prepare(self, question: str, profile: dict, model: str = DEFAULT_MODEL,
+                query_vector=None, extra_pieces=(), memory: str = "",
+                use_cache: bool = True, sources=None) -> PreparedTurn:
+        """
+        Recupera pasajes y arma el prompt de una pregunta.
+
+        Args:
+          question: pregunta del usuario.
+          profile: perfil de la PYME (va completo al prompt de sistema).
+          model: modelo de chat (define el presupuesto de tokens).
+          query_vector: embedding de `question` si ya se calculó.
+          extra_pieces: piezas puntuadas (`context_assembler.ranked`) aportadas
+                        por el llamador, p. ej. pasajes de un PDF o un CSV.
+          memory: resumen de la conversación previa.
+          use_cache: consultar y alimentar el caché semántico de respuestas.
+          sources: libros a los que restringir la búsqueda (None: todos).
+
+        Raises:
+          ValueError, FileNotFoundError: como `vectorstore()`; ValueError
+                                         también si `sources` incluye un libro
+                                         que no está en el índice.
+        """
+        with stage("vectorstore"):
+            retrieval = self.retrieval()
+            retrieval.entry()
+        if query_vector is None:
+            query_vector = self.embed_query(question)
+        with stage("retrieval"):
+            docs = retrieval.hybrid_search(question, query_vector, k=self.k, sources=sources,
+                                           reranker=self.reranker)
+        sources = [d.metadata.get("source", "") for d in docs]
+
+        cache_args = None
+        if use_cache:
+            with stage("answer_cache"):
+                cache_args = {"profile": profile, "model": model, "query_vector": query_vector,
+                              "chunk_ids": [doc_key(d) for d in docs],
+                              "corpus_version": vectorstore_version(self.vs_path), "memory": memory}
+                cached = self.answer_cache.lookup(**cache_args)
+            if cached is not None:
+                return PreparedTurn(model, [], cached, sources, 0, None)
+
+        system = (
+            "Eres un asistente de marketing digital para PYMEs.\n"
+            f"Perfil completo:\n{compact_profile(profile)}"
+            + (f"\n\nResumen de la conversación anterior:\n{memory}" if memory else "")
+        )
+        with stage("context_assembly"):
+            budget = context_budget(model, prompt_tokens=count_tokens(system + question, model),
+                                    max_context_tokens=self.max_context_tokens)
+            pieces = list(extra_pieces) + ranked("Libros", [d.page_content for d in docs])
+            context, stats = assemble_context(pieces, budget, model=model)
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f"Contexto:\n{context}\n\nPregunta: {question}"},
+        ]
+        return PreparedTurn(model, messages, None, sources, stats["tokens"], cache_args)
+
+    def _store(self, turn: PreparedTurn, answer: str):
+        if turn._cache_args is not None:
+            self.answer_cache.store(**turn._cache_args, answer=answer)
+
+    def stream(self, turn: PreparedTurn):
+        """
+        Tokens de la respuesta de `turn` (generador síncrono). Si se consume
+        completo, la respuesta se guarda en el caché.
+        """
+        if turn.cached is not None:
+            yield from replay_chunks(turn.cached)
+            return
+        parts = []
+        for tok in self.backend.stream(turn.messages, model=turn.model):
+            parts.append(tok)
+            yield tok
+        self._store(turn, "".join(parts))
+
+    async def astream(self, turn: PreparedTurn):
+        """
+        Como `stream`, pero asíncrono y sin bloquear el event loop del llamador.
+        """
+        if turn.cached is not None:
+            for piece in replay_chunks(turn.cached):
+                yield piece
+            return
+        parts = []
+        async for tok in self.backend.astream_threadsafe(turn.messages, model=turn.model):
+            parts.append(tok)
+            yield tok
+        self._store(turn, "".join(parts))
@@ -0,0 +1,246 @@
+"""
+llm_backend.py
+
+Capa asíncrona y compartida por el proceso para llamar a la API de OpenAI
+(o a cualquier servidor compatible, p. ej. bench/fake_openai_server.py):
+
+  - Un único `AsyncOpenAI` con pool de conexiones HTTP (keep-alive) que
+    reutilizan todas las sesiones de Streamlit.
+  - Un event loop propio en un hilo de fondo, para que el script síncrono de
+    Streamlit pueda consumir streams y lanzar peticiones concurrentes.
+  - Límite de peticiones simultáneas por proceso (semáforo).
+  - Reintentos con backoff exponencial y jitter ante 429, 5xx, timeouts y
+    errores de conexión, respetando `Retry-After` cuando viene.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import queue
+import random
+import asyncio
+import logging
+import threading
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_TIMEOUT = 60.0
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,   # incluye APITimeoutError
+    openai.InternalServerError,
+)
+
+_DONE = object()
+
+
+def _retry_delay(attempt: int, exc: Exception) -> float:
+    """
+    Espera antes del reintento `attempt` (0, 1, ...): `Retry-After` si el
+    servidor lo indica, si no backoff exponencial con jitter completo.
+    """
+    response = getattr(exc, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Backend
+# ───────────────────────────────────────────────────────────────────────────────
+class LLMBackend:
+    """
+    Cliente de chat completions con pool de conexiones, concurrencia acotada
+    y reintentos. Las corrutinas (`acomplete`, `astream`) sirven para código
+    async; los métodos síncronos (`complete`, `stream`, `complete_many`) las
+    ejecutan en el event loop de fondo del backend.
+    """
+    def __init__(self,
+                 api_key: str,
+                 base_url: str = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.max_retries = max_retries
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name="llm-backend-loop", daemon=True)
+        self._thread.start()
+
+        async def _setup():
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections),
+                timeout=timeout,
+            )
+            # Los reintentos los gestiona este módulo (con el semáforo liberado)
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                 http_client=http_client, max_retries=0)
+            return client, asyncio.Semaphore(max_concurrency)
+
+        self.client, self._semaphore = self._run(_setup())
+
+    def _run(self, coro):
+        """
+        Ejecuta una corrutina en el loop de fondo y espera su resultado.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    # 2.1) API asíncrona ----------------------------------------------------
+    async def acomplete(self, messages: list[dict], model: str, **kwargs) -> str:
+        """
+        Completion sin streaming; devuelve el texto de la respuesta.
+
+        El cuerpo se envía tal cual y se lee el JSON de la respuesta, sin la
+        validación tipada del SDK: en lotes grandes esa validación costaba más
+        CPU que el propio HTTP. Los errores de la API siguen siendo las
+        excepciones del SDK (reintentos iguales).
+        """
+        body = {"model": model, "messages": messages, **kwargs}
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    resp = await self.client.post("/chat/completions", body=body, cast_to=httpx.Response)
+                return resp.json()["choices"][0]["message"].get("content") or ""
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.max_retries:
+                    raise
+                delay = _retry_delay(attempt, exc)
+                logger.warning("LLM: %s; reintento %d en %.2fs", type(exc).__name__, attempt + 1, delay)
+                await asyncio.sleep(delay)
+
+    async def astream(self, messages: list[dict], model: str, **kwargs):
+        """
+        Generador asíncrono de tokens. Solo reintenta si el fallo ocurre antes
+        del primer token (después no se puede repetir sin duplicar texto).
+        """
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                async with self._semaphore:
+                    stream = await self.client.chat.completions.create(
+                        model=model, messages=messages, stream=True, **kwargs
+                    )
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        tok = chunk.choices[0].delta.content or ""
+                        if tok:
+                            started = True
+                            yield tok
+                return
+            except RETRYABLE_ERRORS as exc:
+                if started or attempt == self.max_retries:
+                    raise
+                delay = _retry_delay(attempt, exc)
+                logger.warning("LLM stream: %s; reintento %d en %.2fs", type(exc).__name__, attempt + 1, delay)
+                await asyncio.sleep(delay)
+
+    async def acomplete_many(self, requests: list[list[dict]], model: str, **kwargs) -> list[str]:
+        """
+        Lanza varias completions a la vez (acotadas por el semáforo) y
+        devuelve los textos en el mismo orden.
+        """
+        return await asyncio.gather(*(self.acomplete(m, model, **kwargs) for m in requests))
+
+    # 2.2) API síncrona (para Streamlit) ------------------------------------
+    def run(self, coro):
+        """
+        Ejecuta en el loop del backend una corrutina del llamador (p. ej. un
+        lote que combina varias `acomplete`) y devuelve su resultado.
+        """
+        return self._run(coro)
+
+    def complete(self, messages: list[dict], model: str, **kwargs) -> str:
+        return self._run(self.acomplete(messages, model, **kwargs))
+
+    def complete_many(self, requests: list[list[dict]], model: str, **kwargs) -> list[str]:
+        return self._run(self.acomplete_many(requests, model, **kwargs))
+
+    def stream(self, messages: list[dict], model: str, **kwargs):
+        """
+        Generador síncrono de tokens: el stream corre en el loop de fondo y
+        los tokens llegan por una cola. Si el consumidor deja de iterar, la
+        petición se cancela.
+        """
+        tokens = queue.Queue()
+
+        async def _pump():
+            try:
+                async for tok in self.astream(messages, model, **kwargs):
+                    tokens.put(tok)
+            except BaseException as exc:  # incluye la cancelación
+                tokens.put(exc)
+            finally:
+                tokens.put(_DONE)
+
+        future = asyncio.run_coroutine_threadsafe(_pump(), self._loop)
+        try:
+            while (item := tokens.get()) is not _DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def astream_threadsafe(self, messages: list[dict], model: str, **kwargs):
+        """
+        Como `stream`, pero para consumir desde otro event loop (p. ej. el de
+        api_server.py) sin bloquearlo: el stream corre en el loop del backend
+        y cada token se entrega al loop del consumidor.
+        """
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+
+        async def _pump():
+            try:
+                async for tok in self.astream(messages, model, **kwargs):
+                    loop.call_soon_threadsafe(tokens.put_nowait, tok)
+            except BaseException as exc:  # incluye la cancelación
+                loop.call_soon_threadsafe(tokens.put_nowait, exc)
+            finally:
+                loop.call_soon_threadsafe(tokens.put_nowait, _DONE)
+
+        future = asyncio.run_coroutine_threadsafe(_pump(), self._loop)
+        try:
+            while (item := await tokens.get()) is not _DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Instancias por proceso
+# ───────────────────────────────────────────────────────────────────────────────
+_backends: dict = {}
+_backends_lock = threading.Lock()
+
+
+def get_llm_backend(api_key: str, base_url: str = None, **kwargs) -> LLMBackend:
+    """
+    Devuelve el backend compartido para (api_key, base_url), creándolo la
+    primera vez. Los `kwargs` solo se aplican en la creación.
+    """
+    key = (api_key, base_url)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = LLMBackend(api_key, base_url=base_url, **kwargs)
+        return backend
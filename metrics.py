@@ -0,0 +1,250 @@
+"""
+metrics.py
+
+Instrumentación de latencia por turno de chat:
+
+  - `TurnTimer` mide cada etapa de un turno (`with timer.stage("embed"):`).
+    Mientras está activo (`start_turn`), el código de otros módulos puede
+    medir sub-etapas con `stage(...)` sin recibir el timer como argumento
+    (p. ej. la carga del vectorstore); fuera de un turno, `stage` no hace nada.
+  - `MetricsRegistry` acumula histogramas por etapa, TTFT y tokens/s, y los
+    expone en formato de texto de Prometheus (`to_prometheus`), opcionalmente
+    por HTTP en METRICS_PORT.
+  - Cada turno terminado puede añadirse como una línea a un JSONL
+    (METRICS_JSONL) para analizarlo después.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "estrategia"
+DEFAULT_METRICS_HOST = "127.0.0.1"   # /metrics sin autenticación: solo localhost salvo METRICS_HOST
+# Límites superiores (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 120, 200)
+
+_current = contextvars.ContextVar("turn_timer", default=None)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Medición de un turno
+# ───────────────────────────────────────────────────────────────────────────────
+class TurnTimer:
+    """
+    Duración de cada etapa de un turno, en el orden en que ocurren. Una
+    etapa repetida acumula su tiempo.
+    """
+    def __init__(self):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = {}
+        self.values = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def set(self, name: str, value):
+        """
+        Valor adicional del turno (TTFT, tokens/s, modo, acierto de caché...).
+        """
+        self.values[name] = value
+
+    def record(self) -> dict:
+        return {
+            "turn_id": self.turn_id,
+            "ts": self.started,
+            "total_s": time.perf_counter() - self._t0,
+            "stages": dict(self.stages),
+            **self.values,
+        }
+
+
+def start_turn() -> TurnTimer:
+    """
+    Crea un TurnTimer y lo deja activo para `stage(...)` en este contexto.
+    """
+    timer = TurnTimer()
+    _current.set(timer)
+    return timer
+
+
+def current_turn() -> TurnTimer | None:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Mide `name` en el turno activo, si lo hay.
+    """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Agregados y exportación
+# ───────────────────────────────────────────────────────────────────────────────
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Histogramas de etapas, TTFT y tokens/s de todos los turnos del proceso.
+
+    Args:
+      jsonl_path: si se indica, cada turno se añade como una línea JSON.
+    """
+    def __init__(self, jsonl_path: str = None):
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._ttft = _Histogram(LATENCY_BUCKETS)
+        self._rate = _Histogram(RATE_BUCKETS)
+        self._turns = {}
+        self.last = None
+
+    def observe_turn(self, record: dict):
+        """
+        Incorpora el registro de un turno (`TurnTimer.record()`).
+        """
+        with self._lock:
+            for name, seconds in list(record["stages"].items()) + [("total", record["total_s"])]:
+                self._stages.setdefault(name, _Histogram(LATENCY_BUCKETS)).observe(seconds)
+            if record.get("ttft_s") is not None:
+                self._ttft.observe(record["ttft_s"])
+            if record.get("tokens_per_s"):
+                self._rate.observe(record["tokens_per_s"])
+            key = (record.get("mode", "chat"), str(bool(record.get("cached", False))).lower())
+            self._turns[key] = self._turns.get(key, 0) + 1
+            self.last = record
+        if self.jsonl_path:
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            try:
+                os.makedirs(os.path.dirname(self.jsonl_path) or ".", exist_ok=True)
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                logger.exception("No se pudo escribir la métrica en %s", self.jsonl_path)
+
+    def to_prometheus(self) -> str:
+        """
+        Métricas en el formato de texto de Prometheus.
+        """
+        lines = []
+
+        def histogram(name, hist, labels="", help_text=""):
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {hist.count}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {hist.sum:.6f}")
+            lines.append(f"{name}_count{suffix} {hist.count}")
+
+        with self._lock:
+            name = f"{METRIC_PREFIX}_stage_seconds"
+            lines.append(f"# HELP {name} Duración de cada etapa de un turno de chat")
+            lines.append(f"# TYPE {name} histogram")
+            for stage_name, hist in sorted(self._stages.items()):
+                histogram(name, hist, labels=f'stage="{stage_name}"')
+            histogram(f"{METRIC_PREFIX}_ttft_seconds", self._ttft,
+                      help_text="Tiempo hasta el primer token del LLM")
+            histogram(f"{METRIC_PREFIX}_tokens_per_second", self._rate,
+                      help_text="Velocidad de streaming de la respuesta")
+            name = f"{METRIC_PREFIX}_turns_total"
+            lines.append(f"# HELP {name} Turnos de chat atendidos")
+            lines.append(f"# TYPE {name} counter")
+            for (mode, cached), count in sorted(self._turns.items()):
+                lines.append(f'{name}{{mode="{mode}",cached="{cached}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(registry: MetricsRegistry, port: int, host: str = DEFAULT_METRICS_HOST):
+    """
+    Sirve `registry.to_prometheus()` en http://host:port/metrics en un hilo.
+    Por defecto solo en localhost: el endpoint no tiene autenticación, así
+    que escuchar en otras interfaces debe pedirse explícitamente.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    logger.info("Métricas Prometheus en http://%s:%d/metrics", host, port)
+    return server
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Registro único del proceso. METRICS_JSONL activa el volcado de cada
+    turno a ese archivo; METRICS_PORT, el endpoint /metrics de Prometheus
+    (en localhost, o en METRICS_HOST si se define, p. ej. 0.0.0.0).
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry(jsonl_path=os.getenv("METRICS_JSONL") or None)
+            port = os.getenv("METRICS_PORT")
+            if port:
+                try:
+                    start_metrics_server(_registry, int(port),
+                                         host=os.getenv("METRICS_HOST") or DEFAULT_METRICS_HOST)
+                except OSError:
+                    logger.exception("No se pudo abrir el puerto de métricas %s", port)
+        return _registry
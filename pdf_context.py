@@ -0,0 +1,105 @@
+"""
+pdf_context.py
+
+Contexto a partir de PDFs subidos por el usuario:
+
+  1) La extracción de texto (PyPDF2) y la fragmentación se hacen una sola vez
+     por hash del archivo, en un worker de fondo que arranca en cuanto se
+     sube el PDF; el resultado se comparte entre reruns y sesiones.
+  2) Los fragmentos se embeben en un índice FAISS efímero por sesión.
+  3) En cada pregunta solo los k pasajes más relevantes van al prompt, en
+     lugar del documento completo.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+MAX_CACHED_FILES = 32
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdf-extract")
+_extractions = OrderedDict()   # hash → Future[list[str]]
+_extractions_lock = threading.Lock()
+
+
+def file_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Extracción en segundo plano
+# ───────────────────────────────────────────────────────────────────────────────
+def extract_chunks(data: bytes) -> list[str]:
+    """
+    Extrae el texto de cada página y lo divide en fragmentos.
+    """
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return [c for c in splitter.split_text(text) if c.strip()]
+
+
+def submit_extraction(data: bytes) -> tuple[str, Future]:
+    """
+    Lanza (o reutiliza) la extracción del PDF y devuelve (hash, future).
+    Llamarlo en cada rerun es barato: solo la primera vez se encola trabajo.
+    """
+    digest = file_digest(data)
+    with _extractions_lock:
+        future = _extractions.get(digest)
+        if future is None or (future.done() and future.exception() is not None):
+            future = _executor.submit(extract_chunks, data)
+            _extractions[digest] = future
+        _extractions.move_to_end(digest)
+        while len(_extractions) > MAX_CACHED_FILES:
+            _extractions.popitem(last=False)
+    return digest, future
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Índice efímero por sesión
+# ───────────────────────────────────────────────────────────────────────────────
+class PdfIndex:
+    """
+    Índice FAISS en memoria sobre los fragmentos de un PDF.
+    """
+    def __init__(self, digest: str, chunks: list[str], embedding_model):
+        self.digest = digest
+        self.num_chunks = len(chunks)
+        self.store = FAISS.from_texts(chunks, embedding_model) if chunks else None
+
+    def passages(self, query_vector, k: int = 4) -> list[str]:
+        """
+        Pasajes más relevantes para el vector de la pregunta, de más a menos
+        relevante (para `context_assembler.ranked`).
+        """
+        if self.store is None:
+            return []
+        docs = self.store.similarity_search_by_vector(query_vector, k=min(k, self.num_chunks))
+        return [d.page_content for d in docs]
+
+
+def get_pdf_index(session_state, data: bytes, embedding_model, timeout: float = None) -> PdfIndex:
+    """
+    Devuelve el PdfIndex de la sesión para `data`, construyéndolo si hace
+    falta (espera a la extracción de fondo como mucho `timeout` segundos).
+    Solo se conserva el índice del último PDF de la sesión.
+    """
+    digest, future = submit_extraction(data)
+    index = session_state.get("pdf_index")
+    if index is None or index.digest != digest:
+        index = PdfIndex(digest, future.result(timeout=timeout), embedding_model)
+        session_state["pdf_index"] = index
+    return index
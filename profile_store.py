@@ -0,0 +1,205 @@
+"""
+profile_store.py
+
+Almacén de perfiles (encuestas) indexado por email del usuario.
+
+  - data/surveys.jsonl: registro append-only, una encuesta por línea. Las
+    nuevas encuestas se añaden al final; la más reciente de cada usuario gana.
+  - data/surveys.json: formato heredado (lista JSON), se sigue leyendo como
+    base para no perder los perfiles existentes.
+
+El índice email → perfil vive en memoria y se valida con mtime/tamaño de los
+archivos en cada acceso. Como el JSONL solo crece, cuando cambia se leen
+únicamente los bytes nuevos: el coste de una consulta no depende del número
+de usuarios.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import hmac
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_JSONL_PATH = os.path.join(DATA_DIR, "surveys.jsonl")
+DEFAULT_LEGACY_PATH = os.path.join(DATA_DIR, "surveys.json")
+
+
+def _stat(path: str):
+    try:
+        st_ = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st_.st_mtime_ns, st_.st_size
+
+
+def user_key(user: str) -> str:
+    """
+    Email normalizado (sin espacios, en minúsculas): clave del índice y del
+    token personal.
+    """
+    return user.strip().lower()
+
+
+def user_link_token(user: str, secret: str = None) -> str:
+    """
+    Token personal de `user` (enlaces `?user=<email>&token=<token>` de la app
+    y cabecera X-User-Token de la API): HMAC-SHA256 del email con el secreto
+    USER_LINK_SECRET.
+
+    Raises:
+      ValueError: si no hay secreto configurado.
+    """
+    secret = secret or os.getenv("USER_LINK_SECRET")
+    if not secret:
+        raise ValueError("Define USER_LINK_SECRET para firmar enlaces de usuario")
+    return hmac.new(secret.encode("utf-8"), user_key(user).encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) Almacén
+# ───────────────────────────────────────────────────────────────────────────────
+class ProfileStore:
+    """
+    Índice en memoria de las encuestas, sincronizado con disco por mtime.
+    """
+    def __init__(self, jsonl_path: str = DEFAULT_JSONL_PATH,
+                 legacy_path: str = DEFAULT_LEGACY_PATH):
+        self.jsonl_path = jsonl_path
+        self.legacy_path = legacy_path
+        self._lock = threading.Lock()
+        self._by_user = {}
+        self._legacy_stamp = None
+        self._jsonl_stamp = None
+        self._jsonl_offset = 0
+
+    # 2.1) Sincronización --------------------------------------------------
+    @staticmethod
+    def _index(by_user: dict, record: dict):
+        if isinstance(record, dict) and record.get("user"):
+            by_user[user_key(record["user"])] = record
+
+    def _reload_all(self):
+        """
+        Relee ambos archivos en un índice nuevo y lo publica de una vez:
+        mientras tanto las consultas siguen viendo el anterior, completo.
+        """
+        by_user = {}
+        legacy_stamp = _stat(self.legacy_path)
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                surveys = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            surveys = []
+        if isinstance(surveys, list):
+            for record in surveys:
+                self._index(by_user, record)
+        jsonl_stamp, offset = self._read_jsonl_tail(by_user, 0)
+        self._by_user = by_user
+        self._jsonl_offset = offset
+        self._legacy_stamp = legacy_stamp
+        self._jsonl_stamp = jsonl_stamp
+
+    def _read_jsonl_tail(self, by_user: dict, offset: int) -> tuple:
+        """
+        Indexa en `by_user` las líneas del JSONL desde `offset`. Devuelve la
+        huella del archivo y el offset nuevo.
+        """
+        # Huella tomada antes de leer: si llegan líneas durante la lectura,
+        # la próxima sincronización verá un cambio y las leerá.
+        stamp = _stat(self.jsonl_path)
+        try:
+            f = open(self.jsonl_path, "rb")
+        except FileNotFoundError:
+            return stamp, offset
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # línea a medio escribir: se leerá en la próxima
+                offset += len(line)
+                try:
+                    self._index(by_user, json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("Línea inválida en %s", self.jsonl_path)
+        return stamp, offset
+
+    def _sync(self):
+        """
+        Actualiza el índice si algún archivo cambió desde la última lectura.
+        Las huellas se publican después del índice: quien las vea al día ve
+        también el índice completo.
+        """
+        legacy_stamp = _stat(self.legacy_path)
+        jsonl_stamp = _stat(self.jsonl_path)
+        if legacy_stamp == self._legacy_stamp and jsonl_stamp == self._jsonl_stamp:
+            return
+        with self._lock:
+            if legacy_stamp != self._legacy_stamp:
+                self._reload_all()
+            elif jsonl_stamp is None or jsonl_stamp[1] < self._jsonl_offset:
+                # El JSONL se borró o truncó: no es append-only, releer todo
+                self._reload_all()
+            else:
+                # Cada registro nuevo entra con una sola asignación: el índice
+                # publicado nunca queda a medias
+                stamp, offset = self._read_jsonl_tail(self._by_user, self._jsonl_offset)
+                self._jsonl_offset = offset
+                self._jsonl_stamp = stamp
+
+    # 2.2) Consultas -------------------------------------------------------
+    def get(self, user: str) -> dict:
+        """
+        Última encuesta de `user` (copia) o diccionario vacío.
+        """
+        self._sync()
+        record = self._by_user.get(user_key(user)) if user else None
+        return dict(record) if record else {}
+
+    def users(self) -> list[str]:
+        self._sync()
+        return list(self._by_user)
+
+    def all_profiles(self) -> dict:
+        """
+        {usuario: última encuesta} de todos los usuarios.
+        """
+        self._sync()
+        return {user: dict(record) for user, record in self._by_user.items()}
+
+    # 2.3) Escritura -------------------------------------------------------
+    def append(self, record: dict):
+        """
+        Añade una encuesta al final del JSONL (una sola escritura con
+        O_APPEND, segura entre procesos para líneas de tamaño normal).
+        """
+        if not record.get("user"):
+            raise ValueError("La encuesta necesita el campo 'user' (email)")
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        os.makedirs(os.path.dirname(self.jsonl_path) or ".", exist_ok=True)
+        fd = os.open(self.jsonl_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store() -> ProfileStore:
+    """
+    Instancia única del almacén para todo el proceso.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProfileStore()
+        return _store
@@ -0,0 +1,60 @@
+"""
+quick_prompts.py
+
+Prompts de la generación rápida (guion, calendario, ideas), compartidos por
+las LLMChains de app.py y el generador por lotes (batch_generate.py).
+
+Cada prompt de sistema empieza por las instrucciones fijas del modo y
+termina con los datos del perfil: así las peticiones de un mismo modo
+comparten el prefijo, que el proveedor puede reutilizar entre peticiones
+(prompt caching).
+"""
+
+QUICK_MODES = ("guion", "calendario", "ideas")
+MISSING_FIELD = "(sin especificar)"
+
+QUICK_PROMPTS = {
+    "guion": (
+        "Eres un guionista experto en marketing digital para PYMEs.\n"
+        "Estructura del guion de video:\n"
+        "1. Intro/Hook\n"
+        "2. Problema\n"
+        "3. Pasos con ejemplos\n"
+        "4. Conclusión y CTA\n"
+        "Perfil: {nombreNegocio}, producto estrella: {productoEstrella}, público: {publicoObjetivo}."
+    ),
+    "calendario": (
+        "Eres un planificador de contenido para PYMEs.\n"
+        "Calendario de 7 días con:\n"
+        "- Fecha (YYYY-MM-DD)\n- Plataforma\n- Tipo de contenido\n- CTA\n- Hora\n"
+        "Perfil: {nombreNegocio}, contenido: {tipoContenidoMarca}, frecuencia: {frecuenciaPublicacion}."
+    ),
+    "ideas": (
+        "Eres un creativo digital para PYMEs.\n"
+        "Sugiere 5 ideas de publicaciones:\n"
+        "- How-to\n- Listas\n- Preguntas abiertas\n- UGC\n- Citas motivacionales\n"
+        "Perfil: {nombreNegocio}, público: {publicoObjetivo}."
+    ),
+}
+
+
+class _ProfileFields(dict):
+    def __missing__(self, key):
+        return MISSING_FIELD
+
+
+def quick_messages(mode: str, profile: dict, user_input: str) -> list[dict]:
+    """
+    Mensajes de chat del modo `mode` para `profile`; los campos del perfil
+    que falten se rellenan con MISSING_FIELD.
+
+    Raises:
+      ValueError: si `mode` no es un modo de generación rápida.
+    """
+    if mode not in QUICK_PROMPTS:
+        raise ValueError(f"Modo desconocido: {mode!r} (usa {', '.join(QUICK_MODES)})")
+    fields = _ProfileFields({k: v for k, v in profile.items() if v not in (None, "")})
+    return [
+        {"role": "system", "content": QUICK_PROMPTS[mode].format_map(fields)},
+        {"role": "user", "content": user_input},
+    ]
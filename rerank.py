@@ -0,0 +1,298 @@
+"""
+rerank.py
+
+Etapa opcional tras la recuperación: de `fetch_k` candidatos (p. ej. 50)
+elige los k pasajes que van al prompt, en lugar de quedarse con los k
+primeros, que a menudo son fragmentos solapados del mismo capítulo:
+
+  1) Cross-encoder local en CPU (fastembed `TextCrossEncoder`, ONNX),
+     opcional: puntúa cada par (pregunta, pasaje) y sustituye al orden de la
+     recuperación (densa + BM25) como relevancia.
+  2) MMR vectorizado con los vectores guardados en el índice FAISS: en cada
+     paso elige el candidato con mejor relevancia menos su parecido con lo
+     ya elegido, así los fragmentos casi idénticos no ocupan varios huecos.
+     La relevancia se lleva al rango de similitudes coseno de los
+     candidatos con la consulta, para que λ pese igual en ambos términos.
+  3) Presupuesto de tiempo: la etapa no espera más de `budget_ms`. Si el
+     cross-encoder no termina a tiempo (se le reserva parte del presupuesto
+     para MMR) se sigue solo con MMR, y si el presupuesto se agota antes de
+     reordenar se devuelve el top-k sin reordenar.
+"""
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 1) Imports
+# ───────────────────────────────────────────────────────────────────────────────
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FETCH_K = 50
+DEFAULT_MMR_LAMBDA = 0.8       # 1 = solo relevancia, 0 = solo diversidad
+DEFAULT_BUDGET_MS = 150.0
+DEFAULT_CROSS_ENCODER = "Xenova/ms-marco-MiniLM-L-6-v2"
+MMR_RESERVE = 0.2              # fracción del presupuesto que el cross-encoder deja a MMR
+
+# Un hilo basta: las inferencias del cross-encoder ya usan los núcleos de ONNX.
+# Mientras una sigue en curso (aunque ya nadie la espere) las nuevas consultas
+# no ponen otra en cola, así una inferencia lenta no retrasa a las siguientes.
+_rerank_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+_cross_slot = threading.Semaphore(1)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 2) MMR
+# ───────────────────────────────────────────────────────────────────────────────
+def cosine_to_query(query_vector, vectors: np.ndarray) -> np.ndarray:
+    """
+    Similitud coseno entre la consulta y cada fila de `vectors`.
+    """
+    q = np.asarray(query_vector, dtype="float32").ravel()
+    q = q / (np.linalg.norm(q) or 1.0)
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    return (vectors @ q) / norms
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int,
+               lambda_mult: float = DEFAULT_MMR_LAMBDA) -> np.ndarray:
+    """
+    Maximal Marginal Relevance: posiciones de los `k` candidatos elegidos,
+    en orden de elección.
+
+    La matriz de similitudes entre candidatos se calcula una vez; cada paso
+    solo actualiza con `np.maximum` el parecido máximo de cada candidato con
+    lo ya elegido (O(k·n) tras el producto n×n).
+
+    Args:
+      relevance: relevancia de cada candidato, en la escala del coseno
+                 (orden de la recuperación o puntuación del cross-encoder).
+      vectors: matriz (n, d) de los candidatos.
+      k: candidatos a elegir.
+      lambda_mult: peso de la relevancia frente a la diversidad.
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype="int64")
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = unit @ unit.T
+    redundancy = np.full(n, -1.0, dtype="float32")
+    chosen = np.zeros(n, dtype=bool)
+    selected = np.empty(k, dtype="int64")
+    for step in range(k):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[chosen] = -np.inf
+        j = int(np.argmax(scores))
+        selected[step] = j
+        chosen[j] = True
+        np.maximum(redundancy, similarity[j], out=redundancy)
+    return selected
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Cross-encoder (opcional)
+# ───────────────────────────────────────────────────────────────────────────────
+class CrossEncoderScorer:
+    """
+    Cross-encoder local (fastembed, ONNX Runtime en CPU). El modelo se
+    descarga la primera vez a `cache_dir` y después funciona sin red.
+
+    Cualquier objeto con `.score(query, texts) -> array` sirve igual como
+    `cross_encoder` de `Reranker`.
+
+    Args:
+      model_name: modelo soportado por `TextCrossEncoder`. El de por defecto
+                  es pequeño (MiniLM-L6) para caber en el presupuesto con
+                  unas decenas de pasajes.
+      cache_dir: carpeta de los modelos (por defecto la de fastembed).
+      threads: hilos de ONNX (None: los de ONNX Runtime).
+    """
+    def __init__(self, model_name: str = DEFAULT_CROSS_ENCODER, cache_dir: str = None,
+                 threads: int = None):
+        from fastembed.rerank.cross_encoder import TextCrossEncoder
+
+        self.model = model_name
+        self._model = TextCrossEncoder(model_name=model_name, cache_dir=cache_dir, threads=threads)
+
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        scores = self._model.rerank(query, texts, batch_size=max(1, len(texts)))
+        return np.fromiter(scores, dtype="float32", count=len(texts))
+
+
+_cross_encoders: dict = {}
+_cross_encoders_lock = threading.Lock()
+
+
+def get_cross_encoder(model_name: str = DEFAULT_CROSS_ENCODER, **kwargs) -> CrossEncoderScorer:
+    """
+    Cross-encoder compartido del proceso para `model_name`, cargado la
+    primera vez. Los `kwargs` solo se aplican en la creación.
+    """
+    with _cross_encoders_lock:
+        scorer = _cross_encoders.get(model_name)
+        if scorer is None:
+            scorer = _cross_encoders[model_name] = CrossEncoderScorer(model_name, **kwargs)
+        return scorer
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 4) Etapa de reordenación
+# ───────────────────────────────────────────────────────────────────────────────
+class Reranker:
+    """
+    Reordena los candidatos de la recuperación dentro de un presupuesto.
+
+    Args:
+      fetch_k: candidatos que pide la recuperación antes de reordenar.
+      mmr_lambda: peso de la relevancia en MMR (None: sin MMR).
+      cross_encoder: objeto con `.score(query, texts)` (p. ej.
+                     `get_cross_encoder()`), o None.
+      budget_ms: tiempo máximo de la etapa.
+    """
+    def __init__(self, fetch_k: int = DEFAULT_FETCH_K, mmr_lambda: float | None = DEFAULT_MMR_LAMBDA,
+                 cross_encoder=None, budget_ms: float = DEFAULT_BUDGET_MS):
+        self.fetch_k = fetch_k
+        self.mmr_lambda = mmr_lambda
+        self.cross_encoder = cross_encoder
+        self.budget_ms = budget_ms
+        # Contadores de la instancia; `make_reranker` comparte una por
+        # configuración, así que reflejan todo el proceso
+        self.calls = 0
+        self.fallbacks = 0
+        self._counter_lock = threading.Lock()
+
+    def rerank(self, query: str, query_vector, ids, k: int, vectors, texts) -> np.ndarray:
+        """
+        Los `k` mejores de `ids` (candidatos ordenados por la recuperación).
+
+        Args:
+          query, query_vector: la consulta y su embedding.
+          ids: ids del índice de los candidatos, de mejor a peor.
+          k: ids a devolver.
+          vectors: función ids → matriz (n, d) de sus vectores (None si el
+                   índice no permite reconstruirlos).
+          texts: función ids → textos (solo se llama con cross-encoder).
+
+        Returns:
+          np.ndarray: ids elegidos; el top-k de `ids` si se agota el presupuesto.
+        """
+        with self._counter_lock:
+            self.calls += 1
+        ids = np.asarray(ids, dtype="int64")
+        if len(ids) <= 1:
+            return ids[:k]
+        deadline = time.perf_counter() + self.budget_ms / 1000.0
+
+        scores = None
+        if self.cross_encoder is not None:
+            reserve = MMR_RESERVE * self.budget_ms / 1000.0 if self.mmr_lambda is not None else 0.0
+            scores = self._cross_scores(query, ids, texts, deadline - reserve)
+        if time.perf_counter() > deadline:
+            return self._fallback(ids, k, "presupuesto agotado")
+
+        if self.mmr_lambda is None:
+            if scores is None:
+                return self._fallback(ids, k, "sin puntuaciones del cross-encoder")
+            return ids[np.argsort(-scores, kind="stable")[:k]]
+        matrix = vectors(ids)
+        if matrix is None:
+            if scores is None:
+                return self._fallback(ids, k, "sin vectores en el índice")
+            return ids[np.argsort(-scores, kind="stable")[:k]]
+
+        # Sin cross-encoder la relevancia es el orden de la recuperación: el
+        # coseno solo reflejaría la parte densa y desharía la fusión con BM25
+        if scores is None:
+            scores = -np.arange(len(ids), dtype="float32")
+        cosine = cosine_to_query(query_vector, matrix)
+        lo, hi = float(cosine.min()), float(cosine.max())
+        spread = float(scores.max() - scores.min()) or 1.0
+        relevance = lo + (scores - scores.min()) / spread * (hi - lo)
+        with stage("rerank.mmr"):
+            return ids[mmr_select(relevance, matrix, k, self.mmr_lambda)]
+
+    def _cross_scores(self, query: str, ids: np.ndarray, texts, deadline: float):
+        """
+        Puntuaciones del cross-encoder, o None si no llegan antes de
+        `deadline`. La inferencia sigue en su hilo aunque no se espere.
+        """
+        if not _cross_slot.acquire(blocking=False):
+            logger.debug("Cross-encoder ocupado; se sigue sin él")
+            return None
+        with stage("rerank.cross_encoder"):
+            future = _rerank_pool.submit(lambda: self.cross_encoder.score(query, texts(ids)))
+            future.add_done_callback(lambda _: _cross_slot.release())
+            try:
+                return np.asarray(future.result(timeout=max(0.0, deadline - time.perf_counter())),
+                                  dtype="float32")
+            except FutureTimeout:
+                logger.debug("Cross-encoder fuera de presupuesto (%.0f ms); se sigue sin él", self.budget_ms)
+            except Exception as exc:
+                logger.warning("Cross-encoder falló: %s", exc)
+        return None
+
+    def _fallback(self, ids: np.ndarray, k: int, reason: str) -> np.ndarray:
+        with self._counter_lock:
+            self.fallbacks += 1
+        logger.debug("Rerank omitido (%s): top-%d sin reordenar", reason, k)
+        return ids[:k]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "fallbacks": self.fallbacks}
+
+
+_rerankers: dict = {}
+_rerankers_lock = threading.Lock()
+
+
+def make_reranker(fetch_k: int = 0, mmr_lambda: float | None = DEFAULT_MMR_LAMBDA,
+                  cross_encoder_model: str = None, budget_ms: float = DEFAULT_BUDGET_MS) -> Reranker | None:
+    """
+    Reranker compartido del proceso para la configuración (variables
+    RERANK_* de app.py y api_server.py), creado la primera vez; None si
+    `fetch_k` es 0, es decir, sin etapa.
+
+    Raises:
+      ImportError: si se pide cross-encoder y fastembed no está instalado.
+    """
+    if not fetch_k:
+        return None
+    key = (fetch_k, mmr_lambda, cross_encoder_model, budget_ms)
+    with _rerankers_lock:
+        reranker = _rerankers.get(key)
+    if reranker is None:
+        cross_encoder = get_cross_encoder(cross_encoder_model) if cross_encoder_model else None
+        with _rerankers_lock:
+            reranker = _rerankers.setdefault(key, Reranker(fetch_k=fetch_k, mmr_lambda=mmr_lambda,
+                                                           cross_encoder=cross_encoder, budget_ms=budget_ms))
+    return reranker
+
+
+def reranker_from_env() -> Reranker | None:
+    """
+    Reranker de app.py y api_server.py según el entorno:
+
+      RERANK_FETCH_K        candidatos a reordenar (vacío o 0: sin etapa)
+      RERANK_MMR_LAMBDA     peso de la relevancia en MMR ("off": sin MMR)
+      RERANK_CROSS_ENCODER  modelo de fastembed (vacío: sin cross-encoder)
+      RERANK_BUDGET_MS      presupuesto de la etapa
+
+    Raises:
+      ValueError: si algún valor no es numérico.
+      ImportError: si se pide cross-encoder y fastembed no está instalado.
+    """
+    mmr_lambda = os.getenv("RERANK_MMR_LAMBDA") or str(DEFAULT_MMR_LAMBDA)
+    return make_reranker(
+        fetch_k=int(os.getenv("RERANK_FETCH_K") or 0),
+        mmr_lambda=None if mmr_lambda.lower() == "off" else float(mmr_lambda),
+        cross_encoder_model=os.getenv("RERANK_CROSS_ENCODER") or None,
+        budget_ms=float(os.getenv("RERANK_BUDGET_MS") or DEFAULT_BUDGET_MS),
+    )
@@ -5,7 +5,7 @@ Funciones auxiliares para:
   1) Configuración de LLM y selección de modelo.
   2) Configuración de embeddings.
   3) Gestión de historial de chat y UI helpers.
-  4) Carga de usuario y perfil desde JSON.
+  4) Carga de usuario y perfil (almacén indexado por email).
 
 No modifica la lógica principal de la aplicación, solo ofrece utilidades reutilizables.
 """
@@ -14,13 +14,22 @@ No modifica la lógica principal de la aplicación, solo ofrece utilidades reuti
 # Imports
 # ───────────────────────────────────────────────────────────────────────────────
 import os
-import json
+import hmac
 import streamlit as st
 from datetime import datetime
+from typing import TYPE_CHECKING
 from streamlit.logger import get_logger
 
-from langchain_openai import ChatOpenAI
-from langchain.embeddings import OpenAIEmbeddings
+from chat_history import ChatHistory
+from profile_store import get_profile_store, user_link_token
+
+# langchain_openai, openai/httpx (llm_backend) y langchain_core (embeddings)
+# tardan en importarse: se cargan al crear el primer cliente, no al importar
+# este módulo.
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+    from embedding_cache import CachedEmbeddings
+    from llm_backend import LLMBackend
 
 logger = get_logger('Langchain-Chatbot')
 
@@ -40,6 +49,18 @@ def get_openai_api_key() -> str:
         st.stop()
 
 
+def get_openai_base_url() -> str | None:
+    """
+    URL base opcional de un servidor compatible con OpenAI
+    ([openai] base_url en secrets.toml o OPENAI_BASE_URL), p. ej. el
+    servidor falso de bench/ para pruebas locales.
+    """
+    try:
+        return st.secrets["openai"].get("base_url") or os.getenv("OPENAI_BASE_URL")
+    except (KeyError, FileNotFoundError):
+        return os.getenv("OPENAI_BASE_URL")
+
+
 def choose_model(default: str = "gpt-3.5-turbo") -> str:
     """
     Muestra un selectbox en la sidebar para elegir el modelo LLM,
@@ -53,31 +74,81 @@ def choose_model(default: str = "gpt-3.5-turbo") -> str:
     return st.sidebar.selectbox("Modelo LLM", models, index=idx)
 
 
-def configure_llm() -> ChatOpenAI:
+@st.cache_resource
+def _build_chat_llm(model_name: str, api_key: str, base_url: str | None) -> "ChatOpenAI":
     """
-    Crea y devuelve un cliente ChatOpenAI configurado para streaming,
-    usando la API Key y el modelo seleccionado en choose_model().
+    Un ChatOpenAI por (modelo, credenciales), compartido entre reruns y sesiones.
     """
-    api_key = get_openai_api_key()
-    model_name = choose_model()
+    from langchain_openai import ChatOpenAI
+
     return ChatOpenAI(
         model_name=model_name,
         temperature=0,
         streaming=True,
-        openai_api_key=api_key
+        openai_api_key=api_key,
+        openai_api_base=base_url
     )
 
 
+def configure_llm(model_name: str = None) -> "ChatOpenAI":
+    """
+    Devuelve un cliente ChatOpenAI configurado para streaming, usando la API
+    Key y `model_name` (por defecto, el seleccionado en choose_model()).
+    """
+    api_key = get_openai_api_key()
+    model_name = model_name or choose_model()
+    return _build_chat_llm(model_name, api_key, get_openai_base_url())
+
+
+def configure_llm_backend() -> "LLMBackend":
+    """
+    Backend async compartido por el proceso (pool de conexiones, límite de
+    concurrencia y reintentos); ver llm_backend.py.
+    """
+    from llm_backend import get_llm_backend
+
+    return get_llm_backend(get_openai_api_key(), base_url=get_openai_base_url())
+
+
 # ───────────────────────────────────────────────────────────────────────────────
 # 2) Configuración de embeddings
 # ───────────────────────────────────────────────────────────────────────────────
+def get_embedding_config() -> tuple[str, str | None]:
+    """
+    (backend, modelo) de embeddings: [embeddings] backend/model en
+    secrets.toml o EMBEDDING_BACKEND / EMBEDDING_MODEL. Debe coincidir con
+    el usado al construir el vectorstore.
+    """
+    from embedding_backends import DEFAULT_BACKEND
+
+    try:
+        section = st.secrets["embeddings"]
+    except (KeyError, FileNotFoundError):
+        section = {}
+    backend = section.get("backend") or os.getenv("EMBEDDING_BACKEND") or DEFAULT_BACKEND
+    model = section.get("model") or os.getenv("EMBEDDING_MODEL")
+    return backend, model
+
+
 @st.cache_resource
-def configure_embedding_model() -> OpenAIEmbeddings:
+def _build_embedding_model(backend: str, model: str | None) -> "CachedEmbeddings":
+    from embedding_backends import make_embeddings
+    from embedding_cache import CachedEmbeddings
+
+    if backend == "openai":
+        return CachedEmbeddings(make_embeddings(backend, model, api_key=get_openai_api_key(),
+                                                base_url=get_openai_base_url()))
+    return CachedEmbeddings(make_embeddings(backend, model))
+
+
+def configure_embedding_model() -> "CachedEmbeddings":
     """
-    Instancia OpenAIEmbeddings cached para evitar recargas repetidas.
+    Modelo de embeddings del backend configurado (OpenAI por defecto, o
+    fastembed local y sin red), cacheado para evitar recargas repetidas y
+    envuelto en el caché persistente de embeddings (las preguntas repetidas
+    no vuelven a calcularse). `.stats()` devuelve aciertos/fallos.
     """
-    api_key = get_openai_api_key()
-    return OpenAIEmbeddings(openai_api_key=api_key)
+    return _build_embedding_model(*get_embedding_config())
 
 
 # ───────────────────────────────────────────────────────────────────────────────
@@ -108,17 +179,18 @@ def enable_chat_history(func):
             st.session_state.css_injected = True
 
         # 2) Reset historial al navegar entre páginas
+        history = get_chat_history()
         current = func.__name__
         if st.session_state.get("current_page") != current:
             st.session_state.current_page = current
-            st.session_state.messages = []
+            history.clear()
 
         # 3) Saludo inicial si no hay mensajes
-        if not st.session_state.get("messages"):
+        if not len(history):
             profile = load_user_profile()
             audiencia = profile.get("publicoObjetivo", "tu público objetivo")
             saludo = f"¡Hola! Soy tu asistente de marketing digital para {audiencia}."
-            st.session_state.messages = [{"role": "assistant", "content": saludo}]
+            history.append("assistant", saludo)
 
         # 4) Ejecutar función original
         return func(*args, **kwargs)
@@ -126,13 +198,28 @@ def enable_chat_history(func):
     return wrapper
 
 
+def get_chat_history() -> ChatHistory:
+    """
+    Historial acotado de la sesión (ver chat_history.py), creado la primera vez.
+    """
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = ChatHistory()
+    return st.session_state.chat_history
+
+
 def display_msg(msg: str, author: str):
     """
-    Agrega un mensaje a session_state y lo muestra con st.chat_message(),
-    luego hace scroll al final.
+    Agrega un mensaje al historial de la sesión y lo muestra con st.chat_message().
     """
-    st.session_state.messages.append({"role": author, "content": msg})
+    get_chat_history().append(author, msg)
     st.chat_message(author).write(msg)
+
+
+def scroll_to_end():
+    """
+    Hace scroll al final del chat. Llamar una sola vez por rerun, tras el
+    último mensaje mostrado.
+    """
     st.markdown(
         '<div id="end"></div>'
         '<script>document.getElementById("end")'
@@ -157,37 +244,74 @@ def sync_st_session():
 
 
 # ───────────────────────────────────────────────────────────────────────────────
-# 4) Carga de usuario y perfil desde JSON
+# 4) Carga de usuario y perfil (ver profile_store.py)
 # ───────────────────────────────────────────────────────────────────────────────
-def get_current_user() -> str:
+def set_current_user(user: str):
     """
-    Retorna el campo 'user' de la última entrada en data/surveys.json,
-    o cadena vacía si no existe.
+    Fija el usuario (email) de la sesión actual.
     """
-    base = os.path.dirname(os.path.abspath(__file__))
-    path = os.path.join(base, "data", "surveys.json")
-    try:
-        surveys = json.load(open(path, "r", encoding="utf-8"))
-    except (FileNotFoundError, json.JSONDecodeError):
-        return ""
-    if not isinstance(surveys, list) or not surveys:
+    st.session_state.user = user
+
+
+def _authenticated_user() -> str:
+    """
+    Email de la identidad con la que Streamlit autenticó la sesión (`st.user`
+    con OIDC, Streamlit ≥ 1.42), o cadena vacía si no hay login.
+    """
+    user_info = getattr(st, "user", None)
+    if user_info is None or not user_info.get("is_logged_in"):
         return ""
-    return surveys[-1].get("user", "")
+    return user_info.get("email") or ""
 
 
-def load_user_profile() -> dict:
+def _user_from_link() -> str:
     """
-    Devuelve la última encuesta de data/surveys.json (sin la clave 'user'),
-    o un diccionario vacío si no existe.
+    Usuario del parámetro `?user=` de la URL, solo si viene firmado con
+    `?token=` (ver user_link_token). ALLOW_USER_QUERY_PARAM=1 acepta el
+    parámetro sin firma, solo para desarrollo local.
     """
-    base = os.path.dirname(os.path.abspath(__file__))
-    path = os.path.join(base, "data", "surveys.json")
+    user = st.query_params.get("user", "")
+    if not user or os.getenv("ALLOW_USER_QUERY_PARAM") == "1":
+        return user
     try:
-        surveys = json.load(open(path, "r", encoding="utf-8"))
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-    if not isinstance(surveys, list) or not surveys:
-        return {}
-    last = surveys[-1].copy()
-    last.pop("user", None)
-    return last
+        expected = user_link_token(user)
+    except ValueError:
+        logger.warning("Parámetro ?user= ignorado: falta USER_LINK_SECRET")
+        return ""
+    if hmac.compare_digest(st.query_params.get("token", ""), expected):
+        return user
+    logger.warning("Parámetro ?user= ignorado: token inválido")
+    return ""
+
+
+def get_current_user() -> str:
+    """
+    Retorna el usuario de la sesión: el fijado con set_current_user(), el
+    de la identidad autenticada (`st.user`) o el de un enlace firmado
+    (`?user=...&token=...`). Cadena vacía si no hay ninguno: una sesión
+    anónima no recibe el perfil de otro cliente.
+    """
+    user = st.session_state.get("user")
+    if not user:
+        user = _authenticated_user() or _user_from_link()
+        if user:
+            set_current_user(user)
+    return user or ""
+
+
+def load_user_profile(user: str = None) -> dict:
+    """
+    Devuelve la última encuesta del usuario indicado (por defecto, el de la
+    sesión) sin la clave 'user', o un diccionario vacío si no existe.
+    """
+    profile = get_profile_store().get(user or get_current_user())
+    profile.pop("user", None)
+    return profile
+
+
+def save_survey(survey: dict):
+    """
+    Registra una encuesta nueva (append-only) y la asocia a la sesión.
+    """
+    get_profile_store().append(survey)
+    set_current_user(survey["user"])
@@ -2,66 +2,227 @@
 vectorstore.py
 
 Carga y devuelve una instancia de FAISS VectorStore a partir de archivos
-preconstruidos: un índice FAISS y un pickle con el docstore y el mapeo
-index_to_docstore_id.
+preconstruidos: un índice FAISS y los textos de cada fragmento, ya sea en un
+chunk store mapeado en memoria (ver chunkstore.py) o, como formato heredado,
+en un pickle con el docstore y el mapeo index_to_docstore_id.
+
+Incluye un registro a nivel de proceso (`get_vectorstore`) que comparte el
+índice cargado entre reruns y sesiones de Streamlit, y lo recarga en caliente
+cuando cambian los archivos en disco, y un servicio de recuperación
+(`RetrievalService`) con caché de consultas, búsqueda por lotes, filtro por
+libro y búsqueda híbrida, que fusiona el índice denso con el índice BM25
+(ver bm25.py) mediante reciprocal-rank fusion.
 """
 
 # ───────────────────────────────────────────────────────────────────────────────
 # 1) Imports
 # ───────────────────────────────────────────────────────────────────────────────
 import os
+import json
+import time
 import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import faiss
+import numpy as np
 from langchain.vectorstores import FAISS
 
+from bm25 import BM25_FILES, BM25Index, has_bm25
+from embedding_backends import MANIFEST_NAME, check_compatible, embed_queries, recorded_embedding
+from metrics import stage
+from chunkstore import STORE_FILES, has_chunk_store, load_docstore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VS_SUBPATH = "book_vectorstore/vectorstores/books_faiss"
+RRF_K = 60
+QUERY_CACHE_SIZE = 4_096   # búsquedas (embedding → ids) recordadas por índice
+
+
+class UnknownSourceError(ValueError):
+    """
+    Filtro `sources` con libros que no están en el índice: error de la
+    petición, no del vectorstore.
+    """
+
 
 # ───────────────────────────────────────────────────────────────────────────────
-# 2) Función principal
+# 2) Carga desde disco
+# ───────────────────────────────────────────────────────────────────────────────
+def _resolve_vs_dir(vs_subpath: str = None) -> str:
+    """
+    Construye la ruta absoluta al directorio de vectorstore (None: el de
+    DEFAULT_VS_SUBPATH).
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, vs_subpath or DEFAULT_VS_SUBPATH)
+
+
+def _read_faiss_index(faiss_path: str, mmap: bool = False):
+    """
+    Lee un índice FAISS. Con `mmap=True` usa `faiss.IO_FLAG_MMAP` para que
+    varios procesos compartan las páginas del archivo en lugar de mantener
+    cada uno su propia copia; si el tipo de índice no lo soporta, hace una
+    lectura normal.
+    """
+    if mmap:
+        try:
+            return faiss.read_index(faiss_path, faiss.IO_FLAG_MMAP)
+        except RuntimeError as exc:
+            logger.warning("FAISS no soporta mmap para %s (%s); lectura normal.",
+                           faiss_path, exc)
+    return faiss.read_index(faiss_path)
+
+
+def _load_components(vs_dir: str, mmap: bool = False):
+    """
+    Carga (index, docstore, index_to_docstore_id) desde `vs_dir`.
+
+    Si existe un chunk store se usa (apertura instantánea, decodificación
+    perezosa); si no, se cae al pickle heredado.
+
+    Raises:
+      FileNotFoundError: si faltan los textos ('index.pkl' o chunk store)
+                         o 'index.faiss'.
+    """
+    with stage("vectorstore.texts"):
+        if has_chunk_store(vs_dir):
+            docstore, index_to_docstore_id = load_docstore(vs_dir)
+        else:
+            # Formato heredado: docstore e index_to_docstore_id desde pickle
+            pkl_path = os.path.join(vs_dir, "index.pkl")
+            if not os.path.isfile(pkl_path):
+                raise FileNotFoundError(f"No se encontró 'index.pkl' en {pkl_path}")
+            with open(pkl_path, "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+
+    # Leer y cargar el índice FAISS
+    faiss_path = os.path.join(vs_dir, "index.faiss")
+    if not os.path.isfile(faiss_path):
+        raise FileNotFoundError(f"No se encontró 'index.faiss' en {faiss_path}")
+    with stage("vectorstore.index"):
+        index = _read_faiss_index(faiss_path, mmap=mmap)
+
+    return index, docstore, index_to_docstore_id
+
+
+def _check_generation(vs_dir: str, index, index_to_docstore_id, sparse):
+    """
+    Verifica que índice, chunk store y BM25 sean de la misma construcción:
+    build_vectorstore.py publica el manifiesto el último, con el `ntotal` y
+    el `next_id` de esa construcción. Sin manifiesto (índices antiguos) no
+    se comprueba nada.
+
+    Raises:
+      ValueError: si algún archivo no cuadra con el manifiesto (publicación
+                  en curso o interrumpida).
+    """
+    try:
+        with open(os.path.join(vs_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    if "ntotal" not in manifest:
+        return
+    found = {"index.faiss": index.ntotal, "chunk store": len(index_to_docstore_id)}
+    expected = {"index.faiss": manifest["ntotal"], "chunk store": manifest.get("next_id", found["chunk store"])}
+    if sparse is not None:
+        found["BM25"], expected["BM25"] = sparse.num_docs, manifest["ntotal"]
+    wrong = [name for name in found if found[name] != expected[name]]
+    if wrong:
+        raise ValueError(f"Vectorstore de {vs_dir} a medio publicar ({', '.join(wrong)} no coincide "
+                         "con manifest.json); reintenta en unos segundos o reconstrúyelo")
+
+
+def _files_stamp(vs_dir: str) -> tuple:
+    """
+    Huella de los archivos del vectorstore: (nombre, mtime_ns, tamaño) de cada
+    archivo presente. Cambia cuando se reescribe cualquiera de ellos.
+    """
+    stamp = []
+    for name in ("index.faiss", "index.pkl", MANIFEST_NAME) + STORE_FILES + BM25_FILES:
+        try:
+            st_ = os.stat(os.path.join(vs_dir, name))
+        except FileNotFoundError:
+            continue
+        stamp.append((name, st_.st_mtime_ns, st_.st_size))
+    return tuple(stamp)
+
+
+def apply_search_params(index, nprobe: int = None, ef_search: int = None):
+    """
+    Ajusta los parámetros de búsqueda de un índice aproximado: `nprobe`
+    (listas exploradas en IVF/IVF-PQ) y `efSearch` (HNSW). Valores más altos
+    dan más recall a cambio de latencia. Se ignoran los que no aplican al
+    tipo de índice (p. ej. en un índice plano).
+    """
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            logger.debug("El índice %s no admite '%s'", type(index).__name__, name)
+
+
+def _validate_embedding_model(embedding_model):
+    """
+    Verifica que `embedding_model` exponga `embed_query`.
+    """
+    if embedding_model is None or not hasattr(embedding_model, "embed_query"):
+        raise ValueError(
+            "Se requiere un 'embedding_model' válido con el método 'embed_query'."
+        )
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 3) Función principal
 # ───────────────────────────────────────────────────────────────────────────────
 def initialize_vectorstore(
     embedding_model,
-    vs_subpath: str = "book_vectorstore/vectorstores/books_faiss"
+    vs_subpath: str = DEFAULT_VS_SUBPATH,
+    mmap: bool = False,
+    nprobe: int = None,
+    ef_search: int = None
 ) -> FAISS:
     """
     Inicializa y retorna un FAISS vectorstore listo para búsquedas.
 
+    Siempre lee desde disco; para reutilizar el índice entre reruns usa
+    `get_vectorstore`.
+
     Args:
       embedding_model: objeto con método `.embed_query` para computar embeddings.
       vs_subpath (str): ruta relativa al directorio que contiene
-                        'index.faiss' e 'index.pkl'.
+                        'index.faiss' y 'index.pkl' o un chunk store.
+      mmap (bool): si True, mapea el índice FAISS en memoria (IO_FLAG_MMAP).
+      nprobe (int): listas exploradas si el índice es IVF/IVF-PQ
+                    (None = valor guardado al construir).
+      ef_search (int): efSearch si el índice es HNSW (None = valor guardado).
 
     Returns:
       FAISS: instancia de la vectorstore configurada.
 
     Raises:
-      ValueError: si `embedding_model` es None o no tiene `embed_query`.
-      FileNotFoundError: si faltan los archivos 'index.pkl' o 'index.faiss'.
+      ValueError: si `embedding_model` es None o no tiene `embed_query`, o
+                  no es el backend/modelo con que se construyó el índice.
+      FileNotFoundError: si faltan 'index.faiss' o los textos.
     """
-    # 2.1) Construir ruta absoluta al directorio de vectorstore
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    vs_dir = os.path.join(base_dir, vs_subpath)
+    # 3.1) Construir ruta absoluta y cargar componentes
+    vs_dir = _resolve_vs_dir(vs_subpath)
+    index, docstore, index_to_docstore_id = _load_components(vs_dir, mmap=mmap)
+    apply_search_params(index, nprobe=nprobe, ef_search=ef_search)
 
-    # 2.2) Cargar docstore e index_to_docstore_id desde pickle
-    pkl_path = os.path.join(vs_dir, "index.pkl")
-    if not os.path.isfile(pkl_path):
-        raise FileNotFoundError(f"No se encontró 'index.pkl' en {pkl_path}")
-    with open(pkl_path, "rb") as f:
-        docstore, index_to_docstore_id = pickle.load(f)
+    # 3.2) Validar el modelo de embeddings (y que coincida con el del índice)
+    _validate_embedding_model(embedding_model)
+    check_compatible(recorded_embedding(vs_dir), embedding_model, index.d)
 
-    # 2.3) Leer y cargar el índice FAISS
-    faiss_path = os.path.join(vs_dir, "index.faiss")
-    if not os.path.isfile(faiss_path):
-        raise FileNotFoundError(f"No se encontró 'index.faiss' en {faiss_path}")
-    index = faiss.read_index(faiss_path)
-
-    # 2.4) Validar el modelo de embeddings
-    if embedding_model is None or not hasattr(embedding_model, "embed_query"):
-        raise ValueError(
-            "Se requiere un 'embedding_model' válido con el método 'embed_query'."
-        )
-
-    # 2.5) Crear y devolver la vectorstore FAISS
+    # 3.3) Crear y devolver la vectorstore FAISS
     #     Firma: FAISS(embedding_function, index, docstore, index_to_docstore_id)
     vectorstore = FAISS(
         embedding_function=embedding_model.embed_query,
@@ -70,3 +231,488 @@ def initialize_vectorstore(
         index_to_docstore_id=index_to_docstore_id
     )
     return vectorstore
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 4) Registro de vectorstores a nivel de proceso
+# ───────────────────────────────────────────────────────────────────────────────
+def _runs(ids: np.ndarray) -> np.ndarray:
+    """
+    Rangos [inicio, fin) de ids consecutivos, como array (m, 2).
+    """
+    ids = np.unique(np.asarray(ids, dtype="int64"))
+    if not len(ids):
+        return np.empty((0, 2), dtype="int64")
+    breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+    starts = ids[np.concatenate(([0], breaks))]
+    ends = ids[np.concatenate((breaks - 1, [len(ids) - 1]))] + 1
+    return np.stack([starts, ends], axis=1)
+
+
+def source_id_ranges(vs_dir: str, docstore, index_to_docstore_id) -> dict:
+    """
+    {libro (metadata 'source'): rangos [inicio, fin) de ids del índice}.
+
+    Se toman del manifiesto de build_vectorstore.py, que guarda los ids de
+    cada libro; sin manifiesto (índices antiguos o sintéticos), de los
+    metadatos de cada fragmento en una pasada.
+    """
+    try:
+        with open(os.path.join(vs_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            files = json.load(f).get("files") or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        files = {}
+    if files:
+        return {name: _runs([cid for _, cid in entry["chunks"]]) for name, entry in files.items()}
+
+    store = getattr(docstore, "store", None)   # ChunkDocstore: solo metadatos, sin textos
+    by_source = defaultdict(list)
+    for i in range(len(index_to_docstore_id)):
+        if store is not None:
+            metadata = store.metadata(i)
+        else:
+            doc = docstore.search(index_to_docstore_id[i])
+            if isinstance(doc, str):
+                continue
+            metadata = doc.metadata
+        by_source[metadata.get("source", "")].append(i)
+    return {source: _runs(ids) for source, ids in by_source.items()}
+
+
+class _QueryCache:
+    """
+    LRU (embedding de la consulta, k, filtro, parámetros) → ids del top-k.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(vector: np.ndarray, *extra) -> tuple:
+        return (hashlib.blake2b(vector.tobytes(), digest_size=16).digest(),) + extra
+
+    def get(self, key):
+        with self._lock:
+            ids = self._items.get(key)
+            if ids is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._items.move_to_end(key)
+            return ids
+
+    def put(self, key, ids: np.ndarray):
+        ids.flags.writeable = False   # se comparte entre llamadas
+        with self._lock:
+            self._items[key] = ids
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._items),
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+class _Entry:
+    """
+    Componentes cargados de un vectorstore junto con la huella de sus archivos.
+    Lo derivado del índice (caché de búsquedas, rangos de ids por libro) vive
+    aquí, así se descarta con la versión anterior al recargar.
+    """
+    __slots__ = ("stamp", "vs_dir", "index", "docstore", "index_to_docstore_id", "sparse", "embedding",
+                 "queries", "_source_ranges", "_selectors", "_lock")
+
+    def __init__(self, stamp, vs_dir: str, mmap: bool):
+        self.stamp = stamp
+        self.vs_dir = vs_dir
+        self.index, self.docstore, self.index_to_docstore_id = _load_components(vs_dir, mmap=mmap)
+        # El índice BM25 usa como ids las filas del chunk store
+        with stage("vectorstore.bm25"):
+            self.sparse = BM25Index(vs_dir) if has_bm25(vs_dir) and has_chunk_store(vs_dir) else None
+        _check_generation(vs_dir, self.index, self.index_to_docstore_id, self.sparse)
+        self.embedding = recorded_embedding(vs_dir)
+        self.queries = _QueryCache(QUERY_CACHE_SIZE)
+        self._source_ranges = None
+        self._selectors = {}
+        self._lock = threading.Lock()
+
+    def source_ranges(self) -> dict:
+        """
+        {libro: rangos [inicio, fin) de sus ids}, calculado al primer uso.
+        """
+        if self._source_ranges is None:
+            with self._lock:
+                if self._source_ranges is None:
+                    self._source_ranges = source_id_ranges(self.vs_dir, self.docstore, self.index_to_docstore_id)
+        return self._source_ranges
+
+    def ranges_for(self, sources: frozenset) -> np.ndarray:
+        """
+        Rangos de ids de `sources` unidos y ordenados por inicio.
+
+        Raises:
+          UnknownSourceError: si algún libro no está en el índice.
+        """
+        known = self.source_ranges()
+        unknown = sources - known.keys()
+        if unknown:
+            raise UnknownSourceError(f"Libros desconocidos en el índice: {', '.join(sorted(unknown))}")
+        ranges = np.concatenate([known[s] for s in sources]) if sources else np.empty((0, 2), dtype="int64")
+        return ranges[np.argsort(ranges[:, 0], kind="stable")]
+
+    def selector(self, sources: frozenset):
+        """
+        IDSelector de FAISS (cacheado) que admite solo los ids de `sources`.
+        """
+        sel = self._selectors.get(sources)
+        if sel is None:
+            ranges = self.ranges_for(sources)
+            if len(ranges) == 1:
+                sel = faiss.IDSelectorRange(int(ranges[0, 0]), int(ranges[0, 1]))
+            else:
+                ids = np.concatenate([np.arange(a, b, dtype="int64") for a, b in ranges]) \
+                    if len(ranges) else np.empty(0, dtype="int64")
+                sel = faiss.IDSelectorBatch(ids)
+            self._selectors[sources] = sel
+        return sel
+
+    def vectors(self, ids) -> np.ndarray | None:
+        """
+        Vectores guardados de los ids, o None si el índice no los puede
+        reconstruir. Los IVF necesitan el mapa directo id → posición, que se
+        crea al primer uso como tabla hash: tras una reconstrucción
+        incremental los ids son filas del chunk store con huecos, y el mapa
+        en array solo admite ids secuenciales.
+        """
+        ids = np.asarray(ids, dtype="int64")
+        try:
+            return self.index.reconstruct_batch(ids)
+        except RuntimeError:
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if ivf is None or ivf.direct_map.type != faiss.DirectMap.NoMap:
+                return None
+        with self._lock:
+            if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                try:
+                    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+                except RuntimeError:
+                    logger.warning("No se pudo crear el mapa directo del índice IVF de %s", self.vs_dir)
+                    return None
+        try:
+            return self.index.reconstruct_batch(ids)
+        except RuntimeError:
+            return None
+
+    def texts(self, ids) -> list[str]:
+        """
+        Textos de los ids ("" si alguno ya no está en el docstore).
+        """
+        docs = (self.docstore.search(self.index_to_docstore_id[int(i)]) for i in ids)
+        return ["" if isinstance(doc, str) else doc.page_content for doc in docs]
+
+
+_registry: dict = {}
+_registry_lock = threading.Lock()
+
+
+def get_vectorstore(
+    embedding_model,
+    vs_subpath: str = DEFAULT_VS_SUBPATH,
+    mmap: bool = False,
+    nprobe: int = None,
+    ef_search: int = None
+) -> FAISS:
+    """
+    Devuelve un FAISS vectorstore compartido por todo el proceso.
+
+    El índice y el docstore se cargan una sola vez por (ruta, mmap) y se
+    reutilizan en cada rerun y en cada sesión. En cada llamada se compara la
+    huella (mtime y tamaño) de 'index.faiss' y de los textos; si cambió, se
+    recargan desde disco (recarga en caliente). Crear el envoltorio `FAISS`
+    es barato, así cada llamada usa su propio `embedding_model`.
+
+    Args:
+      embedding_model: objeto con método `.embed_query` para computar embeddings.
+      vs_subpath (str): ruta relativa al directorio del vectorstore.
+      mmap (bool): si True, mapea el índice FAISS en memoria (IO_FLAG_MMAP).
+      nprobe (int), ef_search (int): como en `initialize_vectorstore`. El
+                    índice es compartido, así que el ajuste vale para todo
+                    el proceso.
+
+    Returns:
+      FAISS: instancia de la vectorstore configurada.
+
+    Raises:
+      ValueError: si `embedding_model` es None o no tiene `embed_query`, o
+                  no es el backend/modelo con que se construyó el índice.
+      FileNotFoundError: si faltan 'index.faiss' o los textos.
+    """
+    _validate_embedding_model(embedding_model)
+    entry = _get_entry(vs_subpath, mmap)
+    check_compatible(entry.embedding, embedding_model, entry.index.d)
+    apply_search_params(entry.index, nprobe=nprobe, ef_search=ef_search)
+    return FAISS(
+        embedding_function=embedding_model.embed_query,
+        index=entry.index,
+        docstore=entry.docstore,
+        index_to_docstore_id=entry.index_to_docstore_id
+    )
+
+
+def warm_vectorstore(vs_subpath: str = DEFAULT_VS_SUBPATH, mmap: bool = False):
+    """
+    Carga en el registro el índice, los textos y el BM25 de `vs_subpath`
+    sin necesitar el modelo de embeddings, para que la primera pregunta no
+    pague la lectura desde disco. Pensado para un hilo de arranque.
+    """
+    t0 = time.perf_counter()
+    entry = _get_entry(vs_subpath, mmap)
+    logger.info("Vectorstore precargado en %.2fs (%d vectores)", time.perf_counter() - t0, entry.index.ntotal)
+
+
+def _get_entry(vs_subpath: str, mmap: bool) -> _Entry:
+    """
+    Entrada del registro para (ruta, mmap), cargándola o recargándola si los
+    archivos en disco cambiaron.
+    """
+    vs_dir = _resolve_vs_dir(vs_subpath)
+    key = (vs_dir, mmap)
+
+    stamp = _files_stamp(vs_dir)
+    entry = _registry.get(key)
+    if entry is None or entry.stamp != stamp:
+        with _registry_lock:
+            # Re-comprobar dentro del lock: otra sesión pudo haber recargado ya
+            entry = _registry.get(key)
+            stamp = _files_stamp(vs_dir)
+            if entry is None or entry.stamp != stamp:
+                if entry is None:
+                    entry = _Entry(stamp, vs_dir, mmap)
+                    _registry[key] = entry
+                else:
+                    logger.info("Vectorstore modificado en disco; recargando %s", vs_dir)
+                    try:
+                        entry = _Entry(stamp, vs_dir, mmap)
+                        _registry[key] = entry
+                    except Exception:
+                        # Archivos a medio escribir: seguir sirviendo la versión
+                        # anterior y reintentar en la próxima llamada.
+                        logger.exception("Fallo al recargar %s; se mantiene la versión previa", vs_dir)
+    return entry
+
+
+def vectorstore_version(vs_subpath: str = DEFAULT_VS_SUBPATH) -> str:
+    """
+    Identificador de la versión en disco del vectorstore: cambia cada vez que
+    se reescribe alguno de sus archivos. Útil para invalidar cachés derivados.
+    """
+    return repr(_files_stamp(_resolve_vs_dir(vs_subpath)))
+
+
+def clear_vectorstore_cache():
+    """
+    Vacía el registro de vectorstores; la próxima llamada a `get_vectorstore`
+    volverá a leer desde disco.
+    """
+    with _registry_lock:
+        _registry.clear()
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 5) Fusión de rankings (densa + BM25)
+# ───────────────────────────────────────────────────────────────────────────────
+_search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
+
+def reciprocal_rank_fusion(rankings, k: int, rrf_k: int = RRF_K) -> list:
+    """
+    Fusiona listas de ids ordenadas: puntuación = Σ 1 / (rrf_k + rango).
+    Devuelve los k ids con mayor puntuación.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            doc_id = int(doc_id)
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+def ids_to_documents(vectorstore: FAISS, ids) -> list:
+    """
+    Convierte ids del índice en Documents del docstore.
+    """
+    docs = []
+    for i in ids:
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+        if not isinstance(doc, str):
+            docs.append(doc)
+    return docs
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# 6) Servicio de recuperación (caché, lotes y filtro por libro)
+# ───────────────────────────────────────────────────────────────────────────────
+def _search_params(index, sel):
+    """
+    SearchParameters con el selector `sel` para el tipo de `index`,
+    conservando su nprobe/efSearch actual.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=sel)
+
+
+class RetrievalService:
+    """
+    Búsqueda sobre el vectorstore compartido del proceso para la app, los
+    evaluadores por lotes y la expansión multi-consulta:
+
+      - caché LRU embedding de consulta → ids del top-k, compartido por el
+        proceso y descartado cuando el índice cambia en disco;
+      - `search_many`: embebe todas las consultas en una llamada y hace una
+        sola `index.search` sobre la matriz apilada;
+      - filtro por libro (`sources`) con los rangos de ids precalculados y un
+        IDSelector de FAISS, sin post-filtrar los resultados.
+
+    Crear el servicio es barato (el estado vive en el registro), así que se
+    puede instanciar por petición.
+
+    Args:
+      embedding_model: objeto con `.embed_query` (el modelo del índice).
+      vs_subpath, mmap, nprobe, ef_search: como en `get_vectorstore`.
+
+    Raises:
+      ValueError: si `embedding_model` no es válido.
+    """
+    def __init__(self, embedding_model, vs_subpath: str = DEFAULT_VS_SUBPATH, mmap: bool = False,
+                 nprobe: int = None, ef_search: int = None):
+        _validate_embedding_model(embedding_model)
+        self.embedding_model = embedding_model
+        self.vs_subpath = vs_subpath
+        self.mmap = mmap
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+
+    def entry(self) -> _Entry:
+        """
+        Entrada del registro, verificada contra el modelo de embeddings.
+
+        Raises:
+          ValueError: si los embeddings no son los del índice.
+          FileNotFoundError: si falta el vectorstore.
+        """
+        entry = _get_entry(self.vs_subpath, self.mmap)
+        check_compatible(entry.embedding, self.embedding_model, entry.index.d)
+        apply_search_params(entry.index, nprobe=self.nprobe, ef_search=self.ef_search)
+        return entry
+
+    def sources(self) -> list[str]:
+        """
+        Libros del índice (valores de metadata 'source').
+        """
+        return sorted(self.entry().source_ranges())
+
+    # 6.1) Ids -------------------------------------------------------------
+    def search_vectors(self, vectors, k: int = 4, sources=None) -> list[np.ndarray]:
+        """
+        Ids del top-k de cada vector, de mejor a peor. Los vectores que no
+        están en el caché se buscan juntos en una sola `index.search`.
+
+        Args:
+          vectors: lista o matriz (n, d) de embeddings de consulta.
+          k: vecinos por consulta.
+          sources: libros a los que restringir la búsqueda (None: todos).
+
+        Raises:
+          ValueError: si algún libro de `sources` no está en el índice.
+        """
+        entry = self.entry()
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype="float32").reshape(-1, entry.index.d))
+        scope = frozenset(sources) if sources is not None else None
+        params = None if scope is None else _search_params(entry.index, entry.selector(scope))
+        tag = (k, scope, self.nprobe, self.ef_search)
+
+        keys = [entry.queries.key(row, *tag) for row in matrix]
+        results = [entry.queries.get(key) for key in keys]
+        missing = [i for i, ids in enumerate(results) if ids is None]
+        if missing:
+            _, found = entry.index.search(matrix[missing], k, params=params)
+            for i, row in zip(missing, found):
+                results[i] = row[row >= 0].copy()
+                entry.queries.put(keys[i], results[i])
+        return results
+
+    def search_ids(self, query_vector, k: int = 4, sources=None) -> np.ndarray:
+        return self.search_vectors([query_vector], k, sources=sources)[0]
+
+    # 6.2) Documentos ------------------------------------------------------
+    def search(self, query: str, k: int = 4, sources=None, query_vector=None) -> list:
+        """
+        Documents de la búsqueda densa de `query` (se embebe si no se da
+        `query_vector`).
+        """
+        if query_vector is None:
+            query_vector = self.embedding_model.embed_query(query)
+        return ids_to_documents(self.entry(), self.search_ids(query_vector, k, sources=sources))
+
+    def search_many(self, queries: list[str], k: int = 4, sources=None) -> list[list]:
+        """
+        Documents de varias consultas: un solo embedding por lotes y una sola
+        búsqueda para las que no están en caché.
+        """
+        if not queries:
+            return []
+        vectors = embed_queries(self.embedding_model, list(queries))
+        entry = self.entry()
+        return [ids_to_documents(entry, ids) for ids in self.search_vectors(vectors, k, sources=sources)]
+
+    def hybrid_search(self, query: str, query_vector, k: int = 4, sources=None, fetch_k: int = 20,
+                      reranker=None) -> list:
+        """
+        Recupera `fetch_k` candidatos densos (cacheados) y `fetch_k` de BM25
+        en paralelo, ambos restringidos a `sources`, y los fusiona con RRF.
+        Sin índice BM25, equivale a la búsqueda densa. Con `reranker`
+        (rerank.Reranker) se recuperan `reranker.fetch_k` candidatos y él
+        elige los k finales.
+
+        Returns:
+          list[Document]: documentos, de más a menos relevante.
+        """
+        ids = self.hybrid_search_ids(query, query_vector, k, sources=sources, fetch_k=fetch_k, reranker=reranker)
+        return ids_to_documents(self.entry(), ids)
+
+    def hybrid_search_ids(self, query: str, query_vector, k: int = 4, sources=None, fetch_k: int = 20,
+                          reranker=None):
+        """
+        Ids de `RetrievalService.hybrid_search`, de mejor a peor.
+        """
+        entry = self.entry()
+        n = max(k, reranker.fetch_k) if reranker is not None else k
+        if entry.sparse is None:
+            ids = self.search_ids(query_vector, n, sources=sources)
+        else:
+            fetch_k = max(fetch_k, n)
+            dense = _search_pool.submit(self.search_ids, query_vector, fetch_k, sources)
+            ranges = entry.ranges_for(frozenset(sources)) if sources is not None else None
+            sparse_ids, _ = entry.sparse.search(query, k=fetch_k, id_ranges=ranges)
+            ids = reciprocal_rank_fusion([dense.result(), sparse_ids], n)
+        if reranker is not None:
+            with stage("rerank"):
+                ids = reranker.rerank(query, query_vector, ids, k, vectors=entry.vectors, texts=entry.texts)
+        return ids
+
+    def cache_stats(self) -> dict:
+        return _get_entry(self.vs_subpath, self.mmap).queries.stats()